@@ -0,0 +1,2 @@
+# Importing the analysers registers them
+from ddcheck.analysis import osinfo, top  # noqa: F401
@@ -1,13 +1,96 @@
-from ddcheck.analysis.osinfo import analyse_os_info
-from ddcheck.analysis.top import analyse_top_output
-from ddcheck.storage import AnalysisState, DdcheckMetadata
+import functools
+from pathlib import Path
+
+from ddcheck.analysis.registry import (
+    Analyser,
+    dependencies_completed,
+    get_analyser,
+    get_analysers,
+    get_dependencies,
+)
+from ddcheck.storage import AnalysisState, DdcheckMetadata, Source
+from ddcheck.storage.spans import record_span
 from ddcheck.storage.upload import write_metadata_to_disk
 
+# States of the analyses that are kept on rerun as long as their stamp is unchanged
+UP_TO_DATE_STATES = (AnalysisState.COMPLETED, AnalysisState.SKIPPED)
+
 
 def analyse_tarball(metadata: DdcheckMetadata, node: str) -> AnalysisState:
     try:
-        os_info_result = analyse_os_info(metadata, node)
-        top_result = analyse_top_output(metadata, node)
-        return top_result.max(os_info_result)
+        return _analyse_node(metadata, node)
     finally:
         write_metadata_to_disk(metadata)
+
+
+def invalidate_stale_analyses(metadata: DdcheckMetadata) -> int:
+    """
+    Clear the analyses that are out of date, so that only those are run again.
+
+    An analysis is out of date when it did not complete, when its analyser or its
+    input file changed since it ran, or when an analysis it depends on is cleared.
+
+    :param metadata: Metadata of the upload
+    :return: Number of (node, source) analyses cleared
+    """
+    extract_path = Path(metadata.extract_path)
+    dependencies = get_dependencies()
+    cleared = 0
+    for node in metadata.nodes:
+        stamps = metadata.analysis_stamps.get(node, {})
+        stale: set[Source] = set()
+        for analyser in get_analysers():
+            source = analyser.source
+            if (
+                metadata.analysis_state[node].get(source) in UP_TO_DATE_STATES
+                and stamps.get(source) == analyser.stamp(extract_path, node)
+                and not dependencies[source] & stale
+            ):
+                continue
+            stale.add(source)
+            metadata.clear_analysis(node, source, analyser.produces)
+            cleared += 1
+    return cleared
+
+
+def _analyse_node(metadata: DdcheckMetadata, node: str) -> AnalysisState:
+    for analyser in get_analysers():
+        _run_analyser(analyser, metadata, node)
+    return _node_state(metadata, node)
+
+
+def analyse_source(node_metadata: DdcheckMetadata, source: Source) -> DdcheckMetadata:
+    """
+    Analyse a source of a node, once the analyses it depends on are done.
+
+    :param node_metadata: Metadata restricted to the node, as built by extract_node
+    :param source: Source to analyse
+    :return: node_metadata, to be merged back with DdcheckMetadata.merge_analysis
+    """
+    _run_analyser(get_analyser(source), node_metadata, node_metadata.nodes[0])
+    return node_metadata
+
+
+def _run_analyser(analyser: Analyser, metadata: DdcheckMetadata, node: str) -> None:
+    state = metadata.analysis_state[node].get(
+        analyser.source, AnalysisState.NOT_STARTED
+    )
+    if state != AnalysisState.NOT_STARTED:
+        return
+    if not dependencies_completed(metadata, node, analyser.source):
+        # What it consumes is missing, e.g. the node has no os_info.txt file
+        metadata.analysis_state[node][analyser.source] = AnalysisState.SKIPPED
+    else:
+        with record_span(metadata.spans, f"{analyser.source.to_str()}.analyse", node):
+            analyser.analyse(metadata, node)
+    stamp = analyser.stamp(Path(metadata.extract_path), node)
+    metadata.analysis_stamps.setdefault(node, {})[analyser.source] = stamp
+    metadata.changed_analyses.add((node, analyser.source))
+
+
+def _node_state(metadata: DdcheckMetadata, node: str) -> AnalysisState:
+    return functools.reduce(
+        AnalysisState.max,
+        metadata.analysis_state[node].values(),
+        AnalysisState.NOT_STARTED,
+    )
@@ -0,0 +1,96 @@
+from typing import Optional
+
+import numpy as np
+
+from ddcheck.storage.series import Columns
+
+# Number of points of a chart, about the width of a chart in pixels
+CHART_POINTS = 1000
+# Number of points of the downsampled series precomputed for the charts
+CHART_LEVELS = (CHART_POINTS, 10 * CHART_POINTS)
+
+
+def downsample(columns: Columns, points: int) -> tuple[np.ndarray, Columns]:
+    """
+    Downsample series to about a number of buckets, keeping their peaks.
+
+    The samples are split into points / 2 buckets of the same size, and only the
+    samples holding the minimum or the maximum of a series in its bucket are kept.
+    The series share the kept samples, so a bucket keeps from 1 to 2 points per
+    series, a single series keeping at most the given number of points.
+
+    :param columns: Series to downsample
+    :param points: Number of points to keep per series, series with fewer samples
+        are kept as is
+    :return: Sample index of each point, and the downsampled series
+    """
+    count = columns.array.shape[1]
+    if count <= points:
+        return np.arange(count), columns
+    size = -(-count // (points // 2))
+    buckets = -(-count // size)
+    padded = np.full((len(columns), buckets * size), np.nan)
+    padded[:, :count] = columns.array
+    padded = padded.reshape(len(columns), buckets, size)
+    starts = np.arange(buckets) * size
+    lowest = np.nanargmin(padded, axis=2) + starts
+    highest = np.nanargmax(padded, axis=2) + starts
+    # Sorted, so the minimum and maximum of a bucket are kept in the order they occur
+    index = np.unique(np.concatenate([lowest.reshape(-1), highest.reshape(-1)]))
+    return index, Columns(columns.names, columns.array[:, index])
+
+
+def downsample_levels(columns: Columns) -> Columns:
+    """
+    Precompute the downsampled series of a chart at each of the CHART_LEVELS.
+
+    :param columns: Series of the chart
+    :return: Points of all levels, with a "level" row giving the number of points of
+        the level of each point and an "index" row giving its sample index
+    """
+    levels = []
+    for points in CHART_LEVELS:
+        index, downsampled = downsample(columns, points)
+        levels.append(
+            np.vstack([np.full(len(index), points), index, downsampled.array])
+        )
+    return Columns(["level", "index", *columns.names], np.hstack(levels))
+
+
+def chart_columns(
+    columns: Columns,
+    levels: Optional[Columns],
+    start: int,
+    end: int,
+    points: int = CHART_POINTS,
+) -> tuple[np.ndarray, Columns]:
+    """
+    Select the points of series to chart between two samples.
+
+    The coarsest precomputed level with at least the given number of points per
+    series in the range is used, unless it has too many of them, in which case the
+    range of the full series is downsampled instead.
+
+    :param columns: Full series
+    :param levels: Downsampled series as precomputed by downsample_levels, if any
+    :param start: Index of the first sample of the range
+    :param end: Index of the sample following the range
+    :param points: Number of points of the chart
+    :return: Sample index of each point, and the series of the chart
+    """
+    if levels is not None:
+        level, index = levels["level"], levels["index"]
+        count = max(1, columns.array.shape[1])
+        for level_points in CHART_LEVELS:
+            # Points per series of the level in the range, whatever the series share
+            series_points = min(level_points, count) * (end - start) / count
+            if not points <= series_points <= 4 * points:
+                continue
+            selected = (level == level_points) & (index >= start) & (index < end)
+            return index[selected].astype(int), Columns(
+                levels.names[2:], levels.array[2:, selected]
+            )
+    index, downsampled = downsample(
+        Columns(columns.names, columns.array[:, start:end]), points
+    )
+    return index + start, downsampled
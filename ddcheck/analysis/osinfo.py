@@ -1,8 +1,10 @@
+import io
 import logging
 import re
-from glob import glob
 from pathlib import Path
+from typing import Optional
 
+from ddcheck.analysis.registry import Analyser, register_analyser
 from ddcheck.storage import (
     AnalysisState,
     DdcheckMetadata,
@@ -10,9 +12,28 @@ from ddcheck.storage import (
     InsightQualifier,
     Source,
 )
+from ddcheck.storage.archive import find_member, open_member
+from ddcheck.storage.spans import record_span
 
 logger = logging.getLogger(__name__)
 
+OS_INFO_FILE_PATTERN = "*/node-info/{node}/os_info.txt"
+
+
+class OsInfo:
+    """Facts parsed from the os_info.txt file of a single node."""
+
+    total_memory_kb: Optional[int]
+    total_cpu_count: Optional[int]
+    online_cpus_str: str
+    total_online_cpus: int
+
+    def __init__(self) -> None:
+        self.total_memory_kb = None
+        self.total_cpu_count = None
+        self.online_cpus_str = ""
+        self.total_online_cpus = 0
+
 
 def _parse_online_cpus(online_cpus_str: str) -> list[int]:
     """Parse a CPU range string like '0-15' into a list of integers."""
@@ -48,51 +69,78 @@ def analyse_os_info(metadata: DdcheckMetadata, node: str) -> AnalysisState:
 
     # Find os_info.txt file for node
     extract_path = Path(metadata.extract_path)
-    pattern = str(extract_path / "*" / "node-info" / node / "os_info.txt")
-    matching_files = glob(pattern)
+    pattern = OS_INFO_FILE_PATTERN.format(node=node)
+    with record_span(metadata.spans, "os_info.find", node):
+        os_info_file = find_member(extract_path, pattern)
 
-    if not matching_files:
+    if os_info_file is None:
         logger.error(f"Could not find os_info.txt file for node {node} in {pattern}")
         metadata.analysis_state[node][Source.OS_INFO] = AnalysisState.SKIPPED
         return metadata.analysis_state[node][Source.OS_INFO]
 
-    os_info_file = Path(matching_files[0])
-    if not os_info_file.is_file():
-        logger.error(f"Found path is not a file: {os_info_file}")
-        metadata.analysis_state[node][Source.OS_INFO] = AnalysisState.SKIPPED
+    try:
+        with (
+            record_span(metadata.spans, "os_info.parse", node) as span,
+            io.TextIOWrapper(open_member(extract_path, os_info_file)) as f,
+        ):
+            content = f.read()
+            span.bytes_read = len(content.encode())
+            os_info = parse_os_info(content)
+    except Exception as e:
+        logger.error(f"Error reading os_info file {os_info_file}: {e}")
+        metadata.analysis_state[node][Source.OS_INFO] = AnalysisState.FAILED
         return metadata.analysis_state[node][Source.OS_INFO]
 
+    with record_span(metadata.spans, "os_info.record", node):
+        return record_os_info(metadata, node, os_info)
+
+
+def parse_os_info(content: str) -> OsInfo:
+    """
+    Parse the content of an os_info.txt file.
+
+    :param content: Content of the os_info.txt file
+    :return: Parsed OS information
+    """
+    os_info = OsInfo()
+
+    # Parse total memory
+    mem_match = re.search(r"MemTotal:\s+(\d+)\s*kB", content)
+    if mem_match:
+        os_info.total_memory_kb = int(mem_match.group(1))
+
+    # Parse total CPUs
+    cpu_match = re.search(r"CPU\(s\):\s+(\d+)", content)
+    if cpu_match:
+        os_info.total_cpu_count = int(cpu_match.group(1))
+
+    # Parse online CPUs
+    online_match = re.search(r"On-line CPU\(s\) list:\s+([0-9,-]+)", content)
+    if online_match:
+        os_info.online_cpus_str = online_match.group(1)
+        os_info.total_online_cpus = len(_parse_online_cpus(os_info.online_cpus_str))
+
+    return os_info
+
+
+def record_os_info(
+    metadata: DdcheckMetadata, node: str, os_info: OsInfo
+) -> AnalysisState:
+    """Store the parsed OS information of a node in its metadata and run the checks."""
     try:
-        with open(os_info_file) as f:
-            content = f.read()
+        if os_info.total_memory_kb is not None:
+            _record_ram(metadata, node, os_info.total_memory_kb)
+        if os_info.total_cpu_count is not None:
+            _record_total_cpu_count(metadata, node, os_info.total_cpu_count)
 
-            # Parse total memory
-            mem_match = re.search(r"MemTotal:\s+(\d+)\s*kB", content)
-            if mem_match:
-                _record_ram(metadata, node, int(mem_match.group(1)))
-
-            # Parse total CPUs
-            cpu_match = re.search(r"CPU\(s\):\s+(\d+)", content)
-            if cpu_match:
-                total_cpu_count = int(cpu_match.group(1))
-                _record_total_cpu_count(metadata, node, total_cpu_count)
-
-            # Parse online CPUs
-            online_match = re.search(r"On-line CPU\(s\) list:\s+([0-9,-]+)", content)
-            online_cpus_str = ""
-            total_online_cpus = 0
-            if online_match:
-                online_cpus_str = online_match.group(1)
-                total_online_cpus = len(_parse_online_cpus(online_cpus_str))
-
-            _check_all_cpus_are_online(
-                metadata, node, online_cpus_str, total_online_cpus
-            )
+        _check_all_cpus_are_online(
+            metadata, node, os_info.online_cpus_str, os_info.total_online_cpus
+        )
 
-            metadata.analysis_state[node][Source.OS_INFO] = AnalysisState.COMPLETED
+        metadata.analysis_state[node][Source.OS_INFO] = AnalysisState.COMPLETED
 
     except Exception as e:
-        logger.error(f"Error reading os_info file {os_info_file}: {e}")
+        logger.error(f"Error analysing os_info for node {node}: {e}")
         metadata.analysis_state[node][Source.OS_INFO] = AnalysisState.FAILED
 
     return metadata.analysis_state[node][Source.OS_INFO]
@@ -141,3 +189,16 @@ def _check_all_cpus_are_online(
                 ),
             )
         )
+
+
+register_analyser(
+    Analyser(
+        source=Source.OS_INFO,
+        file_pattern=OS_INFO_FILE_PATTERN,
+        parse=lambda content: parse_os_info(content.decode()),
+        record=record_os_info,
+        analyse=analyse_os_info,
+        produces={"total_memory_kb", "total_cpu_count"},
+        consumes=set(),
+    )
+)
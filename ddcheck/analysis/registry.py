@@ -0,0 +1,145 @@
+from fnmatch import fnmatchcase
+from graphlib import TopologicalSorter
+from pathlib import Path, PurePosixPath
+from typing import Any, Callable, Optional
+
+from ddcheck.storage import AnalysisState, DdcheckMetadata, Source
+from ddcheck.storage.archive import find_member, load_index
+
+
+class Analyser:
+    """Analysis of one file of each node, registered with register_analyser.
+
+    Facts are the per-node attributes of DdcheckMetadata, e.g. total_cpu_count. An
+    analyser only runs once the analysers producing the facts it consumes are done.
+    """
+
+    source: Source
+    # Glob pattern of the analysed file in the tarball, "{node}" being the node name
+    file_pattern: str
+    # Parses the content of the file
+    parse: Callable[[bytes], Any]
+    # Records what parse returned into the metadata of a node and runs the checks
+    record: Callable[[DdcheckMetadata, str, Any], AnalysisState]
+    # Finds, parses and records the file of a node from an existing upload
+    analyse: Callable[[DdcheckMetadata, str], AnalysisState]
+    produces: frozenset[str]
+    consumes: frozenset[str]
+    # To be increased whenever the analyser changes, e.g. with a new check, so that
+    # rerunning the analysis of an upload recomputes what this analyser produced
+    version: int
+
+    def __init__(
+        self,
+        source: Source,
+        file_pattern: str,
+        parse: Callable[[bytes], Any],
+        record: Callable[[DdcheckMetadata, str, Any], AnalysisState],
+        analyse: Callable[[DdcheckMetadata, str], AnalysisState],
+        produces: set[str],
+        consumes: set[str],
+        version: int = 1,
+    ):
+        self.source = source
+        self.file_pattern = file_pattern
+        self.parse = parse
+        self.record = record
+        self.analyse = analyse
+        self.produces = frozenset(produces)
+        self.consumes = frozenset(consumes)
+        self.version = version
+
+    def node_of(self, name: str) -> Optional[str]:
+        """
+        Find the node of a file analysed by this analyser.
+
+        :param name: Name of a file in the tarball
+        :return: Name of the node, or None if the file is not analysed by this analyser
+        """
+        parts = PurePosixPath(name).parts
+        pattern_parts = PurePosixPath(self.file_pattern).parts
+        if len(parts) != len(pattern_parts):
+            return None
+        node = None
+        for part, pattern_part in zip(parts, pattern_parts):
+            if pattern_part == "{node}":
+                node = part
+            elif not fnmatchcase(part, pattern_part):
+                return None
+        return node
+
+    def stamp(self, extract_path: Path, node: str) -> str:
+        """
+        Identify this version of the analyser and the file it analyses for a node.
+
+        The analysis of a node is up to date as long as this stamp does not change.
+        The archive of an upload is never modified once written, so the location
+        and size of the file in it identify its content.
+
+        :param extract_path: Directory of the upload
+        :param node: Node whose file is analysed
+        :return: Stamp to compare with the one recorded when the node was analysed
+        """
+        name = find_member(extract_path, self.file_pattern.format(node=node))
+        if name is None:
+            return f"v{self.version}:missing"
+        offset, size = load_index(extract_path).members[name]
+        return f"v{self.version}:{name}:{offset}:{size}"
+
+
+_ANALYSERS: dict[Source, Analyser] = {}
+
+
+def register_analyser(analyser: Analyser) -> None:
+    """Register the analyser of a source, replacing any previous one."""
+    _ANALYSERS[analyser.source] = analyser
+
+
+def get_analyser(source: Source) -> Analyser:
+    return _ANALYSERS[source]
+
+
+def get_analysers() -> list[Analyser]:
+    """Returns the registered analysers, each one after those it depends on."""
+    order = TopologicalSorter(get_dependencies()).static_order()
+    return [_ANALYSERS[source] for source in order]
+
+
+def get_dependencies() -> dict[Source, set[Source]]:
+    """
+    Build the dependency graph of the registered analysers.
+
+    :return: Sources of the analysers each source depends on, keyed by source
+    :raise ValueError: If an analyser consumes a fact that no analyser produces
+    """
+    producers = {
+        fact: analyser.source
+        for analyser in _ANALYSERS.values()
+        for fact in analyser.produces
+    }
+    dependencies = {}
+    for analyser in _ANALYSERS.values():
+        missing = analyser.consumes - producers.keys()
+        if missing:
+            raise ValueError(
+                f"No analyser produces {sorted(missing)}, needed by {analyser.source}"
+            )
+        dependencies[analyser.source] = {producers[fact] for fact in analyser.consumes}
+    return dependencies
+
+
+def dependencies_completed(
+    metadata: DdcheckMetadata, node: str, source: Source
+) -> bool:
+    """
+    Check that the facts consumed by the analyser of a source were produced.
+
+    :param metadata: Metadata of the upload
+    :param node: Node to analyse
+    :param source: Source to analyse
+    :return: True if the analyses it depends on all completed for the node
+    """
+    return all(
+        metadata.analysis_state[node].get(dependency) == AnalysisState.COMPLETED
+        for dependency in get_dependencies()[source]
+    )
@@ -0,0 +1,113 @@
+import heapq
+import re
+from typing import Iterator
+
+import numpy as np
+
+# Number of threads whose CPU usage is kept as a time series
+HOT_THREADS = 10
+
+# Row of a thread in a ttop.txt snapshot, capturing its %CPU and COMMAND, e.g.
+#  12345 dremio    20   0   40.1g  20.3g  50000 S  12.3  31.2   1:23.45 e1-1f2e3d4c
+_THREAD_ROW = re.compile(
+    rb"\n *\d+ +\S+ +\S+ +\S+ +\S+ +\S+ +\S+ +[A-Z] +([0-9.]+) +[0-9.]+ +\S+ +"
+    rb"([^\r\n]*\S)"
+)
+_SNAPSHOT_START = re.compile(rb"\ntop - ")
+# Numbers and hexadecimal identifiers that tell apart the threads of a pool
+_THREAD_NUMBER = re.compile(r"(?=[0-9a-fA-F]*\d)[0-9a-fA-F]{6,}|\d+")
+
+
+class ThreadUsage:
+    """CPU usage of the threads listed in the snapshots of a ttop.txt file.
+
+    Memory only grows with the number of distinct threads, not with the number of
+    rows: each name is stored once, and only the HOT_THREADS threads that used the
+    most CPU keep a time series.
+    """
+
+    # Name of each thread seen, rows refer to threads by their index in this list
+    names: list[str]
+    # Sum of the %CPU of each thread over all snapshots, indexed like names
+    total_cpu: np.ndarray
+    snapshot_count: int
+    # %CPU of the hottest threads in each snapshot, keyed by thread name
+    hot_threads: dict[str, np.ndarray]
+
+    def __init__(self) -> None:
+        self.names = []
+        self.total_cpu = np.zeros(0)
+        self.snapshot_count = 0
+        self.hot_threads = {}
+
+    def cpu_per_pool(self) -> dict[str, float]:
+        """Returns the sum of the %CPU of the threads of each pool, keyed by pool."""
+        pools: dict[str, float] = {}
+        for name, total_cpu in zip(self.names, self.total_cpu.tolist()):
+            pool = thread_pool(name)
+            pools[pool] = pools.get(pool, 0.0) + total_cpu
+        return pools
+
+
+def thread_pool(name: str) -> str:
+    """Returns the pool of a thread, e.g. "qtp#-#" for "qtp1234567-12"."""
+    return _THREAD_NUMBER.sub("#", name)
+
+
+def parse_thread_usage(content: bytes, hot_threads: int = HOT_THREADS) -> ThreadUsage:
+    """
+    Parse the thread rows of a ttop.txt file.
+
+    The file is read twice: once to sum the CPU usage of every thread, and once
+    to collect the time series of the hottest threads, chosen with a heap.
+
+    :param content: Content of the ttop.txt file
+    :param hot_threads: Number of threads whose time series is kept
+    :return: CPU usage of the threads
+    """
+    content = b"\n" + content
+    usage = ThreadUsage()
+    thread_ids: dict[bytes, int] = {}
+    total_cpu: np.ndarray = np.zeros(0)
+    for snapshot, (ids, cpu) in enumerate(_snapshot_rows(content, thread_ids)):
+        usage.snapshot_count = snapshot + 1
+        # Without any row, bincount returns integers
+        snapshot_cpu: np.ndarray = np.bincount(
+            ids, weights=cpu, minlength=len(thread_ids)
+        ).astype(np.float64, copy=False)
+        snapshot_cpu[: len(total_cpu)] += total_cpu
+        total_cpu = snapshot_cpu
+    usage.names = [name.decode(errors="replace") for name in thread_ids]
+    usage.total_cpu = total_cpu
+
+    hottest = heapq.nlargest(hot_threads, range(len(total_cpu)), total_cpu.__getitem__)
+    series = np.zeros((len(hottest), usage.snapshot_count), dtype=np.float32)
+    positions = np.full(len(thread_ids), -1)
+    positions[hottest] = np.arange(len(hottest))
+    for snapshot, (ids, cpu) in enumerate(_snapshot_rows(content, thread_ids)):
+        rows = positions[ids]
+        hot = rows >= 0
+        series[rows[hot], snapshot] = cpu[hot]
+    usage.hot_threads = {
+        usage.names[thread_id]: series[row] for row, thread_id in enumerate(hottest)
+    }
+    return usage
+
+
+def _snapshot_rows(
+    content: bytes, thread_ids: dict[bytes, int]
+) -> Iterator[tuple[np.ndarray, np.ndarray]]:
+    """
+    Yield the thread ids and %CPU of the rows of each snapshot, as two columns.
+
+    :param thread_ids: Id of each thread name, new names get the next free id
+    """
+    starts = [match.start() for match in _SNAPSHOT_START.finditer(content)]
+    for start, end in zip(starts, starts[1:] + [len(content)]):
+        rows = _THREAD_ROW.findall(content, start, end)
+        cpu, names = zip(*rows) if rows else ((), ())
+        for name in dict.fromkeys(names):
+            if name not in thread_ids:
+                thread_ids[name] = len(thread_ids)
+        ids = np.fromiter(map(thread_ids.__getitem__, names), np.intp, len(names))
+        yield ids, np.array(cpu, dtype=np.float32)
@@ -1,20 +1,79 @@
+import heapq
 import logging
 import re
 from datetime import datetime
-from glob import glob
 from pathlib import Path
-from typing import Dict, List
+from typing import Dict, Iterable, List, Mapping
 
+import numpy as np
+from numpy.typing import ArrayLike
+
+from ddcheck.analysis.downsample import downsample_levels
+from ddcheck.analysis.registry import Analyser, register_analyser
+from ddcheck.analysis.threads import ThreadUsage, parse_thread_usage
 from ddcheck.storage import (
     AnalysisState,
     DdcheckMetadata,
     Insight,
     InsightQualifier,
+    SeriesSummary,
     Source,
 )
+from ddcheck.storage.archive import find_member, open_member
+from ddcheck.storage.series import Columns, seconds_since_midnight
+from ddcheck.storage.spans import record_span
 
 logger = logging.getLogger(__name__)
 
+TTOP_FILE_PATTERN = "*/ttop/{node}/ttop.txt"
+
+# Records of a ttop.txt file, each matched over the whole file at once. They start
+# with a newline rather than "^" so that re can look for their literal prefix.
+_TIME_AND_LOAD_AVERAGE_RECORD = re.compile(
+    rb"\ntop - (\d{1,2}):(\d{1,2}):(\d{1,2}) .*?,  load average: "
+    rb"([0-9.]+), ([0-9.]+), ([0-9.]+)\s*$",
+    re.MULTILINE,
+)
+_CPU_KEYS = ["us", "sy", "ni", "id", "wa", "hi", "si", "st"]
+_CPU_RECORD = re.compile(
+    rb"\n%Cpu\(s\):" + rb",".join(rb"\s*([0-9.]+) " + key.encode() for key in _CPU_KEYS)
+)
+_SWAP_RECORD = re.compile(rb"\nMiB Swap:.*?\s([0-9.]+)\s*used")
+# Rows of TopOutput.cpu_usage
+_CPU_USAGE_KEYS = [*_CPU_KEYS, "total", "jpdm"]
+
+
+class TopOutput:
+    """Time series parsed from the ttop.txt file of a single node.
+
+    The series are stored in the metadata of the node as they are, so they are held
+    in the arrays the metadata stores.
+    """
+
+    # Seconds since midnight, as int32
+    times: np.ndarray
+    # float64, as all the series below
+    load_avg_1min: np.ndarray
+    load_avg_5min: np.ndarray
+    load_avg_15min: np.ndarray
+    # Values for keys us, sy, ni, id, wa, hi, si, st plus the derived total and jpdm
+    cpu_usage: Columns
+    used_swap_mb: np.ndarray
+    # Summary of each of the series above but the times, keyed by CPU usage key or
+    # by attribute name
+    summaries: Dict[str, SeriesSummary]
+    threads: ThreadUsage
+
+    def __init__(self) -> None:
+        self.times = np.zeros(0, dtype=np.int32)
+        self.load_avg_1min = np.zeros(0)
+        self.load_avg_5min = np.zeros(0)
+        self.load_avg_15min = np.zeros(0)
+        self.cpu_usage = Columns(_CPU_USAGE_KEYS, np.zeros((len(_CPU_USAGE_KEYS), 0)))
+        self.used_swap_mb = np.zeros(0)
+        self.summaries = {}
+        self.threads = ThreadUsage()
+
 
 def analyse_top_output(metadata: DdcheckMetadata, node: str) -> AnalysisState:
     # If node does not exist in metadata, log an error and mark it as skipped
@@ -35,59 +94,192 @@ def analyse_top_output(metadata: DdcheckMetadata, node: str) -> AnalysisState:
 
     # Find ttop directory for node
     extract_path = Path(metadata.extract_path)
-    pattern = str(extract_path / "*" / "ttop" / node / "ttop.txt")
-    matching_files = glob(pattern)
+    pattern = TTOP_FILE_PATTERN.format(node=node)
+    with record_span(metadata.spans, "top.find", node):
+        ttop_file = find_member(extract_path, pattern)
 
-    if not matching_files:
+    if ttop_file is None:
         logger.error(f"Could not find ttop.txt file for node {node} in {pattern}")
         metadata.analysis_state[node][Source.TOP] = AnalysisState.SKIPPED
         return metadata.analysis_state[node][Source.TOP]
 
-    ttop_file = Path(matching_files[0])
-    if not ttop_file.is_file():
-        logger.error(f"Found path is not a file: {ttop_file}")
-        metadata.analysis_state[node][Source.TOP] = AnalysisState.SKIPPED
-        return metadata.analysis_state[node][Source.TOP]
-
     try:
-        # Initialize new data collections
-        time_data: List[datetime] = []
-        load_1min: List[float] = []
-        load_5min: List[float] = []
-        load_15min: List[float] = []
-        cpu_data: Dict[str, List[float]] = {
-            "us": [],
-            "sy": [],
-            "ni": [],
-            "id": [],
-            "wa": [],
-            "hi": [],
-            "si": [],
-            "st": [],
-            "total": [],
-            "jpdm": [],
-        }
-        swap_usage: List[float] = []
-
-        with open(ttop_file) as f:
-            for line in f:
-                _maybe_parse_time_and_load_average_line(
-                    time_data, load_1min, load_5min, load_15min, line
-                )
-                _maybe_parse_cpu_line(cpu_data, line)
-                _maybe_parse_swap_line(swap_usage, line)
-
-            metadata.cpu_usage[node] = cpu_data
-            metadata.top_times[node] = time_data
-            metadata.load_avg_1min[node] = load_1min
-            metadata.load_avg_5min[node] = load_5min
-            metadata.load_avg_15min[node] = load_15min
-            metadata.analysis_state[node][Source.TOP] = AnalysisState.COMPLETED
-            metadata.total_used_swap_mb[node] = swap_usage
+        with (
+            record_span(metadata.spans, "top.parse", node) as span,
+            open_member(extract_path, ttop_file) as f,
+        ):
+            content = f.read()
+            span.bytes_read = len(content)
+            top_output = parse_top_output(content)
     except Exception as e:
         logger.exception(e)
         logger.error(f"Error reading ttop file {ttop_file}: {e}")
         metadata.analysis_state[node][Source.TOP] = AnalysisState.FAILED
+        return metadata.analysis_state[node][Source.TOP]
+
+    with record_span(metadata.spans, "top.record", node):
+        return record_top_output(metadata, node, top_output)
+
+
+def parse_top_output(content: bytes) -> TopOutput:
+    """
+    Parse a ttop.txt file into time series, all records of a kind at once.
+
+    Each kind of record is extracted from the whole file by a single regex scan and
+    converted to a NumPy column in bulk, and the derived total and JPDM columns
+    are computed on whole columns instead of line by line. The thread rows are
+    parsed by parse_thread_usage.
+
+    The CPU usage is computed in place in the rows of a single array, and the times
+    in int32 seconds since midnight, as they are stored in the metadata.
+
+    :param content: Content of the ttop.txt file
+    :return: Parsed time series, equal to what parse_top_output_lines returns apart
+        from the threads
+    """
+    top_output = TopOutput()
+    top_output.threads = parse_thread_usage(content)
+
+    content = b"\n" + content
+    times_and_loads = _columns(_TIME_AND_LOAD_AVERAGE_RECORD.findall(content), 6)
+    cpu = _columns(_CPU_RECORD.findall(content), len(_CPU_KEYS))
+    swap = _columns(_SWAP_RECORD.findall(content), 1)
+
+    top_output.times = times_and_loads[:, :3].astype(np.int32) @ np.array(
+        [3600, 60, 1], dtype=np.int32
+    )
+    loads = np.ascontiguousarray(times_and_loads[:, 3:].T)
+    top_output.load_avg_1min = loads[0]
+    top_output.load_avg_5min = loads[1]
+    top_output.load_avg_15min = loads[2]
+
+    usage = np.empty((len(_CPU_USAGE_KEYS), len(cpu)))
+    usage[: len(_CPU_KEYS)] = cpu.T
+    us, sy = usage[_CPU_KEYS.index("us")], usage[_CPU_KEYS.index("sy")]
+    np.subtract(100, usage[_CPU_KEYS.index("id")], out=usage[-2])
+    # Ratio between CPU sy and CPU us, with sy * 10 standing in for a zero us
+    with np.errstate(divide="ignore", invalid="ignore"):
+        jpdm = sy / np.where(us == 0, sy * 10, us) * 100
+    usage[-1] = np.where((us == 0) & (sy == 0), 0.0, jpdm)
+    top_output.cpu_usage = Columns(_CPU_USAGE_KEYS, usage)
+
+    top_output.used_swap_mb = swap[:, 0]
+
+    top_output.summaries = _summarise_top_output(top_output)
+    return top_output
+
+
+def _summarise_top_output(top_output: TopOutput) -> Dict[str, SeriesSummary]:
+    return summarise_series(
+        {
+            **top_output.cpu_usage,
+            "load_avg_1min": top_output.load_avg_1min,
+            "load_avg_5min": top_output.load_avg_5min,
+            "load_avg_15min": top_output.load_avg_15min,
+            "used_swap_mb": top_output.used_swap_mb,
+        }
+    )
+
+
+def _columns(records: list, count: int) -> np.ndarray:
+    """Convert the fields captured by a regex into a 2D array of floats."""
+    return np.array(records, dtype=np.float64).reshape(-1, count)
+
+
+def parse_top_output_lines(lines: Iterable[str]) -> TopOutput:
+    """
+    Parse the lines of a ttop.txt file into time series, one line at a time.
+
+    Slower than parse_top_output, this is the reference implementation it is
+    checked against. Thread rows are ignored.
+
+    :param lines: Lines of the ttop.txt file, e.g. an open text file
+    :return: Parsed time series
+    """
+    times: List[datetime] = []
+    load_avg_1min: List[float] = []
+    load_avg_5min: List[float] = []
+    load_avg_15min: List[float] = []
+    cpu_usage: Dict[str, List[float]] = {key: [] for key in _CPU_USAGE_KEYS}
+    used_swap_mb: List[float] = []
+    for line in lines:
+        _maybe_parse_time_and_load_average_line(
+            times, load_avg_1min, load_avg_5min, load_avg_15min, line
+        )
+        _maybe_parse_cpu_line(cpu_usage, line)
+        _maybe_parse_swap_line(used_swap_mb, line)
+
+    top_output = TopOutput()
+    top_output.times = seconds_since_midnight(times)
+    top_output.load_avg_1min = np.array(load_avg_1min, dtype=np.float64)
+    top_output.load_avg_5min = np.array(load_avg_5min, dtype=np.float64)
+    top_output.load_avg_15min = np.array(load_avg_15min, dtype=np.float64)
+    top_output.cpu_usage = Columns.from_dict(cpu_usage)
+    top_output.used_swap_mb = np.array(used_swap_mb, dtype=np.float64)
+    top_output.summaries = _summarise_top_output(top_output)
+    return top_output
+
+
+def summarise_series(
+    series: Mapping[str, ArrayLike],
+) -> Dict[str, SeriesSummary]:
+    """
+    Compute the statistics of time series, which the checks then read.
+
+    :param series: Values of each series, keyed by series name
+    :return: Summary of each series, keyed by series name, but for the empty series
+        which have none, e.g. the swap usage of a ttop.txt file printing it in KiB
+    """
+    summaries = {}
+    for name, values in series.items():
+        array = np.asarray(values, dtype=np.float64)
+        if not array.size:
+            logger.debug(f"No value found for {name}, not summarising it")
+            continue
+        p50, p95, p99 = np.percentile(array, [50, 95, 99]).tolist()
+        summaries[name] = SeriesSummary(
+            count=int(array.size),
+            mean=float(array.mean()),
+            min=float(array.min()),
+            max=float(array.max()),
+            stddev=float(array.std()),
+            p50=p50,
+            p95=p95,
+            p99=p99,
+        )
+    return summaries
+
+
+def record_top_output(
+    metadata: DdcheckMetadata, node: str, top_output: TopOutput
+) -> AnalysisState:
+    """Store the parsed ttop series of a node in its metadata, without copying them,
+    and run the checks."""
+    metadata.cpu_usage[node] = top_output.cpu_usage
+    metadata.top_times[node] = top_output.times
+    metadata.load_avg_1min[node] = top_output.load_avg_1min
+    metadata.load_avg_5min[node] = top_output.load_avg_5min
+    metadata.load_avg_15min[node] = top_output.load_avg_15min
+    metadata.total_used_swap_mb[node] = top_output.used_swap_mb
+    metadata.top_summaries[node] = top_output.summaries
+    threads = top_output.threads
+    # Rounding drops the float32 noise, ttop prints %CPU with a single decimal
+    metadata.hot_threads[node] = Columns.from_dict(
+        {
+            name: series.astype(np.float64).round(2)
+            for name, series in threads.hot_threads.items()
+        }
+    )
+    metadata.cpu_usage_levels[node] = downsample_levels(metadata.cpu_usage[node])
+    metadata.total_used_swap_mb_levels[node] = downsample_levels(
+        Columns(["used_swap_mb"], top_output.used_swap_mb[np.newaxis])
+    )
+    metadata.hot_threads_levels[node] = downsample_levels(metadata.hot_threads[node])
+    metadata.thread_pool_cpu[node] = {
+        pool: total_cpu / threads.snapshot_count
+        for pool, total_cpu in threads.cpu_per_pool().items()
+    }
+    metadata.analysis_state[node][Source.TOP] = AnalysisState.COMPLETED
 
     _check_cpu_wa(metadata, node)
     _check_cpu_st(metadata, node)
@@ -95,6 +287,7 @@ def analyse_top_output(metadata: DdcheckMetadata, node: str) -> AnalysisState:
     _check_jpdm(metadata, node)
     _check_load_average(metadata, node)
     _check_swap_usage(metadata, node)
+    _check_thread_pools(metadata, node)
 
     return metadata.analysis_state[node][Source.TOP]
 
@@ -197,7 +390,15 @@ def _maybe_parse_swap_line(swap_usage: list[float], line: str) -> bool:
         return False
 
 
+def _has_summaries(metadata: DdcheckMetadata, node: str, *names: str) -> bool:
+    """Whether the series a check reads were found in the ttop.txt file."""
+    return all(name in metadata.top_summaries[node] for name in names)
+
+
 def _check_cpu_wa(metadata: DdcheckMetadata, node: str) -> None:
+    if not _has_summaries(metadata, node, "wa"):
+        return
+
     # Record a CHECK insight for checking the average CPU time spent waiting for I/O.
     metadata.insights.add(
         Insight(
@@ -208,9 +409,8 @@ def _check_cpu_wa(metadata: DdcheckMetadata, node: str) -> None:
         )
     )
 
-    avg_cpu_wa = sum(metadata.cpu_usage[node]["wa"]) / len(
-        metadata.cpu_usage[node]["wa"]
-    )
+    summary = metadata.top_summaries[node]["wa"]
+    avg_cpu_wa = summary.mean
     if avg_cpu_wa >= 6:
         metadata.insights.add(
             Insight(
@@ -239,8 +439,22 @@ def _check_cpu_wa(metadata: DdcheckMetadata, node: str) -> None:
             )
         )
 
+    # Short I/O stalls barely move the average, so look at the tail too
+    if summary.p95 >= 10:
+        metadata.insights.add(
+            Insight(
+                node=node,
+                source=Source.TOP,
+                qualifier=InsightQualifier.BAD,
+                message=f"Spikes of CPU time spent waiting for disk I/O: p95={summary.p95:.1f}%, p99={summary.p99:.1f}%, max={summary.max:.1f}%",
+            )
+        )
+
 
 def _check_cpu_usage(metadata: DdcheckMetadata, node: str) -> None:
+    if not _has_summaries(metadata, node, "total", "us", "sy"):
+        return
+
     # Record a CHECK insight for checking the average CPU time spent waiting for I/O.
     metadata.insights.add(
         Insight(
@@ -251,15 +465,10 @@ def _check_cpu_usage(metadata: DdcheckMetadata, node: str) -> None:
         )
     )
 
-    avg_cpu_usage = sum(metadata.cpu_usage[node]["total"]) / len(
-        metadata.cpu_usage[node]["total"]
-    )
-    avg_cpu_us = sum(metadata.cpu_usage[node]["us"]) / len(
-        metadata.cpu_usage[node]["us"]
-    )
-    avg_cpu_sy = sum(metadata.cpu_usage[node]["sy"]) / len(
-        metadata.cpu_usage[node]["sy"]
-    )
+    summaries = metadata.top_summaries[node]
+    avg_cpu_usage = summaries["total"].mean
+    avg_cpu_us = summaries["us"].mean
+    avg_cpu_sy = summaries["sy"].mean
     if avg_cpu_usage > 80:
         metadata.insights.add(
             Insight(
@@ -278,9 +487,21 @@ def _check_cpu_usage(metadata: DdcheckMetadata, node: str) -> None:
                 message=f"Low average CPU usage: {avg_cpu_usage:.0f}%",
             )
         )
+    if avg_cpu_usage <= 80 and summaries["total"].p99 >= 95:
+        metadata.insights.add(
+            Insight(
+                node=node,
+                source=Source.TOP,
+                qualifier=InsightQualifier.INTERESTING,
+                message=f"CPU saturated at times despite an average CPU usage of {avg_cpu_usage:.0f}%: p95={summaries['total'].p95:.0f}%, p99={summaries['total'].p99:.0f}%",
+            )
+        )
 
 
 def _check_cpu_st(metadata: DdcheckMetadata, node: str) -> None:
+    if not _has_summaries(metadata, node, "st"):
+        return
+
     # Record a CHECK insight for checking the average CPU time spent waiting for I/O.
     metadata.insights.add(
         Insight(
@@ -291,9 +512,8 @@ def _check_cpu_st(metadata: DdcheckMetadata, node: str) -> None:
         )
     )
 
-    avg_cpu_usage = sum(metadata.cpu_usage[node]["st"]) / len(
-        metadata.cpu_usage[node]["st"]
-    )
+    summary = metadata.top_summaries[node]["st"]
+    avg_cpu_usage = summary.mean
     if avg_cpu_usage >= 1:
         metadata.insights.add(
             Insight(
@@ -303,9 +523,21 @@ def _check_cpu_st(metadata: DdcheckMetadata, node: str) -> None:
                 message=f"Non-zero stolen CPU time: {avg_cpu_usage:.1f}%",
             )
         )
+    elif summary.p95 >= 5:
+        metadata.insights.add(
+            Insight(
+                node=node,
+                source=Source.TOP,
+                qualifier=InsightQualifier.BAD,
+                message=f"Spikes of stolen CPU time: p95={summary.p95:.1f}%, p99={summary.p99:.1f}%",
+            )
+        )
 
 
 def _check_jpdm(metadata: DdcheckMetadata, node: str) -> None:
+    if not _has_summaries(metadata, node, "jpdm", "total"):
+        return
+
     metadata.insights.add(
         Insight(
             node=node,
@@ -315,12 +547,8 @@ def _check_jpdm(metadata: DdcheckMetadata, node: str) -> None:
         )
     )
 
-    avg_jpdm = sum(metadata.cpu_usage[node]["jpdm"]) / len(
-        metadata.cpu_usage[node]["jpdm"]
-    )
-    avg_cpu_usage = sum(metadata.cpu_usage[node]["total"]) / len(
-        metadata.cpu_usage[node]["total"]
-    )
+    avg_jpdm = metadata.top_summaries[node]["jpdm"].mean
+    avg_cpu_usage = metadata.top_summaries[node]["total"].mean
 
     if avg_jpdm >= 10:
         dominating_consumer = "System"
@@ -348,6 +576,9 @@ def _check_jpdm(metadata: DdcheckMetadata, node: str) -> None:
 
 
 def _check_load_average(metadata: DdcheckMetadata, node: str) -> None:
+    if not _has_summaries(metadata, node, "load_avg_1min", "load_avg_15min"):
+        return
+
     metadata.insights.add(
         Insight(
             node=node,
@@ -357,12 +588,8 @@ def _check_load_average(metadata: DdcheckMetadata, node: str) -> None:
         )
     )
 
-    avg_1m_load_average = sum(metadata.load_avg_1min[node]) / len(
-        metadata.load_avg_1min[node]
-    )
-    avg_15m_load_average = sum(metadata.load_avg_15min[node]) / len(
-        metadata.load_avg_15min[node]
-    )
+    avg_1m_load_average = metadata.top_summaries[node]["load_avg_1min"].mean
+    avg_15m_load_average = metadata.top_summaries[node]["load_avg_15min"].mean
     total_cpu_count = metadata.total_cpu_count[node]
 
     if avg_1m_load_average > total_cpu_count and avg_15m_load_average > total_cpu_count:
@@ -377,6 +604,9 @@ def _check_load_average(metadata: DdcheckMetadata, node: str) -> None:
 
 
 def _check_swap_usage(metadata: DdcheckMetadata, node: str) -> None:
+    if not _has_summaries(metadata, node, "used_swap_mb"):
+        return
+
     metadata.insights.add(
         Insight(
             node=node,
@@ -386,9 +616,7 @@ def _check_swap_usage(metadata: DdcheckMetadata, node: str) -> None:
         )
     )
 
-    avg_swap_usage = sum(metadata.total_used_swap_mb[node]) / len(
-        metadata.total_used_swap_mb[node]
-    )
+    avg_swap_usage = metadata.top_summaries[node]["used_swap_mb"].mean
 
     if avg_swap_usage > 0:
         metadata.insights.add(
@@ -408,3 +636,75 @@ def _check_swap_usage(metadata: DdcheckMetadata, node: str) -> None:
                 message="No swap usage detected",
             )
         )
+
+
+def _check_thread_pools(metadata: DdcheckMetadata, node: str) -> None:
+    # Only ttop.txt files listing the threads of each snapshot can be checked
+    pools = metadata.thread_pool_cpu[node]
+    total_cpu = sum(pools.values())
+    if total_cpu == 0:
+        return
+
+    metadata.insights.add(
+        Insight(
+            node=node,
+            source=Source.TOP,
+            qualifier=InsightQualifier.CHECK,
+            message="Checking the CPU usage per thread pool",
+        )
+    )
+
+    for pool in heapq.nlargest(3, pools, key=pools.__getitem__):
+        share = pools[pool] / total_cpu * 100
+        if share >= 25:
+            metadata.insights.add(
+                Insight(
+                    node=node,
+                    source=Source.TOP,
+                    qualifier=InsightQualifier.INTERESTING,
+                    message=f"Thread pool `{pool}` used {share:.0f}% of the CPU time of all threads across the capture, {pools[pool]:.0f}% of a core on average",
+                )
+            )
+
+    hottest_threads = ", ".join(
+        f"`{name}` ({series.mean():.1f}%)"
+        for name, series in metadata.hot_threads[node].items()
+    )
+    metadata.insights.add(
+        Insight(
+            node=node,
+            source=Source.TOP,
+            qualifier=InsightQualifier.DEBUG,
+            message=f"Threads that used the most CPU, with their average %CPU of a core: {hottest_threads}",
+        )
+    )
+
+
+register_analyser(
+    Analyser(
+        source=Source.TOP,
+        file_pattern=TTOP_FILE_PATTERN,
+        parse=parse_top_output,
+        record=record_top_output,
+        analyse=analyse_top_output,
+        produces={
+            "cpu_usage",
+            "top_times",
+            "load_avg_1min",
+            "load_avg_5min",
+            "load_avg_15min",
+            "total_used_swap_mb",
+            "top_summaries",
+            "hot_threads",
+            "thread_pool_cpu",
+            "cpu_usage_levels",
+            "total_used_swap_mb_levels",
+            "hot_threads_levels",
+        },
+        # The load average check compares it with the number of CPUs
+        consumes={"total_cpu_count"},
+        # Version 2 precomputes the downsampled series of the charts, version 3 keeps
+        # their peaks at the samples they occur at
+        version=3,
+    )
+)
@@ -0,0 +1,178 @@
+import argparse
+import json
+import logging
+import multiprocessing
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Optional
+
+from ddcheck import jobs
+from ddcheck.analysis.analysis import analyse_tarball
+from ddcheck.storage import AnalysisState, InsightQualifier
+from ddcheck.storage.list import find_tarballs
+from ddcheck.storage.upload import (
+    coalesce_metadata_writes,
+    ingest_tarball,
+    write_metrics,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    """
+    Ingest and analyse tarballs without Streamlit, e.g. ddcheck analyse
+    /archive/*.tar.gz, or run a worker with ddcheck worker, see ddcheck.jobs.
+
+    :param argv: Command line arguments, defaults to sys.argv[1:]
+    :return: Exit status, 1 if any tarball could not be ingested or analysed
+    """
+    parser = argparse.ArgumentParser(
+        prog="ddcheck",
+        description="Ingest and analyse Dremio diagnostics tarballs.",
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+    analyse_parser = commands.add_parser(
+        "analyse",
+        help="Ingest and analyse tarballs without the web interface",
+        description="Ingest and analyse tarballs without the web interface.",
+    )
+    analyse_parser.set_defaults(run=analyse)
+    analyse_parser.add_argument(
+        "paths",
+        nargs="+",
+        type=Path,
+        help="Tarballs, or directories searched recursively for tarballs",
+    )
+    analyse_parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=multiprocessing.cpu_count(),
+        help="Number of tarballs processed in parallel (default: number of CPUs)",
+    )
+    analyse_parser.add_argument(
+        "-o",
+        "--output",
+        type=Path,
+        help="File the summary is written to (default: standard output)",
+    )
+    analyse_parser.add_argument(
+        "--format",
+        choices=["jsonl", "json"],
+        default="jsonl",
+        help="One JSON object per tarball per line, or a single JSON array",
+    )
+    analyse_parser.add_argument("-v", "--verbose", action="store_true")
+    worker_parser = commands.add_parser(
+        "worker", help=jobs.DESCRIPTION, description=jobs.DESCRIPTION
+    )
+    worker_parser.set_defaults(run=jobs.run_command)
+    jobs.add_arguments(worker_parser)
+    args = parser.parse_args(argv)
+    result: int = args.run(args)
+    return result
+
+
+def analyse(args: argparse.Namespace) -> int:
+    """
+    Ingest and analyse tarballs, each one by a worker process, writing the summary
+    of each one as soon as it is done.
+
+    The CPUs are shared by the processes, each one compressing the indexed copy of
+    its tarball on its share of them.
+
+    :param args: Arguments parsed by the analyse command
+    :return: Exit status, 1 if any tarball could not be ingested or analysed
+    """
+    logging.basicConfig(
+        level=logging.DEBUG if args.verbose else logging.INFO,
+        format="%(asctime)s %(levelname)s %(name)s: %(message)s",
+    )
+
+    tarballs = find_tarballs(args.paths)
+    processes = max(1, args.jobs)
+    compression_threads = max(1, multiprocessing.cpu_count() // processes)
+    logger.info(f"Processing {len(tarballs)} tarballs with {processes} processes")
+    start = time.perf_counter()
+    summaries = []
+    output = sys.stdout if args.output is None else open(args.output, "w")
+    try:
+        # Worker processes are not forked from a process running threads
+        with ProcessPoolExecutor(
+            max_workers=processes,
+            mp_context=multiprocessing.get_context("forkserver"),
+        ) as executor:
+            futures = {
+                executor.submit(process_tarball, tarball, compression_threads): tarball
+                for tarball in tarballs
+            }
+            for future in as_completed(futures):
+                try:
+                    summary = future.result()
+                except Exception as e:
+                    logger.exception(e)
+                    summary = {"file": str(futures[future]), "error": str(e)}
+                summaries.append(summary)
+                if args.format == "jsonl":
+                    output.write(json.dumps(summary) + "\n")
+                    output.flush()
+        if args.format == "json":
+            json.dump(summaries, output, indent=2)
+            output.write("\n")
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+    elapsed = time.perf_counter() - start
+    failed = sum(1 for summary in summaries if "error" in summary)
+    logger.info(
+        f"Processed {len(tarballs)} tarballs in {elapsed:.1f}s "
+        f"({len(tarballs) / elapsed * 3600:.0f} tarballs/hour), {failed} failed"
+    )
+    return 1 if failed else 0
+
+
+def process_tarball(tarball: Path, compression_threads: Optional[int] = None) -> dict:
+    """
+    Ingest a tarball and analyse the nodes that were not analysed during ingestion.
+
+    :param tarball: Path of the tarball
+    :param compression_threads: Number of threads compressing the indexed copy,
+        defaults to the number of CPUs
+    :return: Summary of the upload, with an "error" key if it failed
+    """
+    with open(tarball, "rb") as f:
+        metadata = ingest_tarball(f, tarball.name, compression_threads)
+    if metadata is None:
+        return {"file": str(tarball), "error": "Invalid tarball"}
+    # Written once all the nodes are analysed
+    with coalesce_metadata_writes():
+        for node, states in metadata.analysis_state.items():
+            if AnalysisState.NOT_STARTED in states.values():
+                analyse_tarball(metadata, node)
+    write_metrics(metadata)
+
+    state = metadata.get_overall_analysis_state()
+    summary = {
+        "file": str(tarball),
+        "ddcheck_id": metadata.ddcheck_id,
+        "extract_path": metadata.extract_path,
+        "state": state.to_str(),
+        "nodes": metadata.nodes,
+        "insights": [
+            insight.to_dict()
+            for node in metadata.nodes
+            for qualifier in InsightQualifier
+            for insight in metadata.insights.of_qualifier(node, qualifier)
+        ],
+    }
+    if state == AnalysisState.FAILED:
+        summary["error"] = "Analysis failed"
+    return summary
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,737 @@
+import argparse
+import fcntl
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from enum import Enum, auto
+from pathlib import Path
+from typing import IO, Any, Callable, Optional
+
+from ddcheck.analysis.analysis import analyse_source
+from ddcheck.analysis.registry import get_analyser, get_dependencies
+from ddcheck.storage import (
+    EXTRACT_DIRECTORY,
+    AnalysisState,
+    DdcheckMetadata,
+    Source,
+    is_valid_node_name,
+)
+from ddcheck.storage.decompress import SUPPORTED_EXTENSIONS
+from ddcheck.storage.list import get_uploaded_metadata, read_uploaded_metadata
+from ddcheck.storage.upload import (
+    ingest_tarball,
+    merge_analyses_to_disk,
+    write_metrics,
+)
+
+logger = logging.getLogger(__name__)
+
+# State and tarball of the jobs not finished yet
+JOBS_DIRECTORY = EXTRACT_DIRECTORY / "ddcheck-jobs"
+# Analysis of a source of a node of an upload, queued by the jobs, see AnalysisTask
+TASKS_DIRECTORY = JOBS_DIRECTORY / "tasks"
+# State of the finished jobs, kept apart so that the workers do not poll them
+FINISHED_JOBS_DIRECTORY = JOBS_DIRECTORY / "finished"
+# Heartbeat of every running worker, on any host sharing EXTRACT_DIRECTORY
+WORKERS_DIRECTORY = JOBS_DIRECTORY / "workers"
+# Seconds between two checks of the worker for new jobs and tasks
+POLL_INTERVAL = 0.5
+# Seconds after which the job or task of a worker that stopped renewing its lease,
+# e.g. because it was killed, can be run by another worker. Hosts sharing
+# EXTRACT_DIRECTORY must have synchronised clocks
+LEASE_SECONDS = 30
+# Seconds between two renewals of the leases and the heartbeat of a worker
+HEARTBEAT_INTERVAL = 5
+# Number of jobs and tasks run at the same time by a worker, ingestion also
+# compresses on a pool of threads
+JOB_WORKERS = max(1, multiprocessing.cpu_count() // 2)
+# Directory of the server whose tarballs can be ingested without being uploaded, e.g.
+# those too large to be held in memory by Streamlit
+DROP_DIRECTORY = (
+    Path(os.environ["DDCHECK_DROP_DIRECTORY"])
+    if "DDCHECK_DROP_DIRECTORY" in os.environ
+    else None
+)
+# Of the worker, run with python -m ddcheck.jobs or ddcheck worker, see ddcheck.cli
+DESCRIPTION = "Run the queued ingestions and analyses of the uploads."
+
+
+class JobState(Enum):
+    QUEUED = auto()
+    INGESTING = auto()
+    ANALYSING = auto()
+    COMPLETED = auto()
+    FAILED = auto()
+
+    def to_str(self) -> str:
+        return self.name.lower()
+
+    @classmethod
+    def from_str(cls, state: str) -> "JobState":
+        return JobState[state.upper()]
+
+
+FINISHED_STATES = (JobState.COMPLETED, JobState.FAILED)
+
+# Task file, result of run_task and source of a task that is done
+_TaskResult = tuple[Path, Optional[DdcheckMetadata], Source]
+
+
+class Job:
+    """
+    Ingestion and analysis of an upload, run in the background by the workers.
+
+    The tarball is ingested by run_job, which then queues an AnalysisTask for every
+    source of every node left to analyse. The job is completed once they are all
+    done.
+    """
+
+    job_id: str
+    # Name of the uploaded tarball, None for a job only analysing an upload
+    filename: Optional[str]
+    # Path of the tarball, a copy of the uploaded file removed once the job is
+    # finished or a file of the drop directory
+    tarball: Optional[str]
+    # Upload analysed by the job, None until the tarball is ingested
+    ddcheck_id: Optional[str]
+    state: JobState
+    # Why the job failed
+    error: Optional[str]
+
+    def __init__(
+        self,
+        job_id: str,
+        filename: Optional[str] = None,
+        tarball: Optional[str] = None,
+        ddcheck_id: Optional[str] = None,
+        state: JobState = JobState.QUEUED,
+        error: Optional[str] = None,
+    ):
+        self.job_id = job_id
+        self.filename = filename
+        self.tarball = tarball
+        self.ddcheck_id = ddcheck_id
+        self.state = state
+        self.error = error
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.job_id,
+            "filename": self.filename,
+            "tarball": self.tarball,
+            "ddcheck_id": self.ddcheck_id,
+            "state": self.state.to_str(),
+            "error": self.error,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Job":
+        tarball = data.get("tarball")
+        if "tarball" not in data and data["filename"] is not None:
+            # Written when the tarball of a job was always a copy of the upload
+            tarball = str(JOBS_DIRECTORY / data["job_id"] / data["filename"])
+        return Job(
+            job_id=data["job_id"],
+            filename=data["filename"],
+            tarball=tarball,
+            ddcheck_id=data["ddcheck_id"],
+            state=JobState.from_str(data["state"]),
+            error=data["error"],
+        )
+
+
+class AnalysisTask:
+    """Analysis of a source of a node of an upload, run by run_task."""
+
+    # Job that queued the task
+    job_id: str
+    ddcheck_id: str
+    node: str
+    source: Source
+
+    def __init__(self, job_id: str, ddcheck_id: str, node: str, source: Source):
+        self.job_id = job_id
+        self.ddcheck_id = ddcheck_id
+        self.node = node
+        self.source = source
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.job_id,
+            "ddcheck_id": self.ddcheck_id,
+            "node": self.node,
+            "source": self.source.to_str(),
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "AnalysisTask":
+        return AnalysisTask(
+            job_id=data["job_id"],
+            ddcheck_id=data["ddcheck_id"],
+            node=data["node"],
+            source=Source.from_str(data["source"]),
+        )
+
+
+def start_worker() -> None:
+    """
+    Start a worker in the background, unless a worker is running on any host.
+
+    The worker is a separate process, as Streamlit runs pages as the __main__ module,
+    which the processes of a pool started from a page would run again. It keeps
+    running when the server stops, and the jobs and tasks left unfinished by a
+    worker that stopped are run again by another one.
+    """
+    WORKERS_DIRECTORY.mkdir(parents=True, exist_ok=True)
+    with open(WORKERS_DIRECTORY / "start.lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if any(_is_fresh(worker) for worker in WORKERS_DIRECTORY.glob("*.heartbeat")):
+            return
+        process = subprocess.Popen(
+            [sys.executable, "-m", "ddcheck.jobs"], start_new_session=True
+        )
+        # Until the worker beats itself, so that it is not started again meanwhile
+        _heartbeat_file(process.pid).touch()
+
+
+def submit_upload(fileobj: IO[bytes], filename: str) -> Optional[Job]:
+    """
+    Save an uploaded tarball and queue its ingestion and analysis.
+
+    The tarball is copied to disk by chunks of 1 MiB.
+
+    :param fileobj: Tarball, read once from its current position
+    :param filename: Name of the tarball, whose extension tells its compression
+    :return: Queued job, or None if the file is not a supported tarball
+    """
+    filename = Path(filename).name
+    if not _is_tarball(filename):
+        return None
+    job_id = str(uuid.uuid4())
+    tarball = JOBS_DIRECTORY / job_id / filename
+    tarball.parent.mkdir(parents=True)
+    with open(tarball, "wb") as f:
+        shutil.copyfileobj(fileobj, f, 1024 * 1024)
+    job = Job(job_id, filename=filename, tarball=str(tarball))
+    _submit(job)
+    return job
+
+
+def submit_path(tarball: Path) -> Optional[Job]:
+    """
+    Queue the ingestion and analysis of a tarball of the server, e.g. from the
+    DROP_DIRECTORY, which is read in place and kept.
+
+    :param tarball: Path of the tarball
+    :return: Queued job, or None if the file is not a supported tarball
+    """
+    if not _is_tarball(tarball.name):
+        return None
+    job = Job(str(uuid.uuid4()), filename=tarball.name, tarball=str(tarball))
+    _submit(job)
+    return job
+
+
+def submit_analysis(ddcheck_id: str) -> Job:
+    """
+    Queue the analysis of the nodes of an upload that were not analysed yet.
+
+    :param ddcheck_id: Unique ID for the upload
+    :return: Queued job
+    """
+    job = Job(str(uuid.uuid4()), ddcheck_id=ddcheck_id)
+    _submit(job)
+    return job
+
+
+def get_job(job_id: str) -> Optional[Job]:
+    """
+    Read the current state of a job.
+
+    :param job_id: Unique ID for the job
+    :return: Job if found, otherwise None
+    """
+    # A finished job is moved out of the queue once written with the finished ones
+    for directory in (JOBS_DIRECTORY, FINISHED_JOBS_DIRECTORY):
+        try:
+            with open(directory / f"{job_id}.json") as f:
+                return Job.from_dict(json.load(f))
+        except FileNotFoundError:
+            pass
+    return None
+
+
+def find_unfinished_job(ddcheck_id: str) -> Optional[Job]:
+    """
+    Find a job still ingesting or analysing an upload.
+
+    :param ddcheck_id: Unique ID for the upload
+    :return: Job if found, otherwise None
+    """
+    # Only the unfinished jobs are left in the queue
+    for job_file in JOBS_DIRECTORY.glob("*.json"):
+        try:
+            with open(job_file) as f:
+                job = Job.from_dict(json.load(f))
+        except FileNotFoundError:
+            # Finished meanwhile
+            continue
+        if job.ddcheck_id == ddcheck_id and job.state not in FINISHED_STATES:
+            return job
+    return None
+
+
+def run_job(job_id: str) -> None:
+    """
+    Ingest the tarball of a job if not done yet, then queue the analysis of its
+    upload.
+
+    The state of the job is written as it progresses.
+
+    :param job_id: Unique ID for the job
+    """
+    job = get_job(job_id)
+    assert job is not None, f"Job {job_id} not found"
+    try:
+        if job.ddcheck_id is None:
+            assert job.filename is not None and job.tarball is not None
+            _set_state(job, JobState.INGESTING)
+            with open(job.tarball, "rb") as f:
+                metadata = ingest_tarball(f, job.filename)
+            if metadata is None:
+                raise ValueError("Invalid tarball")
+            job.ddcheck_id = metadata.ddcheck_id
+        else:
+            metadata = get_uploaded_metadata(job.ddcheck_id)
+            if metadata is None:
+                raise ValueError(f"Upload {job.ddcheck_id} not found")
+        _queue_tasks(job, metadata)
+    except Exception as e:
+        logger.exception(e)
+        job.error = str(e)
+        _set_state(job, JobState.FAILED)
+    finally:
+        if job.state != JobState.INGESTING:
+            # Copy of the uploaded tarball, if any, kept for an interrupted ingestion
+            shutil.rmtree(JOBS_DIRECTORY / job.job_id, ignore_errors=True)
+
+
+def run_task(task_file: str) -> Optional[DdcheckMetadata]:
+    """
+    Analyse a source of a node of an upload.
+
+    The worker merges the result into the metadata of the upload along with those of
+    the other tasks done meanwhile, then removes the task file, which lets the tasks
+    of the sources depending on this one run. A task that fails is done as well, with
+    the analysis of its source FAILED, so that its job completes.
+
+    :param task_file: Path of the task, see AnalysisTask
+    :return: Metadata of the node holding the result, None if the upload was deleted
+    """
+    task = _read_task(Path(task_file))
+    try:
+        # Its node is modified by the analysis, so it is not shared with the cache
+        metadata = read_uploaded_metadata(task.ddcheck_id)
+        if metadata is None:
+            return None
+        node_metadata = metadata.extract_node(task.node)
+        produces = get_analyser(task.source).produces
+        states = node_metadata.analysis_state[task.node]
+        if states[task.source] == AnalysisState.IN_PROGRESS:
+            # Left in progress by an analysis that was interrupted
+            node_metadata.clear_analysis(task.node, task.source, produces)
+        return analyse_source(node_metadata, task.source)
+    except Exception as e:
+        logger.exception(e)
+        return _failed_analysis(task)
+
+
+def run_worker(
+    processes: int = JOB_WORKERS, stop: Optional[threading.Event] = None
+) -> None:
+    """
+    Run the jobs and tasks as they are queued, some processes at a time, until stopped.
+
+    Any number of workers may run at once, on one host or on several hosts sharing
+    EXTRACT_DIRECTORY. A job or task is run by the worker that created its lease
+    file, and whose heartbeat keeps it fresh. Once a lease is LEASE_SECONDS old,
+    e.g. because its worker was killed, another worker takes it over.
+
+    The results of the tasks are merged into the metadata of their upload at most
+    every POLL_INTERVAL, all those of an upload at once, so that a burst of tasks
+    does not rewrite the metadata once per task.
+
+    :param processes: Number of jobs and tasks run at the same time
+    :param stop: Stops the worker once set, otherwise it runs until interrupted
+    """
+    TASKS_DIRECTORY.mkdir(parents=True, exist_ok=True)
+    WORKERS_DIRECTORY.mkdir(parents=True, exist_ok=True)
+    heartbeat = _heartbeat_file(os.getpid())
+    heartbeat.touch()
+    # Jobs that could not be read
+    ignored: set[str] = set()
+    tasks: dict[Path, AnalysisTask] = {}
+    # Running jobs and tasks, keyed by their lease
+    running: dict[Path, Future[Any]] = {}
+    # Results of the tasks done but not merged yet, with their task file, keyed by
+    # upload
+    unmerged: dict[str, list[_TaskResult]] = {}
+    # time.monotonic() when the oldest of them was done
+    unmerged_since = 0.0
+    last_heartbeat = time.monotonic()
+    dependencies = get_dependencies()
+    executor = _new_pool(processes)
+
+    def submit(item: Path, function: Callable[[str], Any], argument: str) -> None:
+        """Runs a job or task whose lease was taken, in a new pool if it is broken."""
+        nonlocal executor
+        try:
+            running[_lease(item)] = executor.submit(function, argument)
+        except BrokenProcessPool:
+            # A process died, e.g. killed for lack of memory. The jobs and tasks it
+            # ran failed and are run again once their lease is released
+            logger.error("A process of the pool died, starting a new pool")
+            executor.shutdown(wait=False)
+            executor = _new_pool(processes)
+            running[_lease(item)] = executor.submit(function, argument)
+
+    try:
+        while stop is None or not stop.is_set():
+            for lease, future in list(running.items()):
+                if not future.done():
+                    continue
+                del running[lease]
+                item = lease.with_suffix(".json")
+                error = future.exception()
+                if isinstance(error, BrokenProcessPool) or (
+                    error is not None and lease.parent != TASKS_DIRECTORY
+                ):
+                    # Run again once its lease is released
+                    logger.error(f"{lease.stem} failed: {error}")
+                    lease.unlink(missing_ok=True)
+                elif lease.parent == TASKS_DIRECTORY:
+                    # Kept leased until merged
+                    task = tasks.get(item) or _read_task(item)
+                    if error is None:
+                        node_metadata = future.result()
+                    else:
+                        # Failed outside of run_task, e.g. while returning its result
+                        logger.error(f"{lease.stem} failed: {error}")
+                        node_metadata = _failed_analysis(task)
+                    if not unmerged:
+                        unmerged_since = time.monotonic()
+                    unmerged.setdefault(task.ddcheck_id, []).append(
+                        (item, node_metadata, task.source)
+                    )
+                else:
+                    lease.unlink(missing_ok=True)
+            if unmerged and (
+                not running or time.monotonic() - unmerged_since >= POLL_INTERVAL
+            ):
+                _merge_results(unmerged)
+                unmerged.clear()
+            if time.monotonic() - last_heartbeat >= HEARTBEAT_INTERVAL:
+                for path in [heartbeat, *running, *_unmerged_leases(unmerged)]:
+                    path.touch()
+                last_heartbeat = time.monotonic()
+
+            # Oldest first, those left unfinished by a stopped worker included
+            for item in sorted(
+                [*JOBS_DIRECTORY.glob("*.json"), *TASKS_DIRECTORY.glob("*.json")],
+                key=_mtime,
+            ):
+                if len(running) >= processes:
+                    break
+                if item.parent == TASKS_DIRECTORY:
+                    try:
+                        task = tasks.get(item) or _read_task(item)
+                    except FileNotFoundError:
+                        continue
+                    tasks[item] = task
+                    # Waits for the analyses whose facts it consumes
+                    if any(
+                        _task_file(task.ddcheck_id, task.node, source).exists()
+                        for source in dependencies[task.source]
+                    ):
+                        continue
+                    if not _claim(item):
+                        continue
+                    if item.exists():
+                        submit(item, run_task, str(item))
+                    else:
+                        # Done by another worker since it was listed
+                        _lease(item).unlink()
+                    continue
+
+                job_id = item.stem
+                if job_id in ignored:
+                    continue
+                try:
+                    job = get_job(job_id)
+                except (ValueError, KeyError) as e:
+                    logger.error(f"Ignoring unreadable job {job_id}: {e}")
+                    job = None
+                if job is not None and job.state in FINISHED_STATES:
+                    # Finished before the finished jobs were moved out of the queue
+                    _write_job(job)
+                elif job is None:
+                    ignored.add(job_id)
+                elif job.state == JobState.ANALYSING:
+                    if not any(TASKS_DIRECTORY.glob(f"{job.ddcheck_id}.*.json")):
+                        _set_state(job, JobState.COMPLETED)
+                        assert job.ddcheck_id is not None
+                        metadata = get_uploaded_metadata(job.ddcheck_id)
+                        if metadata is not None:
+                            write_metrics(metadata)
+                elif _claim(item):
+                    logger.info(f"Running job {job_id}")
+                    submit(item, run_job, job_id)
+            for item in [*tasks]:
+                if not item.exists():
+                    del tasks[item]
+            if running:
+                # Woken up as soon as a job or task is done
+                wait(running.values(), POLL_INTERVAL, FIRST_COMPLETED)
+            else:
+                time.sleep(POLL_INTERVAL)
+    finally:
+        executor.shutdown()
+        _merge_results(unmerged)
+        for lease in running:
+            lease.unlink(missing_ok=True)
+        heartbeat.unlink(missing_ok=True)
+
+
+def _merge_results(
+    unmerged: dict[str, list[_TaskResult]],
+) -> None:
+    """
+    Merge the results of the tasks of each upload at once, then remove the tasks.
+
+    Tasks whose results cannot be merged are removed as well, so that their job
+    completes, leaving their analyses as they were on disk.
+    """
+    for ddcheck_id, results in unmerged.items():
+        # Deleted uploads have nothing to merge
+        analysed = [
+            (node_metadata, source)
+            for _, node_metadata, source in results
+            if node_metadata is not None
+        ]
+        try:
+            if analysed:
+                merge_analyses_to_disk(ddcheck_id, analysed)
+        except Exception as e:
+            logger.exception(f"Could not merge the tasks of {ddcheck_id}: {e}")
+        for task_file, _, _ in results:
+            task_file.unlink(missing_ok=True)
+            _lease(task_file).unlink(missing_ok=True)
+
+
+def _failed_analysis(task: AnalysisTask) -> Optional[DdcheckMetadata]:
+    """
+    Metadata of the node of a task that failed, with the analysis of its source
+    cleared and FAILED.
+
+    :param task: Task that failed
+    :return: Metadata to merge, None if the upload was deleted or cannot be read
+    """
+    try:
+        metadata = read_uploaded_metadata(task.ddcheck_id)
+        if metadata is None:
+            return None
+        node_metadata = metadata.extract_node(task.node)
+        produces = get_analyser(task.source).produces
+        node_metadata.clear_analysis(task.node, task.source, produces)
+        node_metadata.analysis_state[task.node][task.source] = AnalysisState.FAILED
+        return node_metadata
+    except Exception as e:
+        logger.exception(e)
+        return None
+
+
+def _unmerged_leases(
+    unmerged: dict[str, list[_TaskResult]],
+) -> list[Path]:
+    return [
+        _lease(task_file)
+        for results in unmerged.values()
+        for task_file, _, _ in results
+    ]
+
+
+def _new_pool(processes: int) -> ProcessPoolExecutor:
+    return ProcessPoolExecutor(
+        max_workers=processes, mp_context=multiprocessing.get_context("forkserver")
+    )
+
+
+def _is_tarball(filename: str) -> bool:
+    if not filename.endswith(SUPPORTED_EXTENSIONS):
+        logger.error(
+            f"Invalid file type: {filename} (must end with .tar.gz or .tar.zst)"
+        )
+        return False
+    return True
+
+
+def _submit(job: Job) -> None:
+    start_worker()
+    _write_job(job)
+
+
+def _queue_tasks(job: Job, metadata: DdcheckMetadata) -> None:
+    """Queue the analysis of every source left to analyse, for any worker to run."""
+    TASKS_DIRECTORY.mkdir(parents=True, exist_ok=True)
+    for node, states in metadata.analysis_state.items():
+        for source, state in states.items():
+            # In progress if left so by an analysis that was interrupted
+            if state in (AnalysisState.NOT_STARTED, AnalysisState.IN_PROGRESS):
+                task = AnalysisTask(job.job_id, metadata.ddcheck_id, node, source)
+                _write_json(
+                    _task_file(metadata.ddcheck_id, node, source), task.to_dict()
+                )
+    _set_state(job, JobState.ANALYSING)
+
+
+def _task_file(ddcheck_id: str, node: str, source: Source) -> Path:
+    # Also checked on ingestion, but uploads ingested before may hold any name
+    if not is_valid_node_name(node):
+        raise ValueError(f"Invalid node name: {node!r}")
+    return TASKS_DIRECTORY / f"{ddcheck_id}.{source.to_str()}.{node}.json"
+
+
+def _read_task(task_file: Path) -> AnalysisTask:
+    with open(task_file) as f:
+        return AnalysisTask.from_dict(json.load(f))
+
+
+def _heartbeat_file(pid: int) -> Path:
+    return WORKERS_DIRECTORY / f"{socket.gethostname()}-{pid}.heartbeat"
+
+
+def _lease(item: Path) -> Path:
+    return item.with_suffix(".lease")
+
+
+def _claim(item: Path) -> bool:
+    """
+    Take the lease of a job or task, unless another worker holds it.
+
+    Two workers taking over the same expired lease at once may both run the item,
+    which is harmless as running a job or task again gives the same result.
+
+    :param item: Job or task file
+    :return: Whether the lease was taken
+    """
+    lease = _lease(item)
+    if lease.exists():
+        if _is_fresh(lease):
+            return False
+        logger.warning(f"Taking over the expired lease of {item.stem}")
+        lease.unlink(missing_ok=True)
+    try:
+        fd = os.open(lease, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        return False
+    with os.fdopen(fd, "w") as f:
+        f.write(_heartbeat_file(os.getpid()).stem)
+    return True
+
+
+def _is_fresh(path: Path) -> bool:
+    """Whether a lease or heartbeat was renewed less than LEASE_SECONDS ago."""
+    return time.time() - _mtime(path) < LEASE_SECONDS
+
+
+def _mtime(path: Path) -> float:
+    try:
+        return path.stat().st_mtime
+    except FileNotFoundError:
+        # Removed meanwhile, e.g. a task that was just completed
+        return float("inf")
+
+
+def _set_state(job: Job, state: JobState) -> None:
+    job.state = state
+    _write_job(job)
+
+
+def _write_job(job: Job) -> None:
+    if job.state in FINISHED_STATES:
+        FINISHED_JOBS_DIRECTORY.mkdir(parents=True, exist_ok=True)
+        _write_json(FINISHED_JOBS_DIRECTORY / f"{job.job_id}.json", job.to_dict())
+        (JOBS_DIRECTORY / f"{job.job_id}.json").unlink(missing_ok=True)
+    else:
+        _write_json(JOBS_DIRECTORY / f"{job.job_id}.json", job.to_dict())
+
+
+def _write_json(path: Path, data: dict) -> None:
+    # Pages and other workers read the files while they are written
+    temporary_file = path.with_suffix(f".{uuid.uuid4().hex}.tmp")
+    with open(temporary_file, "w") as f:
+        json.dump(data, f, indent=2)
+    os.replace(temporary_file, path)
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    """
+    Run a worker, e.g. one per host sharing EXTRACT_DIRECTORY.
+
+    :param argv: Command line arguments, defaults to sys.argv[1:]
+    :return: Exit status
+    """
+    parser = argparse.ArgumentParser(prog="ddcheck worker", description=DESCRIPTION)
+    add_arguments(parser)
+    return run_command(parser.parse_args(argv))
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    """
+    Add the arguments of the worker command to a parser.
+
+    :param parser: Parser of the worker command
+    """
+    parser.add_argument(
+        "-p",
+        "--processes",
+        type=int,
+        default=JOB_WORKERS,
+        help="Number of jobs and tasks run at the same time "
+        f"(default: {JOB_WORKERS})",
+    )
+
+
+def run_command(args: argparse.Namespace) -> int:
+    """
+    Run a worker until it is interrupted.
+
+    :param args: Arguments parsed by a parser given to add_arguments
+    :return: Exit status
+    """
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s %(levelname)s %(name)s: %(message)s",
+    )
+    # Stopped as with Ctrl+C, so that the pool ends the running jobs and tasks
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        run_worker(max(1, args.processes))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,10 +1,16 @@
 import streamlit as st
 
+from ddcheck.jobs import start_worker
+
+# Runs the jobs submitted by the pages, and those left unfinished by a previous run
+start_worker()
+
 pg = st.navigation(
     [
         st.Page("pages/01_Upload.py", title="Upload", icon="📤"),
         st.Page("pages/02_Analysis.py", title="Analysis", icon="🔍"),
         st.Page("pages/03_Report.py", title="Report", icon="📊"),
+        st.Page("pages/04_Diagnostics.py", title="Diagnostics", icon="⏱️"),
     ]
 )
 pg.run()
@@ -1,56 +1,115 @@
+import math
+from pathlib import Path
+
 import streamlit as st
 from streamlit.column_config import LinkColumn
 
-from ddcheck.storage.list import list_all_uploaded_tarballs
-from ddcheck.storage.upload import save_uploaded_tarball
+from ddcheck.jobs import DROP_DIRECTORY, Job, submit_path, submit_upload
+from ddcheck.storage.catalog import SORT_COLUMNS, count_uploads, list_uploads
+from ddcheck.storage.list import find_tarballs
 
 st.set_page_config(layout="centered")
 
+# Number of previously uploaded tarballs listed per page
+PAGE_SIZE = 50
+# Seconds the tarballs of the drop directory are listed for, instead of walking it
+# again on every rerun of the page
+DROP_DIRECTORY_TTL = 10
+
 st.title("DDCheck")
 st.subheader("Dremio Diagnostics Tarball Analysis Tool")
 st.write(
-    "Upload a Dremio Diagnostics Tarball (.tar.gz) below. "
+    "Upload a Dremio Diagnostics Tarball (.tar.gz or .tar.zst) below. "
     "Only tarballs generated with Dremio Diagnostics Collector v3.3.1 or earlier are supported."
 )
 
 uploaded_file = st.file_uploader(
     "Choose a diagnostics tarball",
-    type=["gz", "tgz"],
-    help="Upload a Dremio diagnostics tarball (.tar.gz file)",
+    type=["gz", "tgz", "zst"],
+    help="Upload a Dremio diagnostics tarball (.tar.gz or .tar.zst file)",
 )
 
-if uploaded_file is not None:
-    # Save the uploaded file and switch to the analysis page
-    metadata = save_uploaded_tarball(uploaded_file)
-    if metadata is None:
+
+def show_job(job: Job | None) -> None:
+    """Switches to the analysis page, which shows the progress of the job."""
+    if job is None:
         st.error(
             "Invalid tarball uploaded. Please upload a valid Dremio diagnostics tarball."
         )
     else:
-        st.success(f"File uploaded successfully as {metadata.ddcheck_id}")
-        st.session_state["ddcheck_id"] = metadata.ddcheck_id
+        st.session_state["job_id"] = job.job_id
+        st.session_state.pop("ddcheck_id", None)
         st.switch_page("pages/02_Analysis.py")
 
+
+@st.cache_data(ttl=DROP_DIRECTORY_TTL, show_spinner=False)
+def find_dropped_tarballs() -> list[Path]:
+    """Lists the tarballs of the drop directory, shared by all sessions."""
+    assert DROP_DIRECTORY is not None
+    return find_tarballs([DROP_DIRECTORY])
+
+
+if uploaded_file is not None:
+    # Save the uploaded file and queue its ingestion
+    show_job(submit_upload(uploaded_file, uploaded_file.name))
+
+# Tarballs too large to be uploaded through the browser, which Streamlit holds in
+# memory, can be copied to the drop directory of the server instead
+if DROP_DIRECTORY is not None and DROP_DIRECTORY.is_dir():
+    dropped = find_dropped_tarballs()
+    col1, col2 = st.columns([9, 3], vertical_alignment="bottom")
+    with col1:
+        selected = st.selectbox(
+            f"Or choose a tarball from {DROP_DIRECTORY}",
+            dropped,
+            format_func=lambda path: str(path.relative_to(DROP_DIRECTORY)),
+        )
+    with col2:
+        if st.button("Ingest", disabled=selected is None, use_container_width=True):
+            assert selected is not None
+            show_job(submit_path(selected))
+
 # Separator between upload and selection
 st.divider()
 st.write("Or select a previously uploaded tarball:")
 
-# Previously uploaded tarballs section
-existing_tarballs = list_all_uploaded_tarballs()
-if existing_tarballs:
-    # Sort the table data before displaying it by upload time (newest first)
-    table_data = sorted(
-        [
-            {
-                "DDCheck ID": f"Analysis?ddcheck_id={metadata.ddcheck_id}",
-                "Original Filename": metadata.original_filename,
-                "Upload Time (UTC)": metadata.upload_time.isoformat(),
-            }
-            for metadata in existing_tarballs
-        ],
-        key=lambda x: x["Upload Time (UTC)"],
-        reverse=True,
-    )
+# Previously uploaded tarballs section, sorted and paginated by the catalog
+upload_count = count_uploads()
+if upload_count:
+    sort_labels = {
+        "upload_time": "Upload Time (UTC)",
+        "original_filename": "Original Filename",
+        "node_count": "Nodes",
+        "state": "Analysis State",
+        "size": "Size (MiB)",
+    }
+    col1, col2, col3 = st.columns([6, 3, 3], vertical_alignment="bottom")
+    with col1:
+        sort_by = st.selectbox(
+            "Sort by", SORT_COLUMNS, format_func=sort_labels.__getitem__
+        )
+    with col2:
+        descending = st.toggle("Descending", value=True)
+    with col3:
+        page = st.number_input(
+            f"Page (of {math.ceil(upload_count / PAGE_SIZE)})",
+            min_value=1,
+            max_value=math.ceil(upload_count / PAGE_SIZE),
+        )
+
+    table_data = [
+        {
+            "DDCheck ID": f"Analysis?ddcheck_id={entry.ddcheck_id}",
+            "Original Filename": entry.original_filename,
+            "Upload Time (UTC)": entry.upload_time.isoformat(),
+            "Nodes": entry.node_count,
+            "Analysis State": entry.state.name.lower(),
+            "Size (MiB)": round(entry.size / (1024 * 1024), 1),
+        }
+        for entry in list_uploads(
+            sort_by, descending, limit=PAGE_SIZE, offset=(int(page) - 1) * PAGE_SIZE
+        )
+    ]
 
     # Create a dataframe for the table
     st.dataframe(
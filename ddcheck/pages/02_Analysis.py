@@ -1,15 +1,40 @@
+import functools
 import time
 
 import streamlit as st
+from natsort import natsorted
 
-from ddcheck.analysis.analysis import analyse_tarball
+from ddcheck.jobs import (
+    FINISHED_STATES,
+    JobState,
+    find_unfinished_job,
+    get_job,
+    submit_analysis,
+)
 from ddcheck.storage import AnalysisState, DdcheckMetadata
 from ddcheck.storage.list import get_uploaded_metadata
 
 st.set_page_config(layout="centered")
 
+# Seconds between two refreshes of the progress of a job
+POLL_INTERVAL = 1
+
 if "ddcheck_id" in st.query_params:
     st.session_state["ddcheck_id"] = st.query_params["ddcheck_id"]
+    st.session_state.pop("job_id", None)
+
+# The ingestion and analysis run in the background, this page shows their progress
+job = get_job(st.session_state["job_id"]) if "job_id" in st.session_state else None
+if job is not None and job.ddcheck_id is None:
+    if job.state == JobState.FAILED:
+        st.error(f"Could not ingest {job.filename}: {job.error}")
+        st.stop()
+    with st.status(f"Ingesting {job.filename}...", expanded=True):
+        st.write(f"Job {job.job_id} is {job.state.to_str()}")
+    time.sleep(POLL_INTERVAL)
+    st.rerun()
+if job is not None:
+    st.session_state["ddcheck_id"] = job.ddcheck_id
 
 if "ddcheck_id" not in st.session_state:
     st.switch_page("pages/01_Upload.py")
@@ -18,20 +43,40 @@ metadata: DdcheckMetadata | None = get_uploaded_metadata(st.session_state.ddchec
 if metadata is None:
     st.switch_page("pages/01_Upload.py")
 else:
+    # Nodes with sources left to analyse
+    pending = [
+        node
+        for node in natsorted(metadata.nodes)
+        if {AnalysisState.NOT_STARTED, AnalysisState.IN_PROGRESS}
+        & set(metadata.analysis_state.get(node, {}).values())
+    ]
+    # Analyse the nodes that have not been analysed yet, e.g. after a rerun, unless
+    # another session already queued their analysis
+    if job is None and pending:
+        job = find_unfinished_job(metadata.ddcheck_id) or submit_analysis(
+            metadata.ddcheck_id
+        )
+        st.session_state["job_id"] = job.job_id
+
+    if job is None or job.state == JobState.COMPLETED:
+        st.switch_page("pages/03_Report.py")
+
     with st.status(
         f"Analysing {metadata.original_filename} (ID: {metadata.ddcheck_id})...",
         expanded=True,
     ) as status:
-        # Invoke the ttop analysis function for each node if it has not been analysed yet
-        for node, states in metadata.analysis_state.items():
-            # if any of the states is COMPLETE, skip the node
-            if AnalysisState.COMPLETED in states.values():
-                st.write(f"Skipping analysis for {node} - already completed")
-            else:
-                with st.empty():
-                    st.write(f"Analysing node {node}...")
-                    analysis_output = analyse_tarball(metadata, node).name.lower()
-                    time.sleep(0.1)
-                    st.write(f"Analysis of node {node}: {analysis_output}")
-        status.update(label="Analysis complete", state="complete")
-        st.switch_page("pages/03_Report.py")
+        st.progress(1 - len(pending) / max(1, len(metadata.nodes)))
+        for node in natsorted(metadata.nodes):
+            state = functools.reduce(
+                AnalysisState.max,
+                metadata.analysis_state.get(node, {}).values(),
+                AnalysisState.NOT_STARTED,
+            )
+            label = "pending" if node in pending else state.name.lower()
+            st.write(f"Analysis of node {node}: {label}")
+        if job.state == JobState.FAILED:
+            status.update(label="Analysis failed", state="error")
+            st.error(job.error)
+    if job.state not in FINISHED_STATES:
+        time.sleep(POLL_INTERVAL)
+        st.rerun()
@@ -1,12 +1,16 @@
 import os
+from typing import Optional
 
 import pandas as pd
 import streamlit as st
 from natsort import natsorted
 from openai import OpenAI
 
+from ddcheck.analysis.analysis import invalidate_stale_analyses
+from ddcheck.analysis.downsample import CHART_POINTS, chart_columns
 from ddcheck.storage import DdcheckMetadata, InsightQualifier
-from ddcheck.storage.list import get_uploaded_metadata
+from ddcheck.storage.list import get_uploaded_metadata, read_uploaded_metadata
+from ddcheck.storage.series import Columns
 from ddcheck.storage.upload import write_metadata_to_disk
 
 st.set_page_config(layout="wide")
@@ -26,31 +30,33 @@ else:
             st.title(f"Report for {metadata.original_filename}")
         with col2:
             if st.button("Rerun analysis", use_container_width=True):
-                metadata.reset()
-                write_metadata_to_disk(metadata)
+                # Only what changed since the last analysis is analysed again. The
+                # metadata shown is shared with other sessions, so a copy is modified
+                rerun_metadata = read_uploaded_metadata(metadata.ddcheck_id)
+                if rerun_metadata is not None:
+                    invalidate_stale_analyses(rerun_metadata)
+                    write_metadata_to_disk(rerun_metadata)
+                st.session_state.pop("job_id", None)
                 st.switch_page("pages/02_Analysis.py")
 
-    insights_per_qualifier_and_node = metadata.insights_per_qualifier_and_node()
-    insights_per_node_and_qualifier = metadata.insights_per_node_and_qualifier()
+    sorted_nodes = natsorted(metadata.nodes)
 
     # Display all the checks that were performed
     total_checks = sum(
-        len(insights)
-        for insights in insights_per_qualifier_and_node[InsightQualifier.CHECK].values()
+        len(metadata.insights.of_qualifier(node, InsightQualifier.CHECK))
+        for node in metadata.nodes
     )
     with st.status(
         f"📋 {total_checks} checks performed",
         expanded=False,
     ) as status:
-        for node_and_insights in natsorted(
-            insights_per_qualifier_and_node[InsightQualifier.CHECK].items()
-        ):
-            for insight in node_and_insights[1]:
-                status.write(f"{node_and_insights[0]}: {insight.message}")
+        for node in sorted_nodes:
+            for insight in metadata.insights.of_qualifier(node, InsightQualifier.CHECK):
+                status.write(f"{node}: {insight.message}")
 
     # Show a selector with all the nodes
     st.markdown("### Node selection")
-    selected_node = st.selectbox("Select a Dremio node", natsorted(metadata.nodes))
+    selected_node = st.selectbox("Select a Dremio node", sorted_nodes)
 
     # Display the insights for the selected node
     if selected_node:
@@ -64,9 +70,7 @@ else:
         }
 
         for qualifier in labels_per_qualifier:
-            insights = insights_per_qualifier_and_node.get(qualifier, {}).get(
-                selected_node, []
-            )
+            insights = metadata.insights.of_qualifier(selected_node, qualifier)
             if len(insights) != 0:
                 st.write(f"{labels_per_qualifier[qualifier]} **{qualifier.name}**")
                 for insight in insights:
@@ -75,19 +79,38 @@ else:
         st.divider()
         st.subheader("Metrics")
 
+        # Long captures are downsampled to about the width of the charts, zooming in
+        # shows the samples of the selected range at a finer resolution
+        sample_count = len(metadata.top_times[selected_node])
+        start, end = 0, sample_count
+        if sample_count > CHART_POINTS:
+            start, end = st.slider(
+                "Zoom to samples", 0, sample_count, (0, sample_count)
+            )
+
+        def chart_frame(columns: Columns, levels: Optional[Columns]) -> pd.DataFrame:
+            """Returns the points of the series to chart, indexed by sample."""
+            index, chart = chart_columns(columns, levels, start, end)
+            return pd.DataFrame(
+                chart.array.T, index=index, columns=chart.names, copy=False
+            )
+
         if selected_node in metadata.cpu_usage:
             st.write("#### CPU usage")
-            df = pd.DataFrame(metadata.cpu_usage[selected_node])
+            df = chart_frame(
+                metadata.cpu_usage[selected_node],
+                metadata.cpu_usage_levels.get(selected_node),
+            )
             df.rename(
                 columns={
                     "us": "User",
                     "sy": "System",
                     "id": "Idle",
                     "wa": "I/O Wait",
+                    "total": "Total",
                 },
                 inplace=True,
             )
-            df["Total"] = 100 - df["Idle"]
             # Create a line chart with the CPU usage computed as 100 - idle.  Idle CPU usage is displayed with a green line.
             st.line_chart(
                 df,
@@ -99,7 +122,12 @@ else:
 
         if selected_node in metadata.total_used_swap_mb:
             st.write("#### Swap usage")
-            df = pd.DataFrame(metadata.total_used_swap_mb[selected_node])
+            df = chart_frame(
+                Columns.from_dict(
+                    {"used_swap_mb": metadata.total_used_swap_mb[selected_node]}
+                ),
+                metadata.total_used_swap_mb_levels.get(selected_node),
+            )
             # Create a line chart with the Swap usage
             st.line_chart(
                 df,
@@ -107,6 +135,14 @@ else:
                 use_container_width=True,
             )
 
+        if metadata.hot_threads.get(selected_node):
+            st.write("#### CPU usage of the hottest threads")
+            df = chart_frame(
+                metadata.hot_threads[selected_node],
+                metadata.hot_threads_levels.get(selected_node),
+            )
+            st.line_chart(df, use_container_width=True)
+
         def display_chat_message(message: dict) -> None:
             """Displays a chat message with potential handling for <think> tags."""
             content = message["content"]
@@ -159,9 +195,7 @@ else:
             ]:
                 initial_user_prompt += "".join(
                     f"* {i.message}\n"
-                    for i in insights_per_qualifier_and_node.get(q, {}).get(
-                        selected_node, []
-                    )
+                    for i in metadata.insights.of_qualifier(selected_node, q)
                 )
             st.session_state.messages = [
                 {"role": "system", "content": system_prompt},
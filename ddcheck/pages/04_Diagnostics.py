@@ -0,0 +1,55 @@
+import pandas as pd
+import streamlit as st
+
+from ddcheck.storage import DdcheckMetadata
+from ddcheck.storage.list import get_uploaded_metadata
+
+st.set_page_config(layout="wide")
+
+if "ddcheck_id" not in st.session_state:
+    st.switch_page("pages/01_Upload.py")
+
+metadata: DdcheckMetadata | None = get_uploaded_metadata(st.session_state.ddcheck_id)
+
+if metadata is None:
+    st.switch_page("pages/01_Upload.py")
+else:
+    st.title(f"Diagnostics for {metadata.original_filename}")
+
+    if not metadata.spans:
+        st.info("No timings were recorded for this upload.")
+    else:
+        spans = pd.DataFrame(
+            {
+                "Stage": [span.stage for span in metadata.spans],
+                "Node": [span.node or "(all)" for span in metadata.spans],
+                "Wall (s)": [span.wall_seconds for span in metadata.spans],
+                "CPU (s)": [span.cpu_seconds for span in metadata.spans],
+                "Read (MiB)": [span.bytes_read / 2**20 for span in metadata.spans],
+                "Peak RSS (MiB)": [
+                    span.peak_rss_bytes / 2**20 for span in metadata.spans
+                ],
+            }
+        )
+
+        # Stages of the nodes are summed, except their peak RSS of which the max is kept
+        st.subheader("Stages")
+        per_stage = spans.groupby("Stage").agg(
+            {
+                "Wall (s)": "sum",
+                "CPU (s)": "sum",
+                "Read (MiB)": "sum",
+                "Peak RSS (MiB)": "max",
+            }
+        )
+        st.bar_chart(per_stage[["Wall (s)", "CPU (s)"]], stack=False)
+        st.dataframe(per_stage, use_container_width=True)
+
+        st.subheader("Wall time per node")
+        per_node = spans[spans["Node"] != "(all)"].pivot_table(
+            index="Node", columns="Stage", values="Wall (s)", aggfunc="sum"
+        )
+        st.bar_chart(per_node, horizontal=True)
+
+        with st.expander("All spans"):
+            st.dataframe(spans, hide_index=True, use_container_width=True)
@@ -1,8 +1,18 @@
+import bisect
 import functools
+import sys
+import threading
+from collections.abc import MutableSet, Sequence
 from datetime import datetime
 from enum import Enum, auto
 from pathlib import Path
-from typing import Any
+from typing import Any, Collection, Iterable, Iterator, MutableMapping, Optional
+
+import numpy as np
+
+from ddcheck.storage.lazy import DecodedPerNode
+from ddcheck.storage.series import Columns, NodeSeries, seconds_since_midnight
+from ddcheck.storage.spans import Span
 
 
 class Source(Enum):
@@ -83,6 +93,8 @@ class InsightQualifier(Enum):
 
 
 class Insight:
+    __slots__ = ("node", "source", "qualifier", "message")
+
     node: str
     source: Source
     qualifier: InsightQualifier
@@ -91,10 +103,11 @@ class Insight:
     def __init__(
         self, node: str, source: Source, qualifier: InsightQualifier, message: str
     ):
-        self.node = node
+        # The same node names and messages are repeated across insights and uploads
+        self.node = sys.intern(node)
         self.source = source
         self.qualifier = qualifier
-        self.message = message
+        self.message = sys.intern(message)
 
     def __eq__(self, other: Any) -> bool:
         if not isinstance(other, Insight):
@@ -127,27 +140,217 @@ class Insight:
         )
 
 
+def _insight_order(insight: Insight) -> tuple[Source, str]:
+    return insight.source, insight.message
+
+
+class InsightStore(MutableSet[Insight]):
+    """Insights of an upload, indexed by node and qualifier and by node and source.
+
+    The insights of each node and qualifier are kept sorted by source and message as
+    they are added, so that listing them is a lookup.
+    """
+
+    def __init__(self, insights: Iterable[Insight] = ()):
+        self._insights: set[Insight] = set()
+        self._by_qualifier: dict[tuple[str, InsightQualifier], list[Insight]] = {}
+        self._by_source: dict[tuple[str, Source], set[Insight]] = {}
+        for insight in insights:
+            self.add(insight)
+
+    def __contains__(self, insight: object) -> bool:
+        return insight in self._insights
+
+    def __iter__(self) -> Iterator[Insight]:
+        return iter(self._insights)
+
+    def __len__(self) -> int:
+        return len(self._insights)
+
+    def add(self, insight: Insight) -> None:
+        if insight in self._insights:
+            return
+        self._insights.add(insight)
+        bisect.insort(
+            self._by_qualifier.setdefault((insight.node, insight.qualifier), []),
+            insight,
+            key=_insight_order,
+        )
+        self._by_source.setdefault((insight.node, insight.source), set()).add(insight)
+
+    def discard(self, insight: Insight) -> None:
+        if insight not in self._insights:
+            return
+        self._insights.remove(insight)
+        self._by_qualifier[(insight.node, insight.qualifier)].remove(insight)
+        self._by_source[(insight.node, insight.source)].remove(insight)
+
+    def of_qualifier(self, node: str, qualifier: InsightQualifier) -> Sequence[Insight]:
+        """Returns the insights of a node with a qualifier, by source and message.
+
+        Args:
+            node: Node of the insights
+            qualifier: Qualifier of the insights
+
+        Returns:
+            Sorted insights, that must not be modified
+        """
+        return self._by_qualifier.get((node, qualifier), ())
+
+    def of_source(self, node: str, source: Source) -> Iterable[Insight]:
+        """Returns the insights of a node produced by the analysis of a source.
+
+        Args:
+            node: Node of the insights
+            source: Source of the insights
+
+        Returns:
+            Insights in no particular order
+        """
+        return tuple(self._by_source.get((node, source), ()))
+
+    def of_node(self, node: str) -> Iterable[Insight]:
+        """Returns the insights of a node, in no particular order."""
+        for source in Source:
+            yield from self._by_source.get((node, source), ())
+
+
+class SeriesSummary:
+    """Statistics of a time series, computed once when the series is parsed."""
+
+    count: int
+    mean: float
+    min: float
+    max: float
+    stddev: float
+    p50: float
+    p95: float
+    p99: float
+
+    def __init__(
+        self,
+        count: int,
+        mean: float,
+        min: float,
+        max: float,
+        stddev: float,
+        p50: float,
+        p95: float,
+        p99: float,
+    ):
+        self.count = count
+        self.mean = mean
+        self.min = min
+        self.max = max
+        self.stddev = stddev
+        self.p50 = p50
+        self.p95 = p95
+        self.p99 = p99
+
+    def to_dict(self) -> dict:
+        return dict(vars(self))
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "SeriesSummary":
+        return SeriesSummary(**data)
+
+
+def _decode_summaries(data: dict) -> dict[str, SeriesSummary]:
+    return {
+        series: SeriesSummary.from_dict(summary) for series, summary in data.items()
+    }
+
+
+def _encode_summaries(summaries: dict[str, SeriesSummary]) -> dict:
+    return {series: summary.to_dict() for series, summary in summaries.items()}
+
+
+# Guards the first decoding of the insights of any metadata. Not an attribute of the
+# metadata, which is pickled to be analysed by other processes
+_insights_lock = threading.Lock()
+
+
 class DdcheckMetadata:
+    # Attributes holding a dict keyed by node name
+    PER_NODE_ATTRIBUTES = (
+        "analysis_state",
+        "analysis_stamps",
+        "cpu_usage",
+        "top_times",
+        "load_avg_1min",
+        "load_avg_5min",
+        "load_avg_15min",
+        "total_memory_kb",
+        "total_used_swap_mb",
+        "total_cpu_count",
+        "top_summaries",
+        "hot_threads",
+        "thread_pool_cpu",
+        "cpu_usage_levels",
+        "total_used_swap_mb_levels",
+        "hot_threads_levels",
+    )
+    # Per-node attributes holding time series, stored apart from the metadata file
+    # and only loaded for the nodes accessed, see NodeSeries
+    SERIES_ATTRIBUTES = (
+        "cpu_usage",
+        "top_times",
+        "load_avg_1min",
+        "load_avg_5min",
+        "load_avg_15min",
+        "total_used_swap_mb",
+        "hot_threads",
+        "cpu_usage_levels",
+        "total_used_swap_mb_levels",
+        "hot_threads_levels",
+    )
+
     original_filename: str
     ddcheck_id: str
     upload_time: datetime
     extract_path: str
     nodes: list[str]
     analysis_state: dict[str, dict[Source, AnalysisState]]
-    insights: set[Insight]
+    # Stamp of the analyser and its input file, per node and source, see
+    # Analyser.stamp in ddcheck.analysis.registry
+    analysis_stamps: dict[str, dict[Source, str]]
+    # Insights, decoded from _encoded_insights the first time they are accessed
+    _insights: Optional[InsightStore]
+    _encoded_insights: list[dict]
     # CPU usage per node.
-    # Each node is associated to a dict containing a list of values for keys us, sy, ni, id, wa, hi, si, st
-    cpu_usage: dict[str, dict[str, list[float]]]
-    # Times when top was executed per node (stored as datetime objects)
-    top_times: dict[str, list[datetime]]
-    # Load averages per node. Each node has three lists for 1min, 5min, and 15min averages
-    load_avg_1min: dict[str, list[float]]
-    load_avg_5min: dict[str, list[float]]
-    load_avg_15min: dict[str, list[float]]
+    # Each node is associated to columns of values for keys us, sy, ni, id, wa, hi, si, st, total and jpdm
+    cpu_usage: MutableMapping[str, Columns]
+    # Times when top was executed per node (stored as int32 seconds since midnight)
+    top_times: MutableMapping[str, np.ndarray]
+    # Load averages per node. Each node has three arrays for 1min, 5min, and 15min averages
+    load_avg_1min: MutableMapping[str, np.ndarray]
+    load_avg_5min: MutableMapping[str, np.ndarray]
+    load_avg_15min: MutableMapping[str, np.ndarray]
     # Tracks State per node and source
     total_memory_kb: dict[str, int]
-    total_used_swap_mb: dict[str, list[float]]
+    total_used_swap_mb: MutableMapping[str, np.ndarray]
     total_cpu_count: dict[str, int]
+    # Summary of each ttop series per node, keyed by node then by series name
+    # (CPU usage keys, load_avg_1min, load_avg_5min, load_avg_15min, used_swap_mb)
+    top_summaries: DecodedPerNode[dict[str, SeriesSummary]]
+    # %CPU of the threads that used the most CPU per node, keyed by node then thread
+    hot_threads: MutableMapping[str, Columns]
+    # Average %CPU of the threads of each pool per node, keyed by node then pool
+    thread_pool_cpu: dict[str, dict[str, float]]
+    # Downsampled cpu_usage, total_used_swap_mb and hot_threads per node, precomputed
+    # for the charts, see downsample_levels in ddcheck.analysis.downsample
+    cpu_usage_levels: MutableMapping[str, Columns]
+    total_used_swap_mb_levels: MutableMapping[str, Columns]
+    hot_threads_levels: MutableMapping[str, Columns]
+    # Resources used by each stage of the ingestion and analysis, see record_span in
+    # ddcheck.storage.spans
+    spans: list[Span]
+    # Number of times the metadata file was written, see write_metadata_to_disk in
+    # ddcheck.storage.upload
+    version: int
+    # Analyses run, merged or cleared since the metadata was last written, as
+    # (node, source). Only those are kept if another session wrote the file meanwhile
+    changed_analyses: set[tuple[str, Source]]
 
     def __init__(
         self,
@@ -162,6 +365,9 @@ class DdcheckMetadata:
         self.upload_time = upload_time
         self.extract_path = extract_path
         self.nodes = nodes
+        self.spans = []
+        self.version = 0
+        self.changed_analyses = set()
         self.reset()
 
     def reset(self) -> None:
@@ -170,15 +376,67 @@ class DdcheckMetadata:
             node: {source: AnalysisState.NOT_STARTED for source in Source}
             for node in self.nodes
         }
-        self.insights = set()
-        self.cpu_usage = {}
-        self.top_times = {node: [] for node in self.nodes}
-        self.load_avg_1min = {node: [] for node in self.nodes}
-        self.load_avg_5min = {node: [] for node in self.nodes}
-        self.load_avg_15min = {node: [] for node in self.nodes}
+        self.analysis_stamps = {}
+        self.insights = InsightStore()
+        self.cpu_usage = self._new_series("cpu_usage")
+        self.top_times = self._new_series("top_times", self.nodes, np.int32)
+        self.load_avg_1min = self._new_series("load_avg_1min", self.nodes)
+        self.load_avg_5min = self._new_series("load_avg_5min", self.nodes)
+        self.load_avg_15min = self._new_series("load_avg_15min", self.nodes)
         self.total_memory_kb = {}
-        self.total_used_swap_mb = {}
+        self.total_used_swap_mb = self._new_series("total_used_swap_mb")
         self.total_cpu_count = {}
+        self.top_summaries = DecodedPerNode({}, _decode_summaries, _encode_summaries)
+        self.hot_threads = self._new_series("hot_threads")
+        self.thread_pool_cpu = {}
+        self.cpu_usage_levels = self._new_series("cpu_usage_levels")
+        self.total_used_swap_mb_levels = self._new_series("total_used_swap_mb_levels")
+        self.hot_threads_levels = self._new_series("hot_threads_levels")
+
+    @property
+    def insights(self) -> InsightStore:
+        insights = self._insights
+        if insights is None:
+            # Shared by the sessions of the cached metadata, so another thread may
+            # decode them meanwhile
+            with _insights_lock:
+                if self._insights is None:
+                    self._insights = InsightStore(
+                        Insight.from_dict(insight) for insight in self._encoded_insights
+                    )
+                    self._encoded_insights = []
+                insights = self._insights
+        return insights
+
+    @insights.setter
+    def insights(self, insights: InsightStore) -> None:
+        with _insights_lock:
+            self._insights = insights
+            self._encoded_insights = []
+
+    def _encode_insights(self) -> list[dict]:
+        with _insights_lock:
+            insights = self._insights
+            if insights is None:
+                return self._encoded_insights
+        return [insight.to_dict() for insight in insights]
+
+    def _new_series(
+        self,
+        attribute: str,
+        empty_nodes: Iterable[str] = (),
+        dtype: type[np.number] = np.float64,
+    ) -> NodeSeries[Any]:
+        """Returns the series of an attribute, holding an empty array for empty_nodes."""
+        values: NodeSeries[Any] = NodeSeries(Path(self.extract_path), attribute)
+        for node in empty_nodes:
+            values[node] = np.zeros(0, dtype=dtype)
+        return values
+
+    def save_series(self) -> None:
+        """Writes the time series of the nodes assigned since they were loaded."""
+        for attribute in self.SERIES_ATTRIBUTES:
+            getattr(self, attribute).save()
 
     @classmethod
     def from_dict(cls, data: dict) -> "DdcheckMetadata":
@@ -196,49 +454,213 @@ class DdcheckMetadata:
             }
             for node, states in data.get("analysis_state", {}).items()
         }
-        metadata.insights = {
-            Insight.from_dict(insight) for insight in data.get("insights", [])
-        }
-        metadata.cpu_usage = data.get("cpu_usage", {})
-        metadata.top_times = {
-            node: [datetime.strptime(t, "%H:%M:%S") for t in times]
-            for node, times in data.get("top_times", {}).items()
+        metadata.analysis_stamps = {
+            node: {Source.from_str(source): stamp for source, stamp in stamps.items()}
+            for node, stamps in data.get("analysis_stamps", {}).items()
         }
-        metadata.load_avg_1min = data.get("load_avg_1min", {})
-        metadata.load_avg_5min = data.get("load_avg_5min", {})
-        metadata.load_avg_15min = data.get("load_avg_15min", {})
+        metadata._insights = None
+        metadata._encoded_insights = data.get("insights", [])
         metadata.total_memory_kb = data.get("total_memory_kb", {})
-        metadata.total_used_swap_mb = data.get("total_used_swap_mb", {})
         metadata.total_cpu_count = data.get("total_cpu_count", {})
+        metadata.top_summaries = DecodedPerNode(
+            data.get("top_summaries", {}), _decode_summaries, _encode_summaries
+        )
+        metadata.thread_pool_cpu = data.get("thread_pool_cpu", {})
+        metadata.spans = [Span.from_dict(span) for span in data.get("spans", [])]
+        metadata.version = data.get("version", 0)
+        if "series" in data:
+            for attribute, stored in data["series"].items():
+                setattr(
+                    metadata,
+                    attribute,
+                    NodeSeries(Path(metadata.extract_path), attribute, stored),
+                )
+        else:
+            # Metadata written before the series were stored apart holds them all
+            for attribute in cls.SERIES_ATTRIBUTES:
+                values = metadata._new_series(attribute)
+                for node, value in data.get(attribute, {}).items():
+                    if attribute == "top_times":
+                        values[node] = seconds_since_midnight(
+                            datetime.strptime(t, "%H:%M:%S") for t in value
+                        )
+                    elif isinstance(value, dict):
+                        values[node] = Columns.from_dict(value)
+                    else:
+                        values[node] = np.asarray(value, dtype=np.float64)
+                setattr(metadata, attribute, values)
         return metadata
 
     def to_dict(self) -> dict:
         return {
             "original_filename": self.original_filename,
             "ddcheck_id": self.ddcheck_id,
+            "version": self.version,
             "upload_time": self.upload_time.isoformat(),
             "extract_path": self.extract_path,
             "nodes": self.nodes,
-            "insights": [insight.to_dict() for insight in self.insights],
-            "cpu_usage": self.cpu_usage or {},
-            "top_times": {
-                node: [t.strftime("%H:%M:%S") for t in times]
-                for node, times in self.top_times.items()
-            },
-            "load_avg_1min": self.load_avg_1min or {},
-            "load_avg_5min": self.load_avg_5min or {},
-            "load_avg_15min": self.load_avg_15min or {},
+            "insights": self._encode_insights(),
             "analysis_state": {
                 node: {
                     source.to_str(): state.to_str() for source, state in states.items()
                 }
                 for node, states in self.analysis_state.items()
             },
+            "analysis_stamps": {
+                node: {source.to_str(): stamp for source, stamp in stamps.items()}
+                for node, stamps in self.analysis_stamps.items()
+            },
             "total_memory_kb": self.total_memory_kb or {},
-            "total_used_swap_mb": self.total_used_swap_mb or {},
             "total_cpu_count": self.total_cpu_count or {},
+            "top_summaries": self.top_summaries.to_dict(),
+            "thread_pool_cpu": self.thread_pool_cpu,
+            "spans": [span.to_dict() for span in self.spans],
+            # Layout of the series, written apart by save_series
+            "series": {
+                attribute: getattr(self, attribute).layout()
+                for attribute in self.SERIES_ATTRIBUTES
+            },
         }
 
+    def extract_node(self, node: str) -> "DdcheckMetadata":
+        """Returns a copy of this metadata restricted to a single node.
+
+        This keeps what is sent to another process to analyse a node small.
+
+        Args:
+            node: Node whose data is copied
+
+        Returns:
+            DdcheckMetadata containing only the given node
+        """
+        node_metadata = DdcheckMetadata(
+            original_filename=self.original_filename,
+            ddcheck_id=self.ddcheck_id,
+            upload_time=self.upload_time,
+            extract_path=self.extract_path,
+            nodes=[node],
+        )
+        for attribute in self.PER_NODE_ATTRIBUTES:
+            values = getattr(self, attribute)
+            node_values = getattr(node_metadata, attribute)
+            if node in values:
+                node_values[node] = values[node]
+            else:
+                node_values.pop(node, None)
+        node_metadata.insights = InsightStore(self.insights.of_node(node))
+        return node_metadata
+
+    def merge_analysis(
+        self, node_metadata: "DdcheckMetadata", source: Source, facts: Collection[str]
+    ) -> None:
+        """Copies what the analysis of a source produced for the nodes of node_metadata.
+
+        Analyses of other sources may run at the same time on other copies of the same
+        node, so only the state, facts, insights and spans of the given source are
+        copied.
+
+        Args:
+            node_metadata: Metadata restricted to some nodes, as built by extract_node
+            source: Source that was analysed
+            facts: Per-node attributes produced by the analysis, e.g. total_cpu_count
+        """
+        for node in node_metadata.nodes:
+            state = node_metadata.analysis_state[node][source]
+            self.analysis_state[node][source] = state
+            stamp = node_metadata.analysis_stamps.get(node, {}).get(source)
+            if stamp is not None:
+                self.analysis_stamps.setdefault(node, {})[source] = stamp
+            else:
+                self.analysis_stamps.get(node, {}).pop(source, None)
+            for attribute in facts:
+                values = getattr(node_metadata, attribute)
+                if node in values:
+                    getattr(self, attribute)[node] = values[node]
+                else:
+                    # Cleared, e.g. by an analysis that is run again
+                    getattr(self, attribute).pop(node, None)
+            self.changed_analyses.add((node, source))
+        # Stages of the analysis of a source are named after it, e.g. "top.parse"
+        spans = [
+            span
+            for span in node_metadata.spans
+            if span.stage.startswith(f"{source.to_str()}.")
+        ]
+        replaced = {(span.stage, span.node) for span in spans}
+        self.spans = [
+            span for span in self.spans if (span.stage, span.node) not in replaced
+        ] + spans
+        for node in node_metadata.nodes:
+            for insight in self.insights.of_source(node, source):
+                self.insights.discard(insight)
+            for insight in node_metadata.insights.of_source(node, source):
+                self.insights.add(insight)
+
+    def adopt_analysis(
+        self,
+        written: "DdcheckMetadata",
+        node: str,
+        source: Source,
+        facts: Collection[str],
+    ) -> None:
+        """Copies the analysis of a source of a node from the metadata written by another
+        session of the same upload.
+
+        Unlike merge_analysis, the series are not copied but read from the files
+        written with it, so that they are not written again.
+
+        Args:
+            written: Metadata read from disk
+            node: Node whose analysis is copied
+            source: Source whose analysis is copied
+            facts: Per-node attributes produced by the analysis, e.g. total_cpu_count
+        """
+        self.analysis_state[node][source] = written.analysis_state[node][source]
+        stamp = written.analysis_stamps.get(node, {}).get(source)
+        if stamp is not None:
+            self.analysis_stamps.setdefault(node, {})[source] = stamp
+        else:
+            self.analysis_stamps.get(node, {}).pop(source, None)
+        for attribute in facts:
+            values = getattr(self, attribute)
+            written_values = getattr(written, attribute)
+            if isinstance(values, NodeSeries):
+                values.adopt(node, written_values)
+            elif node in written_values:
+                values[node] = written_values[node]
+            else:
+                values.pop(node, None)
+        stage_prefix = f"{source.to_str()}."
+        self.spans = [
+            span
+            for span in self.spans
+            if span.node != node or not span.stage.startswith(stage_prefix)
+        ] + [
+            span
+            for span in written.spans
+            if span.node == node and span.stage.startswith(stage_prefix)
+        ]
+        for insight in self.insights.of_source(node, source):
+            self.insights.discard(insight)
+        for insight in written.insights.of_source(node, source):
+            self.insights.add(insight)
+
+    def clear_analysis(self, node: str, source: Source, facts: Iterable[str]) -> None:
+        """Forgets the analysis of a source for a node, so that it can be run again.
+
+        Args:
+            node: Node whose analysis is cleared
+            source: Source whose analysis is cleared
+            facts: Per-node attributes produced by the analysis, e.g. total_cpu_count
+        """
+        self.analysis_state[node][source] = AnalysisState.NOT_STARTED
+        self.analysis_stamps.get(node, {}).pop(source, None)
+        self.changed_analyses.add((node, source))
+        for attribute in facts:
+            getattr(self, attribute).pop(node, None)
+        for insight in self.insights.of_source(node, source):
+            self.insights.discard(insight)
+
     def get_overall_analysis_state(self) -> AnalysisState:
         """Returns the overall analysis state by reducing all node and source states.
 
@@ -268,40 +690,45 @@ class DdcheckMetadata:
     def insights_per_node_and_qualifier(
         self,
     ) -> dict[str, dict[InsightQualifier, list[Insight]]]:
-        # Initialize a dictionary with all nodes and qualifiers
-        result: dict[str, dict[InsightQualifier, list[Insight]]] = {
-            node: {qualifier: [] for qualifier in InsightQualifier}
+        # Each group is sorted by source and then message by the insight store
+        return {
+            node: {
+                qualifier: [*self.insights.of_qualifier(node, qualifier)]
+                for qualifier in InsightQualifier
+            }
             for node in self.nodes
         }
-        # Group insights by node and qualifier
-        for insight in self.insights:
-            result[insight.node][insight.qualifier].append(insight)
-        # Sorting each group by source and then message
-        for node in result:
-            for qualifier in result[node]:
-                result[node][qualifier] = sorted(
-                    result[node][qualifier], key=lambda i: (i.source, i.message)
-                )
-        return result
 
     def insights_per_qualifier_and_node(
         self,
     ) -> dict[InsightQualifier, dict[str, list[Insight]]]:
-        # Initialize a dictionary with all qualifiers and nodes
-        result: dict[InsightQualifier, dict[str, list[Insight]]] = {
-            qualifier: {node: [] for node in self.nodes}
+        # Each group is sorted by source and then message by the insight store
+        return {
+            qualifier: {
+                node: [*self.insights.of_qualifier(node, qualifier)]
+                for node in self.nodes
+            }
             for qualifier in InsightQualifier
         }
-        # Group insights by qualifier and node
-        for insight in self.insights:
-            result[insight.qualifier][insight.node].append(insight)
-        # Sorting each group by source and then message
-        for qualifier in result:
-            for node in result[qualifier]:
-                result[qualifier][node] = sorted(
-                    result[qualifier][node], key=lambda i: (i.source, i.message)
-                )
-        return result
+
+
+def is_valid_node_name(node: Any) -> bool:
+    """Returns whether a node name read from a tarball can be used as a file name.
+
+    The series of a node are stored in a directory named after it, see NodeSeries,
+    so a name holding a path separator could write outside the upload directory.
+
+    Args:
+        node: Node name, as read from summary.json
+
+    Returns:
+        True if the name is a non-empty string and a single path component
+    """
+    return (
+        isinstance(node, str)
+        and node not in ("", ".", "..")
+        and not any(character in node for character in "/\\\0")
+    )
 
 
 EXTRACT_DIRECTORY = Path("/tmp/extracts")
@@ -0,0 +1,278 @@
+import functools
+import gzip
+import io
+import json
+import os
+import tarfile
+import zlib
+from bisect import bisect_right
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from fnmatch import fnmatchcase
+from pathlib import Path, PurePosixPath
+from typing import IO, Any, Generator, Optional
+
+ARCHIVE_FILENAME = "ddcheck.tar.gz"
+INDEX_FILENAME = "ddcheck-index.json"
+
+# Amount of uncompressed data between two restart points of the archive
+RESTART_INTERVAL = 1024 * 1024
+_READ_SIZE = 64 * 1024
+
+
+class TarballIndex:
+    """Locates the members of an archive written by IndexedTarballWriter.
+
+    The archive is a series of independent gzip members, each starting a restart
+    point, so a tarball member is read by seeking to the closest restart point
+    before it instead of decompressing the archive from the beginning.
+    """
+
+    # Offset of the data in the uncompressed tarball and size, per member name
+    members: dict[str, tuple[int, int]]
+    # Pairs of (uncompressed offset, compressed offset), sorted by offset
+    restart_points: list[tuple[int, int]]
+
+    def __init__(
+        self,
+        members: dict[str, tuple[int, int]],
+        restart_points: list[tuple[int, int]],
+    ):
+        self.members = members
+        self.restart_points = restart_points
+
+    def find(self, pattern: str) -> Optional[str]:
+        """
+        Find the first member matching a glob pattern such as "*/ttop/node/ttop.txt".
+
+        Like glob, wildcards do not match across "/".
+
+        :param pattern: Glob pattern of the member name
+        :return: Name of the matching member, or None if there is none
+        """
+        pattern_parts = PurePosixPath(pattern).parts
+        for name in self.members:
+            parts = PurePosixPath(name).parts
+            if len(parts) == len(pattern_parts) and all(
+                fnmatchcase(part, pattern_part)
+                for part, pattern_part in zip(parts, pattern_parts)
+            ):
+                return name
+        return None
+
+    def restart_point(self, offset: int) -> tuple[int, int]:
+        """Returns the last restart point at or before an uncompressed offset."""
+        position = bisect_right(self.restart_points, offset, key=lambda point: point[0])
+        return self.restart_points[position - 1]
+
+    def to_dict(self) -> dict:
+        return {
+            "members": {name: list(entry) for name, entry in self.members.items()},
+            "restart_points": [list(point) for point in self.restart_points],
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "TarballIndex":
+        return TarballIndex(
+            members={
+                name: (entry[0], entry[1]) for name, entry in data["members"].items()
+            },
+            restart_points=[(point[0], point[1]) for point in data["restart_points"]],
+        )
+
+
+class IndexedTarballWriter:
+    """Writes a seekable gzip-compressed tarball along with its TarballIndex.
+
+    The result is a regular .tar.gz that can still be read by tar or tarfile. Like
+    pigz, its blocks are compressed in parallel by a pool of threads.
+    """
+
+    def __init__(self, extract_path: Path, threads: Optional[int] = None):
+        """
+        :param extract_path: Directory of the upload
+        :param threads: Number of threads compressing the blocks, defaults to the
+            number of CPUs
+        """
+        self._extract_path = extract_path
+        self._file = open(extract_path / ARCHIVE_FILENAME, "wb")
+        self._block = bytearray()
+        self._offset = 0
+        self._members: dict[str, tuple[int, int]] = {}
+        self._restart_points: list[tuple[int, int]] = []
+        workers = threads or os.cpu_count() or 1
+        self._compressor = ThreadPoolExecutor(workers, "ddcheck-gzip")
+        self._max_pending_blocks = 2 * workers
+        # Blocks being compressed, with their uncompressed offset, in file order
+        self._pending_blocks: deque[tuple[int, Future[bytes]]] = deque()
+
+    def __enter__(self) -> "IndexedTarballWriter":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self._compressor.shutdown(cancel_futures=True)
+        self._file.close()
+
+    @contextmanager
+    def add_member(
+        self, member: tarfile.TarInfo
+    ) -> Generator[io.RawIOBase, None, None]:
+        """
+        Add a file to the tarball, its content being written to the yielded stream.
+
+        :param member: Description of the file, its size must match the content
+        """
+        header = member.tobuf(tarfile.PAX_FORMAT, "utf-8", "surrogateescape")
+        self.write(header)
+        name = PurePosixPath(member.name).as_posix()
+        self._members[name] = (self._offset, member.size)
+
+        content = _MemberWriter(self)
+        yield content
+
+        if content.written != member.size:
+            raise ValueError(
+                f"Expected {member.size} bytes for {name}, got {content.written}"
+            )
+        remainder = member.size % tarfile.BLOCKSIZE
+        if remainder:
+            self.write(tarfile.NUL * (tarfile.BLOCKSIZE - remainder))
+
+    def write(self, data: bytes) -> None:
+        """Append raw tar data, closing the current gzip member when it is full."""
+        view = memoryview(data)
+        while view:
+            count = min(len(view), RESTART_INTERVAL - len(self._block))
+            self._block += view[:count]
+            self._offset += count
+            view = view[count:]
+            if len(self._block) >= RESTART_INTERVAL:
+                self._flush_block()
+
+    def finish(self) -> TarballIndex:
+        """Finish the tarball and persist its index next to it."""
+        # End-of-archive marker, padded to a full record like tarfile does
+        self.write(tarfile.NUL * (tarfile.BLOCKSIZE * 2))
+        remainder = self._offset % tarfile.RECORDSIZE
+        if remainder:
+            self.write(tarfile.NUL * (tarfile.RECORDSIZE - remainder))
+        self._flush_block()
+        while self._pending_blocks:
+            self._write_compressed_block()
+        self._file.close()
+
+        index = TarballIndex(self._members, self._restart_points)
+        with open(self._extract_path / INDEX_FILENAME, "w") as f:
+            json.dump(index.to_dict(), f)
+        return index
+
+    def _flush_block(self) -> None:
+        if not self._block:
+            return
+        compressed = self._compressor.submit(gzip.compress, self._block, mtime=0)
+        self._pending_blocks.append((self._offset - len(self._block), compressed))
+        self._block = bytearray()
+        while len(self._pending_blocks) > self._max_pending_blocks:
+            self._write_compressed_block()
+
+    def _write_compressed_block(self) -> None:
+        offset, compressed = self._pending_blocks.popleft()
+        self._restart_points.append((offset, self._file.tell()))
+        self._file.write(compressed.result())
+
+
+class _MemberWriter(io.RawIOBase):
+    def __init__(self, archive: IndexedTarballWriter):
+        self._archive = archive
+        self.written = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data: bytes) -> int:  # type: ignore[override]
+        self._archive.write(data)
+        self.written += len(data)
+        return len(data)
+
+
+class _MemberReader(io.RawIOBase):
+    """Decompresses the archive from a restart point, up to the end of one member."""
+
+    def __init__(self, file: IO[bytes], skip: int, size: int):
+        self._file = file
+        self._skip = skip
+        self._remaining = size
+        self._decompressor = zlib.decompressobj(wbits=31)
+        self._pending = b""
+        self._position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer: memoryview) -> int:  # type: ignore[override]
+        while self._remaining and self._position == len(self._pending):
+            self._pending = self._inflate()
+            self._position = min(self._skip, len(self._pending))
+            self._skip -= self._position
+
+        start = self._position
+        count = min(len(buffer), len(self._pending) - start, self._remaining)
+        buffer[:count] = self._pending[start : start + count]
+        self._position += count
+        self._remaining -= count
+        return count
+
+    def close(self) -> None:
+        self._file.close()
+        super().close()
+
+    def _inflate(self) -> bytes:
+        if self._decompressor.eof:
+            # The next gzip member starts right after the current one
+            data = self._decompressor.unused_data or self._file.read(_READ_SIZE)
+            self._decompressor = zlib.decompressobj(wbits=31)
+        else:
+            data = self._file.read(_READ_SIZE)
+        if not data:
+            raise EOFError("Unexpected end of the archive")
+        return self._decompressor.decompress(data)
+
+
+@functools.lru_cache(maxsize=64)
+def load_index(extract_path: Path) -> TarballIndex:
+    """Load the index of an upload. It never changes once written, so it is cached."""
+    with open(extract_path / INDEX_FILENAME) as f:
+        return TarballIndex.from_dict(json.load(f))
+
+
+def find_member(extract_path: Path, pattern: str) -> Optional[str]:
+    """
+    Find a file of an upload by glob pattern, e.g. "*/ttop/node/ttop.txt".
+
+    :param extract_path: Directory of the upload
+    :param pattern: Glob pattern of the file name inside the tarball
+    :return: Name of the first matching file, or None if there is none
+    """
+    if not (extract_path / INDEX_FILENAME).exists():
+        return None
+    return load_index(extract_path).find(pattern)
+
+
+def open_member(extract_path: Path, name: str) -> io.BufferedReader:
+    """
+    Open a file of an upload for reading, without extracting the tarball.
+
+    :param extract_path: Directory of the upload
+    :param name: Name of the file inside the tarball, as returned by find_member
+    :return: Binary stream over the file content
+    """
+    index = load_index(extract_path)
+    offset, size = index.members[name]
+    uncompressed_offset, compressed_offset = index.restart_point(offset)
+
+    archive = open(extract_path / ARCHIVE_FILENAME, "rb")
+    archive.seek(compressed_offset)
+    return io.BufferedReader(
+        _MemberReader(archive, offset - uncompressed_offset, size), _READ_SIZE
+    )
@@ -0,0 +1,198 @@
+import logging
+import sqlite3
+from contextlib import closing
+from datetime import datetime
+from pathlib import Path
+
+from ddcheck.storage import EXTRACT_DIRECTORY, AnalysisState, DdcheckMetadata
+from ddcheck.storage.list import list_all_uploaded_tarballs
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Catalog of the uploads, so that listing them does not read every metadata file
+CATALOG_FILE = EXTRACT_DIRECTORY / "ddcheck-catalog.sqlite"
+
+# Columns the uploads can be sorted by, each one is indexed
+SORT_COLUMNS = ("upload_time", "original_filename", "node_count", "state", "size")
+
+# Stored in the user_version of the catalog once _SCHEMA is created, to be increased
+# whenever _SCHEMA changes
+_SCHEMA_VERSION = 1
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS uploads (
+    ddcheck_id TEXT PRIMARY KEY,
+    original_filename TEXT NOT NULL,
+    upload_time TEXT NOT NULL,
+    node_count INTEGER NOT NULL,
+    state TEXT NOT NULL,
+    size INTEGER NOT NULL
+);
+""" + "".join(
+    f"CREATE INDEX IF NOT EXISTS uploads_{column} ON uploads ({column}, ddcheck_id);\n"
+    for column in SORT_COLUMNS
+)
+
+
+class CatalogEntry:
+    """Row of the catalog, describing an upload."""
+
+    ddcheck_id: str
+    original_filename: str
+    upload_time: datetime
+    node_count: int
+    state: AnalysisState
+    # Size of the upload directory, in bytes
+    size: int
+
+    def __init__(
+        self,
+        ddcheck_id: str,
+        original_filename: str,
+        upload_time: datetime,
+        node_count: int,
+        state: AnalysisState,
+        size: int,
+    ):
+        self.ddcheck_id = ddcheck_id
+        self.original_filename = original_filename
+        self.upload_time = upload_time
+        self.node_count = node_count
+        self.state = state
+        self.size = size
+
+
+def record_upload(metadata: DdcheckMetadata) -> None:
+    """
+    Add an upload to the catalog, or update it if it is already there.
+
+    :param metadata: Metadata of the upload
+    """
+    with closing(_connect()) as connection, connection:
+        _upsert(connection, metadata)
+
+
+def forget_upload(ddcheck_id: str) -> None:
+    """
+    Remove an upload from the catalog, e.g. once it is deleted.
+
+    :param ddcheck_id: Unique ID for the upload
+    """
+    with closing(_connect()) as connection, connection:
+        connection.execute("DELETE FROM uploads WHERE ddcheck_id = ?", (ddcheck_id,))
+
+
+def count_uploads() -> int:
+    """
+    Count the uploads in the catalog.
+
+    :return: Number of uploads
+    """
+    with closing(_connect()) as connection:
+        count: int = connection.execute("SELECT COUNT(*) FROM uploads").fetchone()[0]
+        return count
+
+
+def list_uploads(
+    sort_by: str = "upload_time",
+    descending: bool = True,
+    limit: int = 50,
+    offset: int = 0,
+) -> list[CatalogEntry]:
+    """
+    List a page of the uploads in the catalog.
+
+    Uploads whose directory was deleted since they were recorded are dropped from
+    the catalog on the way.
+
+    :param sort_by: Column to sort by, one of SORT_COLUMNS
+    :param descending: Whether to sort in descending order
+    :param limit: Maximum number of uploads to return
+    :param offset: Number of uploads to skip
+    :return: Uploads of the page, in order
+    """
+    if sort_by not in SORT_COLUMNS:
+        raise ValueError(f"Cannot sort uploads by {sort_by}")
+    order = "DESC" if descending else "ASC"
+    with closing(_connect()) as connection:
+        while True:
+            rows = connection.execute(
+                "SELECT ddcheck_id, original_filename, upload_time, node_count, state,"
+                f" size FROM uploads ORDER BY {sort_by} {order}, ddcheck_id {order}"
+                " LIMIT ? OFFSET ?",
+                (limit, offset),
+            ).fetchall()
+            deleted = [
+                (row[0],) for row in rows if not (EXTRACT_DIRECTORY / row[0]).is_dir()
+            ]
+            if not deleted:
+                break
+            logger.info(f"Dropping {len(deleted)} deleted uploads from the catalog")
+            with connection:
+                connection.executemany(
+                    "DELETE FROM uploads WHERE ddcheck_id = ?", deleted
+                )
+    return [
+        CatalogEntry(
+            ddcheck_id=ddcheck_id,
+            original_filename=original_filename,
+            upload_time=datetime.fromisoformat(upload_time),
+            node_count=node_count,
+            state=AnalysisState.from_str(state),
+            size=size,
+        )
+        for ddcheck_id, original_filename, upload_time, node_count, state, size in rows
+    ]
+
+
+def rebuild_catalog() -> int:
+    """
+    Rebuild the catalog from the metadata files of the upload directories.
+
+    :return: Number of uploads in the catalog
+    """
+    uploads = list_all_uploaded_tarballs()
+    with closing(_connect()) as connection, connection:
+        connection.execute("DELETE FROM uploads")
+        for metadata in uploads:
+            _upsert(connection, metadata)
+    logger.info(f"Rebuilt the catalog of {len(uploads)} uploads in {CATALOG_FILE}")
+    return len(uploads)
+
+
+def _connect() -> sqlite3.Connection:
+    connection = sqlite3.connect(CATALOG_FILE, timeout=30)
+    (version,) = connection.execute("PRAGMA user_version").fetchone()
+    if version < _SCHEMA_VERSION:
+        # Idempotent, so connections racing to create it do no harm
+        connection.executescript(_SCHEMA + f"PRAGMA user_version = {_SCHEMA_VERSION};")
+    return connection
+
+
+def _upsert(connection: sqlite3.Connection, metadata: DdcheckMetadata) -> None:
+    row = connection.execute(
+        "SELECT size FROM uploads WHERE ddcheck_id = ?", (metadata.ddcheck_id,)
+    ).fetchone()
+    # Walked once, when the upload is ingested, later writes only change its state
+    size = _directory_size(Path(metadata.extract_path)) if row is None else row[0]
+    connection.execute(
+        "INSERT OR REPLACE INTO uploads VALUES (?, ?, ?, ?, ?, ?)",
+        (
+            metadata.ddcheck_id,
+            metadata.original_filename,
+            metadata.upload_time.isoformat(),
+            len(metadata.nodes),
+            metadata.get_overall_analysis_state().to_str(),
+            size,
+        ),
+    )
+
+
+def _directory_size(directory: Path) -> int:
+    return sum(path.stat().st_size for path in directory.rglob("*") if path.is_file())
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    rebuild_catalog()
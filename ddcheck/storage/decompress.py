@@ -0,0 +1,128 @@
+import io
+import queue
+import tarfile
+import threading
+import zlib
+from typing import IO, Iterator, Optional, Union
+
+import zstandard
+
+SUPPORTED_EXTENSIONS = (".tar.gz", ".tgz", ".tar.zst")
+
+_CHUNK_SIZE = 1024 * 1024
+# Number of decompressed chunks buffered ahead of the tar parser
+_QUEUE_DEPTH = 16
+_GZIP_MAGIC = b"\037\213"
+
+
+def open_decompressed(fileobj: IO[bytes], filename: str) -> io.RawIOBase:
+    """
+    Decompress a tarball on a background thread, to be read as a plain tar stream.
+
+    Inflating overlaps with whatever the caller does with the tar stream, as zlib
+    and zstd release the GIL while they decompress.
+
+    :param fileobj: Compressed tarball
+    :param filename: Name of the tarball, whose extension gives the compression
+    :return: Stream of the uncompressed tarball, to be closed by the caller
+    """
+    if filename.endswith(".tar.zst"):
+        return _PipelinedReader(_zstd_chunks(fileobj))
+    return _PipelinedReader(_gzip_chunks(fileobj))
+
+
+def _gzip_chunks(fileobj: IO[bytes]) -> Iterator[bytes]:
+    decompressor: Optional[zlib._Decompress] = None
+    members = 0
+    data = b""
+    while True:
+        # Between members, the magic of the next one may be split between two reads
+        if not data or (decompressor is None and len(data) < len(_GZIP_MAGIC)):
+            more = fileobj.read(_CHUNK_SIZE)
+            if more:
+                data += more
+                continue
+            if decompressor is not None:
+                # Like gzip, rather than accepting a tarball truncated e.g. while
+                # it was copied
+                raise EOFError(
+                    "Compressed file ended before the end-of-stream marker was reached"
+                )
+            if not data:
+                return
+        if decompressor is None:
+            # Multi-member gzip files (e.g. concatenated) continue with a new
+            # member, anything else after the end is ignored like gzip does
+            if not data.startswith(_GZIP_MAGIC):
+                if members == 0:
+                    raise zlib.error("not a gzip file")
+                return
+            decompressor = zlib.decompressobj(wbits=31)
+            members += 1
+        yield decompressor.decompress(data)
+        data = b""
+        if decompressor.eof:
+            data = decompressor.unused_data
+            decompressor = None
+
+
+def _zstd_chunks(fileobj: IO[bytes]) -> Iterator[bytes]:
+    reader = zstandard.ZstdDecompressor().stream_reader(
+        fileobj, read_size=_CHUNK_SIZE, read_across_frames=True
+    )
+    while chunk := reader.read(_CHUNK_SIZE):
+        yield chunk
+
+
+class _PipelinedReader(io.RawIOBase):
+    """Reads chunks produced by a background thread through a bounded queue."""
+
+    def __init__(self, chunks: Iterator[bytes]):
+        self._queue: queue.Queue[Union[bytes, Exception, None]] = queue.Queue(
+            _QUEUE_DEPTH
+        )
+        self._stopped = threading.Event()
+        self._chunk: Optional[bytes] = b""
+        self._position = 0
+        threading.Thread(target=self._produce, args=(chunks,), daemon=True).start()
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer: memoryview) -> int:  # type: ignore[override]
+        while self._chunk is not None and self._position == len(self._chunk):
+            item = self._queue.get()
+            if isinstance(item, Exception):
+                raise tarfile.ReadError(f"invalid compressed data: {item}") from item
+            self._chunk, self._position = item, 0
+        if self._chunk is None:
+            return 0
+
+        start = self._position
+        count = min(len(buffer), len(self._chunk) - start)
+        buffer[:count] = self._chunk[start : start + count]
+        self._position += count
+        return count
+
+    def close(self) -> None:
+        # Unblocks the producer if the reader stops before the end of the stream
+        self._stopped.set()
+        super().close()
+
+    def _produce(self, chunks: Iterator[bytes]) -> None:
+        try:
+            for chunk in chunks:
+                if chunk and not self._put(chunk):
+                    return
+            self._put(None)
+        except Exception as e:
+            self._put(e)
+
+    def _put(self, item: Union[bytes, Exception, None]) -> bool:
+        while not self._stopped.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
@@ -0,0 +1,69 @@
+from collections.abc import Iterator, MutableMapping
+from typing import Any, Callable, TypeVar
+
+V = TypeVar("V")
+
+# Marks a node missing from the encoded values
+_MISSING = object()
+
+
+class DecodedPerNode(MutableMapping[str, V]):
+    """Dict keyed by node whose values are decoded from JSON the first time they are
+    accessed, so that loading the metadata only decodes what is used.
+
+    Values that were never accessed are written back as they were read.
+    """
+
+    def __init__(
+        self,
+        encoded: dict[str, Any],
+        decode: Callable[[Any], V],
+        encode: Callable[[V], Any],
+    ):
+        """
+        :param encoded: JSON value of each node
+        :param decode: Converts the JSON value of a node
+        :param encode: Converts the value of a node back to JSON
+        """
+        self._encoded = encoded
+        self._decoded: dict[str, V] = {}
+        self._decode = decode
+        self._encode = encode
+
+    def __getitem__(self, node: str) -> V:
+        if node in self._decoded:
+            return self._decoded[node]
+        # Shared by the sessions of the cached metadata, so another thread may decode
+        # the same node meanwhile
+        encoded = self._encoded.get(node, _MISSING)
+        if encoded is _MISSING:
+            return self._decoded[node]
+        value = self._decoded.setdefault(node, self._decode(encoded))
+        self._encoded.pop(node, None)
+        return value
+
+    def __setitem__(self, node: str, value: V) -> None:
+        self._encoded.pop(node, None)
+        self._decoded[node] = value
+
+    def __delitem__(self, node: str) -> None:
+        if node in self._decoded:
+            del self._decoded[node]
+        else:
+            del self._encoded[node]
+
+    def __contains__(self, node: object) -> bool:
+        return node in self._decoded or node in self._encoded
+
+    def __iter__(self) -> Iterator[str]:
+        yield from self._decoded
+        yield from self._encoded
+
+    def __len__(self) -> int:
+        return len(self._decoded) + len(self._encoded)
+
+    def to_dict(self) -> dict[str, Any]:
+        """Returns the JSON value of each node."""
+        encoded = {node: self._encode(value) for node, value in self._decoded.items()}
+        encoded.update(self._encoded)
+        return encoded
@@ -1,7 +1,38 @@
 import json
+import threading
+from collections import OrderedDict
+from pathlib import Path
 from typing import Optional
 
 from ddcheck.storage import EXTRACT_DIRECTORY, DdcheckMetadata
+from ddcheck.storage.decompress import SUPPORTED_EXTENSIONS
+from ddcheck.storage.series import SERIES_DIRECTORY
+
+# Memory the cached metadata may use, estimated from the size of their files
+METADATA_CACHE_BYTES = 512 * 1024 * 1024
+
+
+class _CachedMetadata:
+    """Metadata read from disk, shared by all the sessions of the process."""
+
+    metadata: DdcheckMetadata
+    # Inode, modification time and size of the metadata file when it was read, as
+    # the file is replaced by each write, possibly within the same tick of mtime
+    signature: tuple[int, int, int]
+    # Size of the metadata and series files
+    size: int
+
+    def __init__(
+        self, metadata: DdcheckMetadata, signature: tuple[int, int, int], size: int
+    ):
+        self.metadata = metadata
+        self.signature = signature
+        self.size = size
+
+
+# Least recently used first
+_cache: OrderedDict[str, _CachedMetadata] = OrderedDict()
+_cache_lock = threading.Lock()
 
 
 def list_all_uploaded_tarballs() -> list[DdcheckMetadata]:
@@ -20,17 +51,90 @@ def list_all_uploaded_tarballs() -> list[DdcheckMetadata]:
     return results
 
 
+def find_tarballs(paths: list[Path]) -> list[Path]:
+    """
+    List the tarballs to process.
+
+    :param paths: Tarballs, or directories searched recursively for tarballs
+    :return: Tarballs, in the order of the paths then of their names
+    """
+    tarballs = []
+    for path in paths:
+        if path.is_dir():
+            tarballs += sorted(
+                file
+                for file in path.rglob("*")
+                if file.is_file() and file.name.endswith(SUPPORTED_EXTENSIONS)
+            )
+        else:
+            tarballs.append(path)
+    return tarballs
+
+
 def get_uploaded_metadata(ddcheck_id: str) -> Optional[DdcheckMetadata]:
     """
     Retrieve metadata for a specific upload ID.
 
+    The metadata is cached, and the same object is returned to every session as long
+    as the metadata file is not modified. It must not be modified, see
+    read_uploaded_metadata.
+
     :param ddcheck_id: Unique ID for the upload
     :return: DdcheckMetadata object if found, otherwise None
     """
     extract_path = EXTRACT_DIRECTORY / ddcheck_id
     metadata_file = extract_path / "ddcheck-metadata.json"
-    if metadata_file.exists():
-        with open(metadata_file) as f:
-            metadata_dict = json.load(f)
-            return DdcheckMetadata.from_dict(metadata_dict)
-    return None
+    try:
+        stat = metadata_file.stat()
+    except FileNotFoundError:
+        return None
+    signature = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    with _cache_lock:
+        cached = _cache.get(ddcheck_id)
+        if cached is not None and cached.signature == signature:
+            _cache.move_to_end(ddcheck_id)
+            return cached.metadata
+
+    with open(metadata_file) as f:
+        metadata_dict = json.load(f)
+    metadata = DdcheckMetadata.from_dict(metadata_dict)
+    size = _size(metadata_file) + _size(extract_path / SERIES_DIRECTORY)
+    with _cache_lock:
+        _cache[ddcheck_id] = _CachedMetadata(metadata, signature, size)
+        _cache.move_to_end(ddcheck_id)
+        total_size = sum(cached.size for cached in _cache.values())
+        while total_size > METADATA_CACHE_BYTES and len(_cache) > 1:
+            _, evicted = _cache.popitem(last=False)
+            total_size -= evicted.size
+    return metadata
+
+
+def read_uploaded_metadata(ddcheck_id: str) -> Optional[DdcheckMetadata]:
+    """
+    Read the metadata of an upload from disk, bypassing the cache, e.g. to modify it
+    and write it back.
+
+    :param ddcheck_id: Unique ID for the upload
+    :return: DdcheckMetadata object if found, otherwise None
+    """
+    try:
+        with open(EXTRACT_DIRECTORY / ddcheck_id / "ddcheck-metadata.json") as f:
+            return DdcheckMetadata.from_dict(json.load(f))
+    except FileNotFoundError:
+        return None
+
+
+def invalidate_cached_metadata(ddcheck_id: str) -> None:
+    """
+    Forget the cached metadata of an upload, e.g. because it is being written.
+
+    :param ddcheck_id: Unique ID for the upload
+    """
+    with _cache_lock:
+        _cache.pop(ddcheck_id, None)
+
+
+def _size(path: Path) -> int:
+    if path.is_file():
+        return path.stat().st_size
+    return sum(file.stat().st_size for file in path.rglob("*") if file.is_file())
@@ -0,0 +1,164 @@
+import os
+import uuid
+from collections.abc import Iterable, Iterator, Mapping, MutableMapping
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Optional, TypeVar
+
+import numpy as np
+from numpy.typing import ArrayLike
+
+SERIES_DIRECTORY = "series"
+
+V = TypeVar("V")
+
+
+class Columns(Mapping[str, np.ndarray]):
+    """Series of the same length, e.g. the CPU usage per key of a node, stored as the
+    rows of a single 2-D array of floats.
+
+    A DataFrame with a column per series shares the memory of the array when built
+    with pd.DataFrame(columns.array.T, columns=columns.names, copy=False).
+    """
+
+    names: list[str]
+    # One row per name, one column per sample
+    array: np.ndarray
+
+    def __init__(self, names: list[str], array: np.ndarray):
+        self.names = names
+        self.array = array
+        self._rows = {name: row for row, name in enumerate(names)}
+
+    @classmethod
+    def from_dict(cls, series: Mapping[str, ArrayLike]) -> "Columns":
+        """
+        :param series: Values of each series, keyed by name
+        :raise ValueError: If the series do not all have the same length
+        """
+        rows = [np.asarray(values, dtype=np.float64) for values in series.values()]
+        array = np.array(rows) if rows else np.zeros((0, 0))
+        return Columns(list(series), array)
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        row: np.ndarray = self.array[self._rows[name]]
+        return row
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.names)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+
+def seconds_since_midnight(times: Iterable[datetime]) -> np.ndarray:
+    """Returns the times of the day as int32 seconds since midnight."""
+    return np.array(
+        [t.hour * 3600 + t.minute * 60 + t.second for t in times], dtype=np.int32
+    )
+
+
+class NodeSeries(MutableMapping[str, V]):
+    """Series of one attribute of DdcheckMetadata, keyed by node.
+
+    The series of each node are stored as .npy files in the upload directory and
+    memory-mapped the first time the node is accessed, so that loading the metadata
+    does not read the series of every node. Nodes assigned since are written back
+    by save().
+
+    A value is either a 1-D array or Columns.
+    """
+
+    def __init__(
+        self,
+        extract_path: Path,
+        attribute: str,
+        stored: Optional[dict[str, Optional[list[str]]]] = None,
+    ):
+        """
+        :param extract_path: Directory of the upload
+        :param attribute: Name of the attribute of DdcheckMetadata
+        :param stored: Layout of the series already stored, as returned by layout()
+        """
+        self._directory = extract_path / SERIES_DIRECTORY
+        self._attribute = attribute
+        self._stored = dict(stored or {})
+        self._loaded: dict[str, V] = {}
+        self._modified: set[str] = set()
+
+    def __getitem__(self, node: str) -> V:
+        if node not in self._loaded:
+            if node not in self._stored:
+                raise KeyError(node)
+            self._loaded[node] = self._read(node, self._stored[node])
+        return self._loaded[node]
+
+    def __setitem__(self, node: str, value: V) -> None:
+        self._loaded[node] = value
+        self._stored[node] = value.names if isinstance(value, Columns) else None
+        self._modified.add(node)
+
+    def __delitem__(self, node: str) -> None:
+        del self._stored[node]
+        self._loaded.pop(node, None)
+        self._modified.discard(node)
+
+    def __contains__(self, node: object) -> bool:
+        return node in self._stored
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._stored)
+
+    def __len__(self) -> int:
+        return len(self._stored)
+
+    def layout(self) -> dict[str, Optional[list[str]]]:
+        """Returns the names of the Columns of each node, or None for an array."""
+        return dict(self._stored)
+
+    def adopt(self, node: str, written: "NodeSeries[V]") -> None:
+        """Use the series of a node as stored by another writer of the same upload,
+        without writing it again."""
+        self._loaded.pop(node, None)
+        self._modified.discard(node)
+        if node in written._stored:
+            self._stored[node] = written._stored[node]
+        else:
+            self._stored.pop(node, None)
+
+    def save(self) -> None:
+        """Write the series of the nodes assigned since they were loaded."""
+        for node in self._modified:
+            directory = self._directory / node
+            directory.mkdir(parents=True, exist_ok=True)
+            value: Any = self._loaded[node]
+            if isinstance(value, Columns):
+                value = value.array
+            # Replaced rather than rewritten, as other sessions may memory-map it
+            path = directory / f"{self._attribute}.npy"
+            temporary_file = path.with_suffix(f".{uuid.uuid4().hex}.tmp")
+            with open(temporary_file, "wb") as f:
+                np.save(f, value)
+            os.replace(temporary_file, path)
+        self._modified.clear()
+
+    def _read(self, node: str, names: Optional[list[str]]) -> Any:
+        path = self._directory / node / f"{self._attribute}.npy"
+        if names is None:
+            return _load(path)
+        if not path.exists():
+            # Written one file per name before Columns were stored as a whole
+            return Columns.from_dict(
+                {
+                    name: _load(path.with_suffix(f".{row}.npy"))
+                    for row, name in enumerate(names)
+                }
+            )
+        return Columns(names, _load(path))
+
+
+def _load(path: Path) -> np.ndarray:
+    # Empty arrays cannot be memory-mapped, their file only holds the .npy header
+    empty = path.stat().st_size <= 128
+    array: np.ndarray = np.load(path, mmap_mode=None if empty else "r")
+    return array
@@ -0,0 +1,153 @@
+import resource
+import time
+from collections.abc import Iterable, Iterator
+from contextlib import contextmanager
+
+
+class Span:
+    """Resources used by a stage of the ingestion or analysis of an upload."""
+
+    # Name of the stage, e.g. "ingest.stream" or "top.parse"
+    stage: str
+    # Node the stage worked on, empty for the stages of the whole upload
+    node: str
+    wall_seconds: float
+    # CPU time of the process during the stage, including the threads the stage used
+    # to decompress and compress, but also any other stage running at the same time
+    cpu_seconds: float
+    # Bytes of the files read by the stage, as reported by the stage itself
+    bytes_read: int
+    # Peak RSS of the process during the stage, including any stage running at the
+    # same time, or since the process started where the peak cannot be reset
+    peak_rss_bytes: int
+
+    def __init__(
+        self,
+        stage: str,
+        node: str = "",
+        wall_seconds: float = 0.0,
+        cpu_seconds: float = 0.0,
+        bytes_read: int = 0,
+        peak_rss_bytes: int = 0,
+    ):
+        self.stage = stage
+        self.node = node
+        self.wall_seconds = wall_seconds
+        self.cpu_seconds = cpu_seconds
+        self.bytes_read = bytes_read
+        self.peak_rss_bytes = peak_rss_bytes
+
+    def to_dict(self) -> dict:
+        return {
+            "stage": self.stage,
+            "node": self.node,
+            "wall_seconds": self.wall_seconds,
+            "cpu_seconds": self.cpu_seconds,
+            "bytes_read": self.bytes_read,
+            "peak_rss_bytes": self.peak_rss_bytes,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Span":
+        return Span(**data)
+
+
+# Stages being measured, by any thread, whose peak RSS is updated before it is reset
+_open_spans: list[Span] = []
+
+
+@contextmanager
+def record_span(spans: list[Span], stage: str, node: str = "") -> Iterator[Span]:
+    """
+    Measure a stage, e.g. with record_span(metadata.spans, "top.parse", node).
+
+    The span replaces the one previously recorded for the same stage and node, if
+    any. Stages that read files set the bytes_read of the yielded span.
+
+    :param spans: Spans the span of the stage is added to when the stage ends
+    :param stage: Name of the stage
+    :param node: Node the stage works on, empty for the stages of the whole upload
+    :return: Span of the stage
+    """
+    span = Span(stage, node)
+    # The peak is reset for this stage, so the stages it is nested in keep theirs
+    _update_open_spans()
+    _reset_peak_rss()
+    _open_spans.append(span)
+    wall_start, cpu_start = time.perf_counter(), time.process_time()
+    try:
+        yield span
+    finally:
+        span.wall_seconds = time.perf_counter() - wall_start
+        span.cpu_seconds = time.process_time() - cpu_start
+        _update_open_spans()
+        _open_spans.remove(span)
+        spans[:] = [s for s in spans if (s.stage, s.node) != (stage, node)]
+        spans.append(span)
+
+
+def _update_open_spans() -> None:
+    peak = peak_rss_bytes()
+    for span in _open_spans:
+        span.peak_rss_bytes = max(span.peak_rss_bytes, peak)
+
+
+def _reset_peak_rss() -> None:
+    # Only possible on Linux, elsewhere the peak of the process is kept
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def peak_rss_bytes() -> int:
+    """
+    Returns the peak RSS of the process, since the last stage started if it could
+    reset it.
+
+    The peak reported by getrusage is kept across exec, so that a process started by
+    a larger one, e.g. the job worker started by the server, would report the peak
+    of its parent. The peak of the process itself is read from /proc when available.
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    # In kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def to_prometheus(spans: Iterable[Span]) -> str:
+    """
+    Format spans as Prometheus metrics, in the text format of the textfile collector.
+
+    The spans of the nodes are summed per stage, except the peak RSS of which the
+    maximum is kept.
+
+    :param spans: Spans of an upload
+    :return: Metrics labelled by stage
+    """
+    per_stage: dict[str, Span] = {}
+    for span in spans:
+        total = per_stage.setdefault(span.stage, Span(span.stage))
+        total.wall_seconds += span.wall_seconds
+        total.cpu_seconds += span.cpu_seconds
+        total.bytes_read += span.bytes_read
+        total.peak_rss_bytes = max(total.peak_rss_bytes, span.peak_rss_bytes)
+
+    lines = []
+    for metric, description in [
+        ("wall_seconds", "Wall time of the stage for the last upload written"),
+        ("cpu_seconds", "CPU time of the stage for the last upload written"),
+        ("bytes_read", "Bytes read by the stage for the last upload written"),
+        ("peak_rss_bytes", "Peak RSS of the process during the stage"),
+    ]:
+        name = f"ddcheck_stage_{metric}"
+        lines += [f"# HELP {name} {description}", f"# TYPE {name} gauge"]
+        for stage, total in sorted(per_stage.items()):
+            lines.append(f'{name}{{stage="{stage}"}} {getattr(total, metric)}')
+    return "\n".join(lines) + "\n"
@@ -1,103 +1,556 @@
+import fcntl
+import hashlib
+import io
 import json
 import logging
+import os
 import shutil
 import tarfile
+import threading
 import uuid
+from contextlib import contextmanager
 from datetime import datetime
-from pathlib import Path
-from tarfile import TarInfo
-from typing import Generator, Optional
+from pathlib import Path, PurePosixPath
+from typing import IO, Any, Callable, Collection, Iterator, Optional, TypeVar
 
 from streamlit.runtime.uploaded_file_manager import UploadedFile
 
-from ddcheck.storage import EXTRACT_DIRECTORY, DdcheckMetadata
+from ddcheck.analysis.registry import (
+    dependencies_completed,
+    get_analyser,
+    get_analysers,
+)
+from ddcheck.storage import (
+    EXTRACT_DIRECTORY,
+    AnalysisState,
+    DdcheckMetadata,
+    Source,
+    is_valid_node_name,
+)
+from ddcheck.storage.archive import IndexedTarballWriter
+from ddcheck.storage.catalog import forget_upload, record_upload
+from ddcheck.storage.decompress import SUPPORTED_EXTENSIONS, open_decompressed
+from ddcheck.storage.list import invalidate_cached_metadata, read_uploaded_metadata
+from ddcheck.storage.spans import Span, record_span, to_prometheus
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
+T = TypeVar("T")
+
+# Maps the SHA-256 of every uploaded tarball to its ddcheck_id, as well as its
+# fingerprint, see _fingerprint
+UPLOAD_HASHES_FILE = EXTRACT_DIRECTORY / "ddcheck-upload-hashes.json"
+# Bytes read from each end of a seekable tarball to fingerprint it
+FINGERPRINT_BYTES = 1024 * 1024
+
+# Spans of the last upload ingested or analysed, for the textfile collector of
+# Prometheus
+METRICS_FILE = EXTRACT_DIRECTORY / "ddcheck-metrics.prom"
+
+# Metadata whose writes are deferred by coalesce_metadata_writes, per thread
+_deferred_writes = threading.local()
+
 
 def save_uploaded_tarball(uploaded_file: UploadedFile) -> Optional[DdcheckMetadata]:
     """
-    Extract the uploaded tarball and save metadata.
+    Save a tarball uploaded with Streamlit, see ingest_tarball.
 
     :param uploaded_file: Uploaded file object
-    :return: Path to the extracted directory
+    :return: Metadata of the upload, or None if the tarball is invalid
+    """
+    return ingest_tarball(uploaded_file, uploaded_file.name)
+
+
+def ingest_tarball(
+    fileobj: IO[bytes], filename: str, compression_threads: Optional[int] = None
+) -> Optional[DdcheckMetadata]:
+    """
+    Stream a tarball once, analysing it and keeping an indexed copy.
+
+    The files of the registered analysers, e.g. ttop.txt and os_info.txt, are parsed
+    while they are read from the archive, so the nodes whose files were found are
+    already analysed on return.
+    Useful files are kept compressed in a seekable tarball instead of extracted.
+    A tarball that was already uploaded is recognised by its SHA-256, computed while
+    it is streamed, and the metadata of the previous upload is returned instead. A
+    seekable file is also recognised by its fingerprint before it is streamed, so
+    that such a tarball is not decompressed nor parsed again.
+
+    :param fileobj: Tarball, read from its current position, once unless seekable
+    :param filename: Name of the tarball, whose extension tells its compression
+    :param compression_threads: Number of threads compressing the indexed copy,
+        defaults to the number of CPUs
+    :return: Metadata of the upload, or None if the tarball is invalid
     """
-    filename = uploaded_file.name
     logger.debug(f"Starting to process {filename}")
 
-    # Check if the file is a tarball (.tar.gz or .tgz), if not, return None
-    if not filename.endswith(".tar.gz") and not filename.endswith(".tgz"):
-        logger.error(f"Invalid file type: {filename} (must end with .tar.gz)")
+    # Check if the file is a tarball (.tar.gz, .tgz or .tar.zst), if not, return None
+    if not filename.endswith(SUPPORTED_EXTENSIONS):
+        logger.error(
+            f"Invalid file type: {filename} (must end with .tar.gz or .tar.zst)"
+        )
         return None
 
+    # Reuse the previous upload of the same tarball, if any
+    fingerprint: Optional[str] = None
+    if fileobj.seekable():
+        fingerprint = _fingerprint(fileobj)
+        existing_metadata = _find_upload_by_hash(fingerprint)
+        if existing_metadata is not None:
+            logger.debug(
+                f"{filename} was already uploaded as {existing_metadata.ddcheck_id}"
+            )
+            return existing_metadata
+
     # Create a unique directory for this upload
     extract_id = str(uuid.uuid4())
     extract_path = EXTRACT_DIRECTORY / extract_id
     extract_path.mkdir()
     logger.debug(f"Created extraction directory at {extract_path}")
 
-    # Extract the tarball and delete it
+    # Walk the tarball once, parsing the analysed members as they go by, and record
+    # each node as soon as all its files are parsed so that only the nodes being
+    # read are held in memory
     valid = True
+    hashing_file = _HashingReader(fileobj)
+    summary_data: Optional[dict] = None
+    metadata: Optional[DdcheckMetadata] = None
+    analysers = get_analysers()
+    # Parsed files of the nodes not recorded yet, keyed by node then source
+    parsed_files: dict[str, dict[Source, Optional[Any]]] = {}
+    spans: list[Span] = []
     try:
-        logger.debug("Extracting tarball contents")
-        with tarfile.open(fileobj=uploaded_file) as tar:
-
-            def only_useful_files(
-                members: list[TarInfo],
-            ) -> Generator[TarInfo, None, None]:
-                for member in members:
-                    if any(part in member.name for part in ["jfr", "logs", "queries"]):
-                        logger.debug(f"Skipping directory: {member.name}")
-                        continue
-                    yield member
+        logger.debug("Streaming tarball contents")
+        with (
+            record_span(spans, "ingest.stream") as stream_span,
+            IndexedTarballWriter(extract_path, compression_threads) as archive,
+            open_decompressed(
+                io.BufferedReader(hashing_file), filename
+            ) as uncompressed_file,
+            tarfile.open(fileobj=uncompressed_file, mode="r|") as tar,
+        ):
+            for member in tar:
+                parts = PurePosixPath(member.name).parts
+                if not member.isfile() or not parts or parts[0] == "/" or ".." in parts:
+                    continue
+                if any(part in member.name for part in ["jfr", "logs", "queries"]):
+                    logger.debug(f"Skipping file: {member.name}")
+                    continue
 
-            tar.extractall(
-                path=extract_path, members=only_useful_files(tar.getmembers())
-            )
+                if parts == ("summary.json",):
+                    summary_data = _extract_and_parse(tar, member, archive, _parse_json)
+                    metadata = _new_metadata(filename, extract_path, summary_data)
+                    if metadata is None:
+                        continue
+                    metadata.spans = spans
+                    # Only the nodes of the summary are recorded, all of them
+                    parsed_files = {
+                        node: parsed_files.get(node, {}) for node in metadata.nodes
+                    }
+                    for node in list(parsed_files):
+                        _record_node(metadata, node, parsed_files, walked=False)
+                    continue
+                for analyser in analysers:
+                    node = analyser.node_of(member.name)
+                    if node is None:
+                        continue
+                    if metadata is not None and node not in parsed_files:
+                        # Not a node of the summary
+                        _extract_and_parse(tar, member, archive, None)
+                        break
+                    stage = f"{analyser.source.to_str()}.parse"
+                    with record_span(spans, stage, node) as span:
+                        span.bytes_read = member.size
+                        parsed_files.setdefault(node, {})[analyser.source] = (
+                            _extract_and_parse(tar, member, archive, analyser.parse)
+                        )
+                    if metadata is not None:
+                        _record_node(metadata, node, parsed_files, walked=False)
+                    break
+                else:
+                    _extract_and_parse(tar, member, archive, None)
+            archive.finish()
+            # Read what follows the end of the tar archive so that it is hashed too
+            while uncompressed_file.read(1024 * 1024):
+                pass
+            stream_span.bytes_read = hashing_file.size
     except tarfile.ReadError:
         # The tarball could not be read, mark it as invalid
         logger.error("Failed to read tarball - file might be corrupted")
         valid = False
 
     # A valid tarball should have a summary.json file
-    summary_file = extract_path / "summary.json"
-    valid = valid and summary_file.exists()
-    if not summary_file.exists():
+    if summary_data is None:
         logger.error("Missing summary.json file in uploaded tarball")
+        valid = False
 
     # If the tarball is invalid, delete the extract directory and return None
-    if not valid:
+    if not valid or metadata is None:
         logger.error("Invalid tarball structure - cleaning up extraction directory")
         shutil.rmtree(extract_path)
         return None
 
-    # Read the summary.json file and collect node names
-    logger.debug("Reading summary.json and collecting node information")
-    with open(summary_file) as f:
-        summary_data = json.load(f)
-        executors = summary_data.get("executors", [])
-        coordinators = summary_data.get("coordinators", [])
-        nodes = executors + coordinators
-    logger.debug(f"Found {len(nodes)} nodes in the cluster data")
+    # Reuse the previous upload of the same tarball, if it was not fingerprinted
+    sha256 = hashing_file.sha256.hexdigest()
+    existing_metadata = _find_upload_by_hash(sha256)
+    if existing_metadata is not None:
+        logger.debug(
+            f"{filename} was already uploaded as {existing_metadata.ddcheck_id}"
+        )
+        shutil.rmtree(extract_path)
+        if fingerprint is not None:
+            _record_upload_hash([fingerprint], existing_metadata.ddcheck_id)
+        return existing_metadata
+
+    # Record the nodes missing files, which are skipped, now that the walk is over
+    for node in list(parsed_files):
+        _record_node(metadata, node, parsed_files, walked=True)
+    # Stamped once the index of the archive is written
+    for node in metadata.nodes:
+        for analyser in analysers:
+            metadata.analysis_stamps.setdefault(node, {})[analyser.source] = (
+                analyser.stamp(extract_path, node)
+            )
+
+    write_metadata_to_disk(metadata)
+    write_metrics(metadata)
+    _record_upload_hash(
+        [sha256] if fingerprint is None else [sha256, fingerprint], extract_id
+    )
+    logger.debug(f"Successfully processed {filename}")
+
+    return metadata
+
+
+def _fingerprint(fileobj: IO[bytes]) -> str:
+    """
+    Identify a seekable tarball by its size and both of its ends, without reading it.
+
+    Gzip, and zstd by default, end a compressed tarball with a checksum of its
+    content, so this recognises a tarball already uploaded before it is streamed.
+
+    :param fileobj: Tarball, from its current position, which is restored
+    :return: Size and SHA-256 of the ends, in a key of UPLOAD_HASHES_FILE
+    """
+    start = fileobj.tell()
+    size = fileobj.seek(0, os.SEEK_END) - start
+    digest = hashlib.sha256()
+    fileobj.seek(start)
+    digest.update(fileobj.read(FINGERPRINT_BYTES))
+    fileobj.seek(max(start, start + size - FINGERPRINT_BYTES))
+    digest.update(fileobj.read(FINGERPRINT_BYTES))
+    fileobj.seek(start)
+    return f"{size}:{digest.hexdigest()}"
+
+
+def _find_upload_by_hash(key: str) -> Optional[DdcheckMetadata]:
+    if not UPLOAD_HASHES_FILE.exists():
+        return None
+    with open(UPLOAD_HASHES_FILE) as f:
+        ddcheck_id = json.load(f).get(key)
+    # Returned to a caller that may analyse it, so not shared with the cache
+    return None if ddcheck_id is None else read_uploaded_metadata(ddcheck_id)
+
+
+def _record_upload_hash(keys: list[str], ddcheck_id: str) -> None:
+    with _update_upload_hashes() as upload_hashes:
+        for key in keys:
+            upload_hashes[key] = ddcheck_id
+
+
+def delete_upload(ddcheck_id: str) -> None:
+    """
+    Delete an upload, along with its entries in the catalog and in the hash index.
+
+    :param ddcheck_id: Unique ID for the upload
+    """
+    # Forgotten first, so that the same tarball is not deduplicated to it meanwhile
+    with _update_upload_hashes() as upload_hashes:
+        keys = [key for key, value in upload_hashes.items() if value == ddcheck_id]
+        for key in keys:
+            del upload_hashes[key]
+    forget_upload(ddcheck_id)
+    shutil.rmtree(EXTRACT_DIRECTORY / ddcheck_id, ignore_errors=True)
+    invalidate_cached_metadata(ddcheck_id)
+    logger.debug(f"Deleted upload {ddcheck_id}")
+
+
+@contextmanager
+def _update_upload_hashes() -> Iterator[dict[str, str]]:
+    # Tarballs may be ingested by several processes at once, e.g. by the ddcheck
+    # command, so updates are serialised and readers never see a partial file
+    with open(UPLOAD_HASHES_FILE.with_suffix(".lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        upload_hashes = {}
+        if UPLOAD_HASHES_FILE.exists():
+            with open(UPLOAD_HASHES_FILE) as f:
+                upload_hashes = json.load(f)
+        yield upload_hashes
+        temporary_file = UPLOAD_HASHES_FILE.with_suffix(".tmp")
+        with open(temporary_file, "w") as f:
+            json.dump(upload_hashes, f, indent=2)
+        os.replace(temporary_file, UPLOAD_HASHES_FILE)
+
+
+class _HashingReader(io.RawIOBase):
+    """Computes the SHA-256 of a file while it is being read, and counts the bytes
+    read."""
+
+    def __init__(self, fileobj: IO[bytes]):
+        self._fileobj = fileobj
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer: memoryview) -> int:  # type: ignore[override]
+        data = self._fileobj.read(len(buffer))
+        self.sha256.update(data)
+        self.size += len(data)
+        buffer[: len(data)] = data
+        return len(data)
+
+
+def _extract_and_parse(
+    tar: tarfile.TarFile,
+    member: tarfile.TarInfo,
+    archive: IndexedTarballWriter,
+    parse: Optional[Callable[[bytes], T]],
+) -> Optional[T]:
+    """
+    Copy a tarball member to the indexed archive and parse its content.
 
-    # Create metadata
-    metadata = DdcheckMetadata(
+    :return: Parsed content, or None if it could not be parsed or there is no parser
+    """
+    source = tar.extractfile(member)
+    assert source is not None
+    with source, archive.add_member(member) as target:
+        if parse is None:
+            shutil.copyfileobj(source, target)
+            return None
+        content = source.read()
+        target.write(content)
+    try:
+        return parse(content)
+    except Exception as e:
+        logger.error(f"Failed to parse {member.name}: {e}")
+        return None
+
+
+def _new_metadata(
+    filename: str, extract_path: Path, summary_data: Optional[dict]
+) -> Optional[DdcheckMetadata]:
+    """
+    Create the metadata of an upload from its summary.json file.
+
+    :return: Metadata of the upload, or None if the node names could not be read
+    """
+    if summary_data is None:
+        return None
+    # Collect node names from the summary.json file
+    executors = summary_data.get("executors", [])
+    coordinators = summary_data.get("coordinators", [])
+    nodes = executors + coordinators
+    logger.debug(f"Found {len(nodes)} nodes in the cluster data")
+    invalid_nodes = [node for node in nodes if not is_valid_node_name(node)]
+    if invalid_nodes:
+        logger.error(f"Invalid node names in summary.json: {invalid_nodes}")
+        return None
+    return DdcheckMetadata(
         original_filename=filename,
-        ddcheck_id=extract_id,
+        ddcheck_id=extract_path.name,
         upload_time=datetime.utcnow(),
         extract_path=str(extract_path),
         nodes=nodes,
     )
 
-    write_metadata_to_disk(metadata)
-    logger.debug(f"Successfully processed {filename}")
 
-    return metadata
+def _record_node(
+    metadata: DdcheckMetadata,
+    node: str,
+    parsed_files: dict[str, dict[Source, Optional[Any]]],
+    walked: bool,
+) -> None:
+    """
+    Record the parsed files of a node and forget them, once all of them are parsed
+    or once the tarball is walked, each analyser after those it depends on.
+    """
+    analysers = get_analysers()
+    parsed = parsed_files[node]
+    if not walked and len(parsed) < len(analysers):
+        return
+    del parsed_files[node]
+    for analyser in analysers:
+        stage = f"{analyser.source.to_str()}.record"
+        with record_span(metadata.spans, stage, node):
+            _record_parsed(metadata, node, analyser.source, parsed, analyser.record)
+
+
+def _record_parsed(
+    metadata: DdcheckMetadata,
+    node: str,
+    source: Source,
+    parsed: dict[Source, Optional[T]],
+    record: Callable[[DdcheckMetadata, str, T], AnalysisState],
+) -> None:
+    """
+    Record the parsed file of a node.
+
+    The analysis is marked skipped if the file was not found or if the analyses it
+    depends on did not complete.
+    """
+    parsed_file = parsed.get(source)
+    if source not in parsed:
+        logger.error(f"Could not find {source.to_str()} file for node {node}")
+        metadata.analysis_state[node][source] = AnalysisState.SKIPPED
+    elif not dependencies_completed(metadata, node, source):
+        logger.error(f"Missing dependencies of {source.to_str()} for node {node}")
+        metadata.analysis_state[node][source] = AnalysisState.SKIPPED
+    elif parsed_file is None:
+        metadata.analysis_state[node][source] = AnalysisState.FAILED
+    else:
+        try:
+            record(metadata, node, parsed_file)
+        except Exception as e:
+            logger.error(f"Error analysing {source.to_str()} for node {node}: {e}")
+            metadata.analysis_state[node][source] = AnalysisState.FAILED
+
+
+def _parse_json(content: bytes) -> dict:
+    return dict(json.loads(content))
 
 
 def write_metadata_to_disk(metadata: DdcheckMetadata) -> None:
+    """
+    Write the metadata of an upload and the series assigned since it was read.
+
+    The file is written to a temporary file that is then renamed, so that readers
+    never see a partial file, by one session or worker of the upload at a time. If
+    another one wrote the file since this metadata was read, the analyses it wrote
+    are merged first, except those in changed_analyses. Within
+    coalesce_metadata_writes, the write is deferred to the end of the block.
+
+    :param metadata: Metadata of the upload
+    """
+    deferred: Optional[dict[str, DdcheckMetadata]] = getattr(
+        _deferred_writes, "metadata", None
+    )
+    if deferred is not None:
+        deferred[metadata.ddcheck_id] = metadata
+        return
+    metadata_file = Path(metadata.extract_path) / "ddcheck-metadata.json"
+    with _lock_metadata(metadata.ddcheck_id):
+        # Read from the file rather than the cache, which may not see a file replaced
+        # within the same tick of its modification time
+        invalidate_cached_metadata(metadata.ddcheck_id)
+        try:
+            with open(metadata_file) as f:
+                written: Optional[dict] = json.load(f)
+        except FileNotFoundError:
+            written = None
+        if written is not None and written.get("version", 0) != metadata.version:
+            logger.debug(f"Merging the analyses written meanwhile to {metadata_file}")
+            _merge_written_analyses(metadata, DdcheckMetadata.from_dict(written))
+            metadata.version = max(metadata.version, written.get("version", 0))
+        _replace_metadata_file(metadata)
+
+
+def merge_analyses_to_disk(
+    ddcheck_id: str, results: Collection[tuple[DdcheckMetadata, Source]]
+) -> None:
+    """
+    Merge the analyses of sources into the metadata written on disk, at once.
+
+    Workers analysing other nodes or sources of the same upload merge their results
+    into the same file, one at a time. The file is read and written once whatever
+    the number of results, so a worker merges all the results it has at once.
+
+    :param ddcheck_id: Unique ID for the upload
+    :param results: Metadata restricted to some nodes, as built by extract_node,
+        with the source that was analysed
+    """
+    with _lock_metadata(ddcheck_id):
+        # Read under the lock, so that no other write is missed
+        metadata = read_uploaded_metadata(ddcheck_id)
+        if metadata is None:
+            raise ValueError(f"Upload {ddcheck_id} not found")
+        for node_metadata, source in results:
+            facts = get_analyser(source).produces
+            metadata.merge_analysis(node_metadata, source, facts)
+        _replace_metadata_file(metadata)
+
+
+def write_metrics(metadata: DdcheckMetadata) -> None:
+    """
+    Write the spans of an upload to METRICS_FILE, once it is ingested or analysed.
+
+    :param metadata: Metadata of the upload
+    """
+    # The file may be scraped at any time, so it is replaced rather than rewritten
+    temporary_file = METRICS_FILE.with_suffix(f".{uuid.uuid4().hex}.tmp")
+    with open(temporary_file, "w") as f:
+        f.write(to_prometheus(metadata.spans))
+    os.replace(temporary_file, METRICS_FILE)
+
+
+def _replace_metadata_file(metadata: DdcheckMetadata) -> None:
+    """Write the metadata of an upload, its lock being held by the caller."""
     metadata_file = Path(metadata.extract_path) / "ddcheck-metadata.json"
-    with open(metadata_file, "w") as f:
-        json.dump(metadata.to_dict(), f, indent=2)
+    metadata.version += 1
+    with record_span(metadata.spans, "metadata.write"):
+        metadata.save_series()
+        data = metadata.to_dict()
+    # Includes the span of this write, which ended after the metadata was converted
+    data["spans"] = [span.to_dict() for span in metadata.spans]
+    temporary_file = metadata_file.with_suffix(f".{uuid.uuid4().hex}.tmp")
+    with open(temporary_file, "w") as f:
+        json.dump(data, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary_file, metadata_file)
+    metadata.changed_analyses.clear()
+    invalidate_cached_metadata(metadata.ddcheck_id)
+    record_upload(metadata)
     logger.debug(f"Successfully wrote metadata to {metadata_file}")
+
+
+@contextmanager
+def coalesce_metadata_writes() -> Iterator[None]:
+    """
+    Defer the writes of metadata by this thread to the end of the block, so that a
+    burst of updates, e.g. one per node analysed, writes each upload once.
+    """
+    if getattr(_deferred_writes, "metadata", None) is not None:
+        # Written at the end of the outermost block
+        yield
+        return
+    deferred: dict[str, DdcheckMetadata] = {}
+    _deferred_writes.metadata = deferred
+    try:
+        yield
+    finally:
+        _deferred_writes.metadata = None
+        for metadata in deferred.values():
+            write_metadata_to_disk(metadata)
+
+
+@contextmanager
+def _lock_metadata(ddcheck_id: str) -> Iterator[None]:
+    # Advisory, taken by the writers of the metadata only, readers rely on the rename
+    with open(EXTRACT_DIRECTORY / ddcheck_id / "ddcheck-metadata.lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        yield
+
+
+def _merge_written_analyses(
+    metadata: DdcheckMetadata, written: DdcheckMetadata
+) -> None:
+    """Copies the analyses of written into metadata, except those it changed."""
+    for node in written.nodes:
+        for analyser in get_analysers():
+            if (node, analyser.source) not in metadata.changed_analyses:
+                metadata.adopt_analysis(
+                    written, node, analyser.source, analyser.produces
+                )
@@ -0,0 +1,201 @@
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+
+from watchdog.events import (
+    FileClosedEvent,
+    FileMovedEvent,
+    FileSystemEvent,
+    FileSystemEventHandler,
+)
+from watchdog.observers import Observer
+
+from ddcheck.jobs import (
+    FINISHED_STATES,
+    JOB_WORKERS,
+    get_job,
+    start_worker,
+    submit_path,
+)
+from ddcheck.storage import EXTRACT_DIRECTORY
+from ddcheck.storage.decompress import SUPPORTED_EXTENSIONS
+from ddcheck.storage.list import find_tarballs
+
+logger = logging.getLogger(__name__)
+
+# Seconds a tarball must stay unchanged to be considered fully written, when it is
+# not known to be closed or renamed, e.g. on file systems that do not report it
+SETTLE_SECONDS = 10
+# Jobs of the watcher that may be unfinished at the same time, the next tarballs wait
+MAX_PENDING_JOBS = 2 * JOB_WORKERS
+# Size and modification time of the tarballs already submitted, keyed by path
+SUBMITTED_FILE = EXTRACT_DIRECTORY / "ddcheck-watched.json"
+
+
+class _Candidate:
+    """Tarball seen by the watcher, submitted once it stops changing."""
+
+    # Size and modification time when the tarball was last seen changing
+    signature: tuple[int, int]
+    # time.monotonic() when the tarball was last seen changing
+    changed: float
+
+    def __init__(self, signature: tuple[int, int], changed: float):
+        self.signature = signature
+        self.changed = changed
+
+
+class TarballWatcher(FileSystemEventHandler):
+    """Submits the ingestion and analysis of the tarballs written to a directory."""
+
+    def __init__(self, directory: Path, settle_seconds: float = SETTLE_SECONDS):
+        """
+        :param directory: Directory watched recursively
+        :param settle_seconds: Seconds a tarball must stay unchanged to be submitted
+        """
+        self._directory = directory
+        self._settle_seconds = settle_seconds
+        self._candidates: dict[Path, _Candidate] = {}
+        self._lock = threading.Lock()
+        # Paths of the submitted jobs not finished yet, keyed by job
+        self._pending: dict[str, Path] = {}
+        self._submitted: dict[str, list[int]] = {}
+        if SUBMITTED_FILE.exists():
+            with open(SUBMITTED_FILE) as f:
+                self._submitted = json.load(f)
+
+    def on_any_event(self, event: FileSystemEvent) -> None:
+        if event.is_directory:
+            return
+        if isinstance(event, FileMovedEvent):
+            # Renamed once written, e.g. from a temporary name
+            self._see(Path(os.fsdecode(event.dest_path)), written=True)
+        else:
+            self._see(
+                Path(os.fsdecode(event.src_path)),
+                written=isinstance(event, FileClosedEvent),
+            )
+
+    def run(self) -> None:
+        """Watch the directory until interrupted, submitting the tarballs found."""
+        observer = Observer()
+        observer.schedule(self, str(self._directory), recursive=True)
+        observer.start()
+        # Tarballs written while the watcher was stopped
+        for tarball in find_tarballs([self._directory]):
+            self._see(tarball, written=False)
+        try:
+            while True:
+                self.submit_ready()
+                time.sleep(1)
+        finally:
+            observer.stop()
+            observer.join()
+
+    def submit_ready(self) -> None:
+        """Submit the tarballs that are fully written, if few enough jobs are pending."""
+        for job_id in list(self._pending):
+            job = get_job(job_id)
+            if job is None or job.state in FINISHED_STATES:
+                path = self._pending.pop(job_id)
+                state = "missing" if job is None else job.state.to_str()
+                logger.info(f"Job {job_id} for {path} is {state}")
+
+        now = time.monotonic()
+        ready = []
+        with self._lock:
+            for path, candidate in list(self._candidates.items()):
+                signature = _signature(path)
+                if signature is None:
+                    del self._candidates[path]
+                elif signature != candidate.signature:
+                    self._candidates[path] = _Candidate(signature, now)
+                elif now - candidate.changed >= self._settle_seconds:
+                    ready.append((candidate.changed, path))
+
+        for _, path in sorted(ready):
+            if len(self._pending) >= MAX_PENDING_JOBS:
+                break
+            with self._lock:
+                candidate = self._candidates.pop(path)
+            key = str(path)
+            if self._submitted.get(key) == list(candidate.signature):
+                continue
+            job = submit_path(path)
+            if job is not None:
+                logger.info(f"Submitted {path} as job {job.job_id}")
+                self._pending[job.job_id] = path
+            self._submitted[key] = list(candidate.signature)
+            _write_submitted(self._submitted)
+
+    def _see(self, path: Path, written: bool) -> None:
+        if not path.name.endswith(SUPPORTED_EXTENSIONS):
+            return
+        signature = _signature(path)
+        if signature is None:
+            return
+        with self._lock:
+            # A tarball known to be written is submitted without waiting
+            self._candidates[path] = _Candidate(
+                signature, float("-inf") if written else time.monotonic()
+            )
+
+
+def _signature(path: Path) -> Optional[tuple[int, int]]:
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+def _write_submitted(submitted: dict[str, list[int]]) -> None:
+    temporary_file = SUBMITTED_FILE.with_suffix(".tmp")
+    with open(temporary_file, "w") as f:
+        json.dump(submitted, f, indent=2)
+    os.replace(temporary_file, SUBMITTED_FILE)
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    """
+    Ingest and analyse the tarballs written to a directory, e.g. by the collectors.
+
+    :param argv: Command line arguments, defaults to sys.argv[1:]
+    :return: Exit status
+    """
+    parser = argparse.ArgumentParser(
+        prog="ddcheck-watch",
+        description="Ingest and analyse the tarballs written to a directory.",
+    )
+    parser.add_argument("directory", type=Path, help="Directory watched recursively")
+    parser.add_argument(
+        "--settle-seconds",
+        type=float,
+        default=SETTLE_SECONDS,
+        help="Seconds a tarball must stay unchanged to be considered fully written, "
+        f"unless it is closed or renamed (default: {SETTLE_SECONDS})",
+    )
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args(argv)
+    logging.basicConfig(
+        level=logging.DEBUG if args.verbose else logging.INFO,
+        format="%(asctime)s %(levelname)s %(name)s: %(message)s",
+    )
+
+    start_worker()
+    logger.info(f"Watching {args.directory}")
+    try:
+        TarballWatcher(args.directory, args.settle_seconds).run()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
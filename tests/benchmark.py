@@ -0,0 +1,101 @@
+"""Benchmark of the upload ingestion against the original tarfile extraction.
+
+Usage: python -m tests.benchmark --size-mb 4096 --compression gz
+"""
+
+import argparse
+import multiprocessing
+import tarfile
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Callable, cast
+
+from streamlit.runtime.uploaded_file_manager import UploadedFile
+
+from ddcheck.storage.spans import Span, peak_rss_bytes, record_span
+from ddcheck.storage.upload import delete_upload, save_uploaded_tarball
+from tests.synthetic import write_synthetic_tarball
+
+
+def extract_tarball(tarball: Path, extract_path: Path) -> None:
+    """Extraction as originally done on upload, with tarfile.open and extractall."""
+    with tarfile.open(tarball) as tar:
+        members = [
+            member
+            for member in tar.getmembers()
+            if not any(part in member.name for part in ["jfr", "logs", "queries"])
+        ]
+        tar.extractall(path=extract_path, members=members)
+
+
+def ingest_tarball(tarball: Path, extract_path: Path) -> None:
+    with open(tarball, "rb") as f:
+        metadata = save_uploaded_tarball(cast(UploadedFile, f))
+    assert metadata is not None, f"Failed to ingest {tarball}"
+    delete_upload(metadata.ddcheck_id)
+
+
+def ingest_peak_rss(tarball: Path) -> tuple[int, int]:
+    """
+    Measure the memory used to ingest a tarball read from disk, in a new process.
+
+    :return: Peak RSS in bytes of the process before and after the ingestion
+    """
+    with ProcessPoolExecutor(
+        max_workers=1, mp_context=multiprocessing.get_context("spawn")
+    ) as executor:
+        return executor.submit(_ingest_peak_rss, tarball).result()
+
+
+def _ingest_peak_rss(tarball: Path) -> tuple[int, int]:
+    before = peak_rss_bytes()
+    # The stages of the ingestion reset the peak, which the span keeps
+    spans: list[Span] = []
+    with (
+        tempfile.TemporaryDirectory() as extract_path,
+        record_span(spans, "benchmark.ingest") as span,
+    ):
+        ingest_tarball(tarball, Path(extract_path))
+    return before, span.peak_rss_bytes
+
+
+def time_it(function: Callable[[Path, Path], None], tarball: Path) -> float:
+    with tempfile.TemporaryDirectory() as extract_path:
+        start = time.perf_counter()
+        function(tarball, Path(extract_path))
+        return time.perf_counter() - start
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size-mb", type=int, default=1024)
+    parser.add_argument("--nodes", type=int, default=8)
+    parser.add_argument("--samples", type=int, default=28800)
+    parser.add_argument("--threads", type=int, default=0)
+    parser.add_argument("--compression", choices=["gz", "zst"], default="gz")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        tarball = Path(directory) / f"synthetic.tar.{args.compression}"
+        log_size = args.size_mb * 1024 * 1024 // args.nodes
+        write_synthetic_tarball(
+            tarball, args.nodes, args.samples, log_size, args.threads
+        )
+        print(f"Generated {tarball.stat().st_size / 1024 / 1024:.0f} MiB {tarball}")
+
+        if args.compression == "gz":
+            extraction = time_it(extract_tarball, tarball)
+            print(f"tarfile.open + extractall: {extraction:.2f}s")
+        ingestion = time_it(ingest_tarball, tarball)
+        print(f"save_uploaded_tarball:     {ingestion:.2f}s (includes ttop parsing)")
+        before, peak = ingest_peak_rss(tarball)
+        print(
+            f"Peak RSS of the ingestion: {peak / 2**20:.0f} MiB "
+            f"({(peak - before) / 2**20:.0f} MiB more than the idle process)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+"""End-to-end benchmark of the ingestion, analysis and metadata of a synthetic upload.
+
+Each stage is run --repeat times and its fastest run is kept, and the peak RSS of
+the ingestion is measured in a new process. The results can be written as JSON and
+compared to the results of a previous run, in which case the exit status is 1 if any
+stage got slower by more than --threshold, unless by less than --noise seconds, or
+if the ingestion used more than --threshold more memory.
+
+Usage: python -m tests.benchmark_suite --output results.json --baseline baseline.json
+"""
+
+import argparse
+import json
+import multiprocessing
+import platform
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Optional
+
+from ddcheck.analysis.osinfo import analyse_os_info
+from ddcheck.analysis.registry import get_analyser
+from ddcheck.analysis.top import analyse_top_output
+from ddcheck.storage import DdcheckMetadata, Source
+from ddcheck.storage.upload import (
+    delete_upload,
+    ingest_tarball,
+    write_metadata_to_disk,
+)
+from tests.benchmark import ingest_peak_rss
+from tests.synthetic import write_synthetic_tarball
+
+STAGES = (
+    "ingest_tarball",
+    "analyse_top_output",
+    "analyse_os_info",
+    "to_dict",
+    "from_dict",
+    "write_metadata_to_disk",
+    "insight_groupings",
+)
+
+
+def run_stages(tarball: Path) -> dict[str, float]:
+    """
+    Run every stage once on an upload of a tarball, which is deleted afterwards.
+
+    :param tarball: Synthetic tarball
+    :return: Duration in seconds of each stage
+    """
+    timings = {}
+
+    def timed(stage: str, function: Callable[[], object]) -> None:
+        start = time.perf_counter()
+        function()
+        timings[stage] = time.perf_counter() - start
+
+    uploads: list[Optional[DdcheckMetadata]] = []
+    with open(tarball, "rb") as f:
+        timed("ingest_tarball", lambda: uploads.append(ingest_tarball(f, tarball.name)))
+    metadata = uploads[0]
+    assert metadata is not None, f"Failed to ingest {tarball}"
+    try:
+        for stage, source, analyse in [
+            ("analyse_top_output", Source.TOP, analyse_top_output),
+            ("analyse_os_info", Source.OS_INFO, analyse_os_info),
+        ]:
+            # Analysed during ingestion, so cleared to be analysed again
+            for node in metadata.nodes:
+                metadata.clear_analysis(node, source, get_analyser(source).produces)
+            timed(stage, lambda: [analyse(metadata, node) for node in metadata.nodes])
+
+        data = {}
+        timed("to_dict", lambda: data.update(metadata.to_dict()))
+        timed("from_dict", lambda: DdcheckMetadata.from_dict(data))
+        timed("write_metadata_to_disk", lambda: write_metadata_to_disk(metadata))
+        timed(
+            "insight_groupings",
+            lambda: (
+                metadata.insights_per_node_and_qualifier(),
+                metadata.insights_per_qualifier_and_node(),
+            ),
+        )
+    finally:
+        delete_upload(metadata.ddcheck_id)
+    return timings
+
+
+def compare(
+    results: dict[str, float],
+    baseline: dict[str, float],
+    threshold: float,
+    noise: float,
+    unit: str,
+) -> list[str]:
+    """
+    Print the results next to a baseline.
+
+    :param results: Measure of each stage, e.g. its duration in seconds
+    :param baseline: Measure of each stage in the baseline
+    :param threshold: Increase above which a stage is a regression, e.g. 0.2 for 20%
+    :param noise: Increase below which a stage is never a regression
+    :param unit: Unit of the measures, e.g. "s"
+    :return: Stages that regressed
+    """
+    regressions = []
+    print(f"{'stage':<24}{'baseline':>12}{'current':>12}{'change':>9}")
+    for stage, value in results.items():
+        if stage not in baseline:
+            print(f"{stage:<24}{'':>12}{f'{value:.3f}{unit}':>12}")
+            continue
+        change = value / baseline[stage] - 1 if baseline[stage] else 0.0
+        regressed = change > threshold and value - baseline[stage] > noise
+        if regressed:
+            regressions.append(stage)
+        print(
+            f"{stage:<24}{f'{baseline[stage]:.3f}{unit}':>12}"
+            f"{f'{value:.3f}{unit}':>12}{change:>+9.0%}"
+            + ("  REGRESSION" if regressed else "")
+        )
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--nodes", type=int, default=8)
+    parser.add_argument("--samples", type=int, default=28800)
+    parser.add_argument("--interval", type=int, default=3)
+    parser.add_argument("--threads", type=int, default=0)
+    parser.add_argument("--cpus", type=int, default=16)
+    parser.add_argument("--compression", choices=["gz", "zst"], default="gz")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", type=Path, help="File the results are written to")
+    parser.add_argument("--baseline", type=Path, help="Results of a previous run")
+    parser.add_argument("--threshold", type=float, default=0.2)
+    parser.add_argument("--noise", type=float, default=0.01)
+    args = parser.parse_args()
+
+    parameters = {
+        "nodes": args.nodes,
+        "samples": args.samples,
+        "interval": args.interval,
+        "threads": args.threads,
+        "cpus": args.cpus,
+        "compression": args.compression,
+    }
+    results = {stage: float("inf") for stage in STAGES}
+    with tempfile.TemporaryDirectory() as directory:
+        tarball = Path(directory) / f"synthetic.tar.{args.compression}"
+        write_synthetic_tarball(
+            tarball,
+            args.nodes,
+            args.samples,
+            threads=args.threads,
+            interval=args.interval,
+            cpus=args.cpus,
+        )
+        for _ in range(args.repeat):
+            for stage, seconds in run_stages(tarball).items():
+                results[stage] = min(results[stage], seconds)
+        before, peak = ingest_peak_rss(tarball)
+    # Memory used by the ingestion, in MiB, not counting the interpreter and modules
+    memory = {"ingest_tarball": (peak - before) / 2**20}
+
+    report = {
+        "parameters": parameters,
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": multiprocessing.cpu_count(),
+        },
+        "results": results,
+        "peak_rss_mib": memory,
+    }
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline is None:
+        for stage, seconds in results.items():
+            print(f"{stage:<24}{seconds:>11.3f}s")
+        for stage, mib in memory.items():
+            print(f"{stage + ' peak RSS':<24}{mib:>9.1f}MiB")
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline["parameters"] != parameters:
+        print(f"Baseline was run with different parameters: {baseline['parameters']}")
+        return 1
+    regressions = compare(
+        results, baseline["results"], args.threshold, args.noise, "s"
+    ) + compare(memory, baseline.get("peak_rss_mib", {}), args.threshold, 16, "MiB")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
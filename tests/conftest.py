@@ -0,0 +1,41 @@
+import tempfile
+from pathlib import Path
+
+import pytest
+
+from ddcheck import jobs, watch
+from ddcheck.storage import DdcheckMetadata, catalog, upload
+from ddcheck.storage import list as upload_list
+from ddcheck.storage.upload import ingest_tarball
+from tests.synthetic import write_synthetic_tarball
+
+
+@pytest.fixture
+def extract_directory(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Path:
+    """Directory of the uploads, the catalog and the jobs, instead of /tmp/extracts."""
+    for module in (upload, catalog, upload_list, jobs):
+        monkeypatch.setattr(module, "EXTRACT_DIRECTORY", tmp_path)
+    monkeypatch.setattr(
+        upload, "UPLOAD_HASHES_FILE", tmp_path / "ddcheck-upload-hashes.json"
+    )
+    monkeypatch.setattr(upload, "METRICS_FILE", tmp_path / "ddcheck-metrics.prom")
+    monkeypatch.setattr(catalog, "CATALOG_FILE", tmp_path / "ddcheck-catalog.sqlite")
+    jobs_directory = tmp_path / "ddcheck-jobs"
+    monkeypatch.setattr(jobs, "JOBS_DIRECTORY", jobs_directory)
+    monkeypatch.setattr(jobs, "TASKS_DIRECTORY", jobs_directory / "tasks")
+    monkeypatch.setattr(jobs, "FINISHED_JOBS_DIRECTORY", jobs_directory / "finished")
+    monkeypatch.setattr(jobs, "WORKERS_DIRECTORY", jobs_directory / "workers")
+    monkeypatch.setattr(watch, "SUBMITTED_FILE", tmp_path / "ddcheck-watched.json")
+    return tmp_path
+
+
+@pytest.fixture
+def uploaded(extract_directory: Path) -> DdcheckMetadata:
+    """Ingested synthetic upload of two nodes."""
+    with tempfile.TemporaryDirectory() as directory:
+        tarball = Path(directory) / "synthetic.tar.gz"
+        write_synthetic_tarball(tarball, nodes=2, samples=60)
+        with open(tarball, "rb") as f:
+            metadata = ingest_tarball(f, tarball.name)
+    assert metadata is not None
+    return metadata
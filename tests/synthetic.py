@@ -0,0 +1,172 @@
+"""Generator of synthetic Dremio diagnostics tarballs, for benchmarks."""
+
+import io
+import json
+import random
+import tarfile
+from pathlib import Path
+from typing import IO
+
+import zstandard
+
+_OS_INFO = """MemTotal:       {memory_kb} kB
+Architecture:                    x86_64
+CPU(s):                          {cpus}
+On-line CPU(s) list:             0-{last_cpu}
+"""
+
+
+def generate_ttop(
+    samples: int, seed: int = 0, threads: int = 0, interval: int = 3
+) -> str:
+    """
+    Generate the content of a ttop.txt file.
+
+    :param samples: Number of snapshots
+    :param seed: Seed of the random values
+    :param threads: Number of thread rows listed in each snapshot
+    :param interval: Number of seconds between snapshots
+    """
+    rng = random.Random(seed)
+    thread_names = [
+        f"e{i % 64} - {rng.getrandbits(32):08x}" if i % 4 else f"qtp{seed}-{i}"
+        for i in range(threads)
+    ]
+    lines = []
+    for sample in range(samples):
+        seconds = sample * interval
+        time = f"{seconds // 3600 % 24:02d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+        us, sy, wa = rng.uniform(0, 80), rng.uniform(0, 10), rng.uniform(0, 5)
+        idle = 100 - us - sy - wa
+        load = [rng.uniform(0, 20) for _ in range(3)]
+        lines.append(
+            f"top - {time} up 10 days,  3:02,  0 users,  load average: "
+            f"{load[0]:.2f}, {load[1]:.2f}, {load[2]:.2f}\n"
+            "Threads: 300 total,   1 running, 299 sleeping,   0 stopped,   0 zombie\n"
+            f"%Cpu(s): {us:4.1f} us, {sy:4.1f} sy,  0.0 ni, {idle:4.1f} id, "
+            f"{wa:4.1f} wa,  0.0 hi,  0.0 si,  0.0 st\n"
+            "MiB Mem :  64316.4 total,   1024.0 free,  30000.0 used,  33292.4 buff/cache\n"
+            "MiB Swap:      0.0 total,      0.0 free,      0.0 used.  33292.4 avail Mem\n"
+            "\n"
+        )
+        if thread_names:
+            lines.append(
+                "    PID USER      PR  NI    VIRT    RES    SHR S  %CPU  %MEM     "
+                "TIME+ COMMAND\n"
+            )
+        for pid, name in enumerate(thread_names, 1000):
+            lines.append(
+                f"{pid:7d} dremio    20   0   40.1g  20.3g  50000 S "
+                f"{rng.expovariate(0.2):5.1f}   0.1   1:23.45 {name}\n"
+            )
+    return "".join(lines)
+
+
+def generate_log_block(seed: int = 0) -> bytes:
+    """Generate 1 MiB of server.log lines, repeated to build large log files."""
+    rng = random.Random(seed)
+    block = io.StringIO()
+    while block.tell() < 1024 * 1024:
+        block.write(
+            f"2025-02-12 15:{rng.randrange(60):02d}:{rng.randrange(60):02d},"
+            f"{rng.randrange(1000):03d} [e{rng.randrange(64)} - {rng.getrandbits(64):x}] "
+            f"INFO  c.d.e.w.f.FragmentExecutor - {rng.getrandbits(128):x} state "
+            f"{rng.choice(['RUNNING', 'FINISHED', 'AWAITING_ALLOCATION'])}\n"
+        )
+    return block.getvalue().encode()
+
+
+def write_synthetic_tarball(
+    path: Path,
+    nodes: int = 4,
+    samples: int = 1200,
+    log_size: int = 0,
+    threads: int = 0,
+    interval: int = 3,
+    cpus: int = 16,
+) -> None:
+    """
+    Write a diagnostics tarball compressed according to the extension of its path.
+
+    :param path: Destination, ending with .tar.gz or .tar.zst
+    :param nodes: Number of executors, one of them being the coordinator
+    :param samples: Number of ttop snapshots per node
+    :param log_size: Size in bytes of the server.log file of each node
+    :param threads: Number of thread rows in each ttop snapshot
+    :param interval: Number of seconds between ttop snapshots
+    :param cpus: Number of CPUs listed in os_info.txt, with 4 GiB of RAM each
+    """
+    names = [f"node-{i}.dremio.local" for i in range(nodes)]
+    with open(path, "wb") as f:
+        if path.name.endswith(".tar.zst"):
+            compressor = zstandard.ZstdCompressor(level=3, threads=-1)
+            with compressor.stream_writer(f) as zst:
+                _write_tar(zst, names, samples, log_size, threads, interval, cpus)
+        else:
+            with tarfile.open(fileobj=f, mode="w:gz", compresslevel=1) as tar:
+                _add_members(tar, names, samples, log_size, threads, interval, cpus)
+
+
+def _write_tar(
+    fileobj: IO[bytes],
+    names: list[str],
+    samples: int,
+    log_size: int,
+    threads: int,
+    interval: int,
+    cpus: int,
+) -> None:
+    with tarfile.open(fileobj=fileobj, mode="w|") as tar:
+        _add_members(tar, names, samples, log_size, threads, interval, cpus)
+
+
+def _add_members(
+    tar: tarfile.TarFile,
+    names: list[str],
+    samples: int,
+    log_size: int,
+    threads: int,
+    interval: int,
+    cpus: int,
+) -> None:
+    summary = {"executors": names[1:], "coordinators": names[:1]}
+    _add_file(tar, "summary.json", json.dumps(summary).encode())
+    for seed, name in enumerate(names):
+        ttop = generate_ttop(samples, seed, threads, interval).encode()
+        _add_file(tar, f"ddc/ttop/{name}/ttop.txt", ttop)
+        os_info = _OS_INFO.format(
+            memory_kb=cpus * 4 * 1024 * 1024, cpus=cpus, last_cpu=cpus - 1
+        )
+        _add_file(tar, f"ddc/node-info/{name}/os_info.txt", os_info.encode())
+        if log_size:
+            log = io.BufferedReader(_RepeatedBlock(generate_log_block(seed)))
+            _add_file(tar, f"ddc/logs/{name}/server.log", log, log_size)
+
+
+def _add_file(
+    tar: tarfile.TarFile, name: str, data: bytes | IO[bytes], size: int = 0
+) -> None:
+    member = tarfile.TarInfo(name)
+    if isinstance(data, bytes):
+        member.size = len(data)
+        tar.addfile(member, io.BytesIO(data))
+    else:
+        member.size = size
+        tar.addfile(member, data)
+
+
+class _RepeatedBlock(io.RawIOBase):
+    """Endless stream repeating a block, to write large files in constant memory."""
+
+    def __init__(self, block: bytes):
+        self._block = block
+        self._position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer: memoryview) -> int:  # type: ignore[override]
+        count = min(len(buffer), len(self._block) - self._position)
+        buffer[:count] = self._block[self._position : self._position + count]
+        self._position = (self._position + count) % len(self._block)
+        return count
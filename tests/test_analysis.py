@@ -0,0 +1,42 @@
+"""Checks the order in which the analysers of a node are run."""
+
+import tarfile
+from datetime import datetime
+from pathlib import Path
+
+from ddcheck.analysis.analysis import analyse_source
+from ddcheck.storage import AnalysisState, DdcheckMetadata, Source
+from ddcheck.storage.archive import IndexedTarballWriter
+from tests.synthetic import generate_ttop
+
+
+def _upload(extract_path: Path) -> DdcheckMetadata:
+    """Upload holding the ttop.txt file of a single node, but not its os_info.txt."""
+    ttop = generate_ttop(samples=10).encode()
+    with IndexedTarballWriter(extract_path) as archive:
+        member = tarfile.TarInfo("ddc/ttop/node/ttop.txt")
+        member.size = len(ttop)
+        with archive.add_member(member) as f:
+            f.write(ttop)
+        archive.finish()
+    return DdcheckMetadata(
+        "upload.tar.gz", "ddcheck-id", datetime.now(), str(extract_path), ["node"]
+    )
+
+
+def test_skips_source_whose_dependencies_did_not_complete(tmp_path: Path) -> None:
+    metadata = _upload(tmp_path)
+    analyse_source(metadata, Source.OS_INFO)
+    assert metadata.analysis_state["node"][Source.OS_INFO] == AnalysisState.SKIPPED
+    # The load average check of the ttop.txt file needs the number of CPUs
+    analyse_source(metadata, Source.TOP)
+    assert metadata.analysis_state["node"][Source.TOP] == AnalysisState.SKIPPED
+    assert Source.TOP in metadata.analysis_stamps["node"]
+
+
+def test_analyses_source_whose_dependencies_completed(tmp_path: Path) -> None:
+    metadata = _upload(tmp_path)
+    metadata.analysis_state["node"][Source.OS_INFO] = AnalysisState.COMPLETED
+    metadata.total_cpu_count["node"] = 8
+    analyse_source(metadata, Source.TOP)
+    assert metadata.analysis_state["node"][Source.TOP] == AnalysisState.COMPLETED
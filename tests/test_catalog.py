@@ -0,0 +1,36 @@
+"""Checks that the catalog follows the uploads without walking them on every write."""
+
+import shutil
+from datetime import datetime
+from pathlib import Path
+
+from ddcheck.storage import DdcheckMetadata
+from ddcheck.storage.catalog import count_uploads, list_uploads, record_upload
+
+
+def _upload(extract_directory: Path, ddcheck_id: str) -> DdcheckMetadata:
+    extract_path = extract_directory / ddcheck_id
+    extract_path.mkdir()
+    (extract_path / "archive").write_bytes(b"\0" * 1000)
+    return DdcheckMetadata(
+        "upload.tar.gz", ddcheck_id, datetime.now(), str(extract_path), ["node"]
+    )
+
+
+def test_keeps_size_measured_at_ingest(extract_directory: Path) -> None:
+    metadata = _upload(extract_directory, "upload")
+    record_upload(metadata)
+    (extract_directory / "upload" / "series.npy").write_bytes(b"\0" * 500)
+    record_upload(metadata)
+    [entry] = list_uploads()
+    assert entry.size == 1000
+
+
+def test_drops_deleted_uploads(extract_directory: Path) -> None:
+    for ddcheck_id in ["first", "second", "third"]:
+        record_upload(_upload(extract_directory, ddcheck_id))
+    shutil.rmtree(extract_directory / "second")
+    assert count_uploads() == 3
+    entries = list_uploads(sort_by="original_filename", limit=2)
+    assert [entry.ddcheck_id for entry in entries] == ["third", "first"]
+    assert count_uploads() == 2
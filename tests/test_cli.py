@@ -0,0 +1,43 @@
+"""Checks that the command line runs the analysis or a worker as asked."""
+
+import argparse
+from pathlib import Path
+
+import pytest
+
+from ddcheck import cli, jobs
+
+
+@pytest.fixture
+def commands(monkeypatch: pytest.MonkeyPatch) -> list[argparse.Namespace]:
+    """Arguments of each command run, instead of running them."""
+    run: list[argparse.Namespace] = []
+
+    def record(args: argparse.Namespace) -> int:
+        run.append(args)
+        return 0
+
+    monkeypatch.setattr(cli, "analyse", record)
+    monkeypatch.setattr(jobs, "run_command", record)
+    return run
+
+
+def test_path_named_worker_is_analysed(commands: list[argparse.Namespace]) -> None:
+    assert cli.main(["analyse", "--jobs", "2", "worker"]) == 0
+    [args] = commands
+    assert args.command == "analyse"
+    assert args.paths == [Path("worker")]
+    assert args.jobs == 2
+
+
+def test_worker_takes_its_own_arguments(commands: list[argparse.Namespace]) -> None:
+    assert cli.main(["worker", "--processes", "3"]) == 0
+    [args] = commands
+    assert args.command == "worker"
+    assert args.processes == 3
+
+
+def test_command_is_required(commands: list[argparse.Namespace]) -> None:
+    with pytest.raises(SystemExit):
+        cli.main([])
+    assert not commands
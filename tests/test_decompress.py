@@ -0,0 +1,45 @@
+"""Checks the decompression of gzip tarballs by open_decompressed."""
+
+import gzip
+import io
+import random
+import tarfile
+
+import pytest
+
+from ddcheck.storage import decompress
+from ddcheck.storage.decompress import open_decompressed
+
+FIRST = random.Random(0).randbytes(300_000)
+SECOND = b"second member" * 1000
+FIRST_MEMBER = gzip.compress(FIRST)
+TWO_MEMBERS = FIRST_MEMBER + gzip.compress(SECOND)
+
+
+def _decompress(data: bytes) -> bytes:
+    with open_decompressed(io.BytesIO(data), "upload.tar.gz") as f:
+        return f.read()
+
+
+@pytest.mark.parametrize("offset", range(-2, 3))
+def test_reads_split_around_members(
+    monkeypatch: pytest.MonkeyPatch, offset: int
+) -> None:
+    # Reads end around the end of the first member, splitting the next magic
+    monkeypatch.setattr(decompress, "_CHUNK_SIZE", len(FIRST_MEMBER) + offset)
+    assert _decompress(TWO_MEMBERS) == FIRST + SECOND
+
+
+def test_ignores_garbage_after_members() -> None:
+    assert _decompress(TWO_MEMBERS + b"\0garbage") == FIRST + SECOND
+
+
+@pytest.mark.parametrize("size", [len(FIRST_MEMBER) - 10, len(FIRST_MEMBER) + 5])
+def test_rejects_truncated_member(size: int) -> None:
+    with pytest.raises(tarfile.ReadError):
+        _decompress(TWO_MEMBERS[:size])
+
+
+def test_rejects_other_files() -> None:
+    with pytest.raises(tarfile.ReadError):
+        _decompress(b"not a gzip file")
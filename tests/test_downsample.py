@@ -0,0 +1,60 @@
+"""Checks that downsampling keeps the peaks of series where they occur."""
+
+import numpy as np
+import pytest
+
+from ddcheck.analysis.downsample import (
+    CHART_POINTS,
+    chart_columns,
+    downsample,
+    downsample_levels,
+)
+from ddcheck.storage.series import Columns
+
+SERIES = Columns.from_dict(
+    {
+        "rising": np.arange(10_000, dtype=np.float64),
+        "noisy": np.random.default_rng(0).normal(50, 20, 10_000),
+        "constant": np.zeros(10_000),
+    }
+)
+
+
+def test_keeps_samples_of_extremes() -> None:
+    index, downsampled = downsample(SERIES, 100)
+    assert np.all(np.diff(index) > 0)
+    for name in SERIES:
+        # Points are samples of the series, at their sample index
+        assert np.array_equal(downsampled[name], SERIES[name][index])
+        buckets = SERIES[name].reshape(50, -1)
+        extremes = np.concatenate(
+            [
+                np.arange(50) * 200 + buckets.argmin(axis=1),
+                np.arange(50) * 200 + buckets.argmax(axis=1),
+            ]
+        )
+        assert set(extremes) <= set(index)
+
+
+def test_keeps_maximum_before_minimum() -> None:
+    series = Columns.from_dict({"falling": np.arange(1000, 0, -1, dtype=np.float64)})
+    index, downsampled = downsample(series, 10)
+    assert index.tolist() == [0, 199, 200, 399, 400, 599, 600, 799, 800, 999]
+    assert downsampled["falling"].tolist() == [
+        1000, 801, 800, 601, 600, 401, 400, 201, 200, 1
+    ]
+
+
+def test_keeps_short_series() -> None:
+    index, downsampled = downsample(SERIES, 20_000)
+    assert index.tolist() == list(range(10_000))
+    assert downsampled is SERIES
+
+
+@pytest.mark.parametrize("start, end", [(0, 10_000), (2_000, 6_000), (100, 300)])
+def test_charts_range_from_levels(start: int, end: int) -> None:
+    levels = downsample_levels(SERIES)
+    index, chart = chart_columns(SERIES, levels, start, end)
+    assert index.min() >= start and index.max() < end
+    assert np.array_equal(chart["noisy"], SERIES["noisy"][index])
+    assert len(index) >= min(CHART_POINTS, end - start)
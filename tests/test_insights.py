@@ -0,0 +1,60 @@
+"""Checks that the insights of an upload are listed from their indexes."""
+
+from ddcheck.storage import Insight, InsightQualifier, InsightStore, Source
+
+OK, BAD = InsightQualifier.OK, InsightQualifier.BAD
+
+
+def _store() -> InsightStore:
+    return InsightStore(
+        [
+            Insight("a", Source.TOP, OK, "No swap usage detected"),
+            Insight("a", Source.TOP, BAD, "High average CPU usage: 95%"),
+            Insight("a", Source.OS_INFO, OK, "Enough memory"),
+            Insight("a", Source.TOP, OK, "Low average CPU usage: 5%"),
+            Insight("b", Source.TOP, OK, "No swap usage detected"),
+        ]
+    )
+
+
+def test_lists_sorted_by_source_and_message() -> None:
+    store = _store()
+    assert [insight.message for insight in store.of_qualifier("a", OK)] == [
+        "Enough memory",
+        "Low average CPU usage: 5%",
+        "No swap usage detected",
+    ]
+    assert [insight.message for insight in store.of_qualifier("a", BAD)] == [
+        "High average CPU usage: 95%"
+    ]
+    assert store.of_qualifier("c", OK) == ()
+
+
+def test_adding_twice_keeps_one() -> None:
+    store = _store()
+    store.add(Insight("b", Source.TOP, OK, "No swap usage detected"))
+    assert len(store) == 5
+    assert len(store.of_qualifier("b", OK)) == 1
+
+
+def test_discard_updates_every_index() -> None:
+    store = _store()
+    for insight in store.of_source("a", Source.TOP):
+        store.discard(insight)
+    store.discard(Insight("c", Source.TOP, OK, "Never added"))
+    assert len(store) == 2
+    assert store.of_qualifier("a", BAD) == []
+    assert [insight.message for insight in store.of_qualifier("a", OK)] == [
+        "Enough memory"
+    ]
+    assert store.of_source("a", Source.TOP) == ()
+    assert set(store.of_node("a")) == {
+        Insight("a", Source.OS_INFO, OK, "Enough memory")
+    }
+
+
+def test_round_trips_through_the_metadata_json() -> None:
+    store = _store()
+    decoded = InsightStore(Insight.from_dict(insight.to_dict()) for insight in store)
+    assert decoded == store
+    assert list(decoded.of_qualifier("a", OK)) == list(store.of_qualifier("a", OK))
@@ -0,0 +1,143 @@
+"""Checks that the workers share the queued tasks and run them in dependency order."""
+
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator
+
+import pytest
+
+from ddcheck import jobs
+from ddcheck.analysis.registry import get_analyser
+from ddcheck.jobs import (
+    FINISHED_STATES,
+    LEASE_SECONDS,
+    Job,
+    JobState,
+    get_job,
+    run_worker,
+    submit_analysis,
+)
+from ddcheck.storage import AnalysisState, DdcheckMetadata, Source
+from ddcheck.storage.list import read_uploaded_metadata
+from ddcheck.storage.upload import write_metadata_to_disk
+
+
+@pytest.fixture(autouse=True)
+def threads(extract_directory: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Runs the workers in threads of the tests rather than in processes."""
+    monkeypatch.setattr(jobs, "_new_pool", ThreadPoolExecutor)
+    # Only creates the directories of the jobs, the tests start their workers
+    monkeypatch.setattr(jobs, "start_worker", _create_jobs_directory)
+    monkeypatch.setattr(jobs, "POLL_INTERVAL", 0.01)
+
+
+def _create_jobs_directory() -> None:
+    jobs.WORKERS_DIRECTORY.mkdir(parents=True, exist_ok=True)
+
+
+@pytest.fixture
+def unanalysed(uploaded: DdcheckMetadata) -> DdcheckMetadata:
+    """Upload whose analyses are left to run."""
+    metadata = _read(uploaded)
+    for node in metadata.nodes:
+        for source in Source:
+            produces = get_analyser(source).produces
+            metadata.clear_analysis(node, source, produces)
+    write_metadata_to_disk(metadata)
+    return metadata
+
+
+@contextmanager
+def _worker(processes: int = 2) -> Iterator[None]:
+    stop = threading.Event()
+    thread = threading.Thread(target=run_worker, args=(processes, stop))
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+def _wait_until_finished(job: Job) -> Job:
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        finished = get_job(job.job_id)
+        assert finished is not None
+        if finished.state in FINISHED_STATES:
+            return finished
+        time.sleep(0.01)
+    raise AssertionError(f"Job {job.job_id} did not finish")
+
+
+def _read(metadata: DdcheckMetadata) -> DdcheckMetadata:
+    written = read_uploaded_metadata(metadata.ddcheck_id)
+    assert written is not None
+    return written
+
+
+def test_lease_is_taken_once_until_it_expires(extract_directory: Path) -> None:
+    item = extract_directory / "task.json"
+    assert jobs._claim(item)
+    assert not jobs._claim(item)
+
+    expired = time.time() - LEASE_SECONDS - 1
+    os.utime(jobs._lease(item), (expired, expired))
+    assert jobs._claim(item)
+    assert not jobs._claim(item)
+
+
+def test_sources_are_analysed_after_their_dependencies(
+    unanalysed: DdcheckMetadata,
+) -> None:
+    job = submit_analysis(unanalysed.ddcheck_id)
+    with _worker(processes=4):
+        assert _wait_until_finished(job).state == JobState.COMPLETED
+
+    written = _read(unanalysed)
+    for node in written.nodes:
+        # TOP is skipped unless OS_INFO was analysed first
+        assert written.analysis_state[node] == {
+            Source.OS_INFO: AnalysisState.COMPLETED,
+            Source.TOP: AnalysisState.COMPLETED,
+        }
+        assert node in written.total_cpu_count
+    assert not any(jobs.TASKS_DIRECTORY.iterdir())
+
+
+def test_expired_job_lease_is_taken_over(unanalysed: DdcheckMetadata) -> None:
+    job = submit_analysis(unanalysed.ddcheck_id)
+    # Left by a worker that was killed
+    lease = jobs._lease(jobs.JOBS_DIRECTORY / f"{job.job_id}.json")
+    lease.write_text("killed-worker")
+    with _worker():
+        time.sleep(0.1)
+        assert get_job(job.job_id).state == JobState.QUEUED  # type: ignore[union-attr]
+        expired = time.time() - LEASE_SECONDS - 1
+        os.utime(lease, (expired, expired))
+        assert _wait_until_finished(job).state == JobState.COMPLETED
+
+
+@pytest.mark.parametrize("failing", ["analyse_source", "run_task"])
+def test_failing_task_completes_its_job(
+    unanalysed: DdcheckMetadata, failing: str, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    def fail(*args: object) -> None:
+        raise RuntimeError("Corrupted upload")
+
+    monkeypatch.setattr(jobs, failing, fail)
+    job = submit_analysis(unanalysed.ddcheck_id)
+    with _worker():
+        assert _wait_until_finished(job).state == JobState.COMPLETED
+
+    written = _read(unanalysed)
+    for node in written.nodes:
+        assert written.analysis_state[node] == {
+            Source.OS_INFO: AnalysisState.FAILED,
+            Source.TOP: AnalysisState.FAILED,
+        }
+    assert not any(jobs.TASKS_DIRECTORY.iterdir())
@@ -0,0 +1,77 @@
+"""Checks that the metadata decodes its insights and summaries once, when first used."""
+
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+import pytest
+
+from ddcheck.storage import (
+    DdcheckMetadata,
+    Insight,
+    InsightQualifier,
+    SeriesSummary,
+    Source,
+)
+
+
+def _metadata(tmp_path: Path) -> DdcheckMetadata:
+    metadata = DdcheckMetadata(
+        "upload.tar.gz", "ddcheck-id", datetime.now(), str(tmp_path), ["a", "b"]
+    )
+    for node in metadata.nodes:
+        metadata.insights.add(
+            Insight(node, Source.TOP, InsightQualifier.OK, "No swap usage detected")
+        )
+        metadata.top_summaries[node] = {
+            "total": SeriesSummary(
+                count=2, mean=1.5, min=1, max=2, stddev=0.5, p50=1.5, p95=2, p99=2
+            )
+        }
+    return DdcheckMetadata.from_dict(metadata.to_dict())
+
+
+def test_undecoded_values_are_written_back(tmp_path: Path) -> None:
+    metadata = _metadata(tmp_path)
+    written = metadata.to_dict()
+    assert metadata._insights is None
+    assert DdcheckMetadata.from_dict(written).to_dict() == written
+    assert len(metadata.insights) == 2
+    assert metadata.top_summaries["a"]["total"].mean == 1.5
+    assert metadata.to_dict() == written
+
+
+def test_concurrent_sessions_share_the_decoded_values(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    metadata = _metadata(tmp_path)
+    from_dict = Insight.from_dict
+
+    def slow_from_dict(data: dict) -> Insight:
+        # Lets the other threads access the insights while they are decoded
+        time.sleep(0.01)
+        return from_dict(data)
+
+    monkeypatch.setattr(Insight, "from_dict", slow_from_dict)
+    barrier = threading.Barrier(8)
+    insights = []
+    summaries = []
+    written = []
+
+    def access() -> None:
+        barrier.wait()
+        insights.append(metadata.insights)
+        summaries.append(metadata.top_summaries["a"])
+        # Written meanwhile by another session, see write_metadata_to_disk
+        written.append(metadata.to_dict()["insights"])
+
+    threads = [threading.Thread(target=access) for _ in range(barrier.parties)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert all(store is insights[0] for store in insights)
+    assert len(insights[0]) == 2
+    assert all(summary is summaries[0] for summary in summaries)
+    assert all(len(encoded) == 2 for encoded in written)
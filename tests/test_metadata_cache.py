@@ -0,0 +1,57 @@
+"""Checks that the sessions share the cached metadata until it is written again."""
+
+from pathlib import Path
+
+import pytest
+
+from ddcheck.storage import AnalysisState, DdcheckMetadata, Source
+from ddcheck.storage import list as upload_list
+from ddcheck.storage.list import get_uploaded_metadata, read_uploaded_metadata
+from ddcheck.storage.upload import ingest_tarball, write_metadata_to_disk
+from tests.synthetic import write_synthetic_tarball
+
+
+def test_sessions_share_the_cached_metadata(uploaded: DdcheckMetadata) -> None:
+    cached = get_uploaded_metadata(uploaded.ddcheck_id)
+    assert cached is not None
+    assert get_uploaded_metadata(uploaded.ddcheck_id) is cached
+    assert get_uploaded_metadata("missing") is None
+
+
+def test_modified_copy_does_not_change_the_cache(uploaded: DdcheckMetadata) -> None:
+    cached = get_uploaded_metadata(uploaded.ddcheck_id)
+    assert cached is not None
+    metadata = read_uploaded_metadata(uploaded.ddcheck_id)
+    assert metadata is not None and metadata is not cached
+    node = metadata.nodes[0]
+    metadata.analysis_state[node][Source.TOP] = AnalysisState.FAILED
+    assert cached.analysis_state[node][Source.TOP] == AnalysisState.COMPLETED
+
+    write_metadata_to_disk(metadata)
+    written = get_uploaded_metadata(uploaded.ddcheck_id)
+    assert written is not None and written is not cached
+    assert written.analysis_state[node][Source.TOP] == AnalysisState.FAILED
+
+
+def test_invalidated_metadata_is_read_again(uploaded: DdcheckMetadata) -> None:
+    cached = get_uploaded_metadata(uploaded.ddcheck_id)
+    upload_list.invalidate_cached_metadata(uploaded.ddcheck_id)
+    reread = get_uploaded_metadata(uploaded.ddcheck_id)
+    assert reread is not None and reread is not cached
+    assert get_uploaded_metadata(uploaded.ddcheck_id) is reread
+
+
+def test_least_recently_used_is_evicted(
+    uploaded: DdcheckMetadata, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    tarball = tmp_path / "other.tar.gz"
+    write_synthetic_tarball(tarball, nodes=1, samples=30)
+    with open(tarball, "rb") as f:
+        other = ingest_tarball(f, tarball.name)
+    assert other is not None
+    first = get_uploaded_metadata(uploaded.ddcheck_id)
+    # Only the metadata just read fits
+    monkeypatch.setattr(upload_list, "METADATA_CACHE_BYTES", 1)
+    second = get_uploaded_metadata(other.ddcheck_id)
+    assert get_uploaded_metadata(other.ddcheck_id) is second
+    assert get_uploaded_metadata(uploaded.ddcheck_id) is not first
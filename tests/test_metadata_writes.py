@@ -0,0 +1,98 @@
+"""Checks that sessions writing the metadata of the same upload keep each other's."""
+
+import numpy as np
+import pytest
+
+from ddcheck.analysis.analysis import analyse_source
+from ddcheck.analysis.registry import get_analyser
+from ddcheck.storage import AnalysisState, DdcheckMetadata, Source
+from ddcheck.storage.list import read_uploaded_metadata
+from ddcheck.storage.upload import (
+    coalesce_metadata_writes,
+    merge_analyses_to_disk,
+    write_metadata_to_disk,
+)
+
+
+def _read(metadata: DdcheckMetadata) -> DdcheckMetadata:
+    written = read_uploaded_metadata(metadata.ddcheck_id)
+    assert written is not None
+    return written
+
+
+def test_concurrent_writes_keep_both_changes(uploaded: DdcheckMetadata) -> None:
+    first_node, second_node = uploaded.nodes
+    produces = get_analyser(Source.TOP).produces
+    # Both read before either writes
+    first, second = _read(uploaded), _read(uploaded)
+    first.clear_analysis(first_node, Source.TOP, produces)
+    second.clear_analysis(second_node, Source.OS_INFO, set())
+    write_metadata_to_disk(first)
+    write_metadata_to_disk(second)
+
+    written = _read(uploaded)
+    assert written.analysis_state[first_node] == {
+        Source.OS_INFO: AnalysisState.COMPLETED,
+        Source.TOP: AnalysisState.NOT_STARTED,
+    }
+    assert written.analysis_state[second_node] == {
+        Source.OS_INFO: AnalysisState.NOT_STARTED,
+        Source.TOP: AnalysisState.COMPLETED,
+    }
+    # The series cleared by the first write are not brought back by the second one
+    assert first_node not in written.cpu_usage
+    assert np.array_equal(
+        written.cpu_usage[second_node].array, uploaded.cpu_usage[second_node].array
+    )
+
+
+def _analyse_top(uploaded: DdcheckMetadata) -> list[DdcheckMetadata]:
+    """Analyse the ttop.txt file of every node again, each on its own copy."""
+    produces = get_analyser(Source.TOP).produces
+    metadata = _read(uploaded)
+    for node in uploaded.nodes:
+        metadata.clear_analysis(node, Source.TOP, produces)
+    write_metadata_to_disk(metadata)
+    # As by several workers, from the same version of the file
+    metadata = _read(uploaded)
+    results = [metadata.extract_node(node) for node in uploaded.nodes]
+    for node_metadata in results:
+        analyse_source(node_metadata, Source.TOP)
+    return results
+
+
+@pytest.mark.parametrize("batched", [False, True])
+def test_merges_keep_all_results(uploaded: DdcheckMetadata, batched: bool) -> None:
+    results = _analyse_top(uploaded)
+    version = _read(uploaded).version
+    if batched:
+        merge_analyses_to_disk(
+            uploaded.ddcheck_id, [(result, Source.TOP) for result in results]
+        )
+    else:
+        for result in results:
+            merge_analyses_to_disk(uploaded.ddcheck_id, [(result, Source.TOP)])
+
+    written = _read(uploaded)
+    assert written.version == version + (1 if batched else len(results))
+    for node in uploaded.nodes:
+        assert written.analysis_state[node][Source.TOP] == AnalysisState.COMPLETED
+        assert np.array_equal(
+            written.cpu_usage[node].array, uploaded.cpu_usage[node].array
+        )
+        assert written.insights.of_source(node, Source.TOP)
+
+
+def test_coalesced_writes_write_once(uploaded: DdcheckMetadata) -> None:
+    version = _read(uploaded).version
+    metadata = _read(uploaded)
+    with coalesce_metadata_writes():
+        for node in uploaded.nodes:
+            metadata.clear_analysis(node, Source.OS_INFO, set())
+            write_metadata_to_disk(metadata)
+        # Deferred until the end of the block
+        assert _read(uploaded).version == version
+    written = _read(uploaded)
+    assert written.version == version + 1
+    for node in uploaded.nodes:
+        assert written.analysis_state[node][Source.OS_INFO] == AnalysisState.NOT_STARTED
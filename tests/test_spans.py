@@ -0,0 +1,65 @@
+"""Checks the spans recorded for each stage and their Prometheus metrics."""
+
+from pathlib import Path
+
+import pytest
+
+from ddcheck.storage import DdcheckMetadata
+from ddcheck.storage.spans import Span, record_span, to_prometheus
+
+
+def test_span_replaces_the_previous_one_of_its_stage_and_node() -> None:
+    spans: list[Span] = []
+    with record_span(spans, "top.parse", "a") as span:
+        span.bytes_read = 100
+    with record_span(spans, "top.parse", "b"):
+        pass
+    with record_span(spans, "top.parse", "a") as span:
+        span.bytes_read = 200
+    assert [(span.stage, span.node, span.bytes_read) for span in spans] == [
+        ("top.parse", "b", 0),
+        ("top.parse", "a", 200),
+    ]
+    assert all(span.wall_seconds >= 0 and span.peak_rss_bytes > 0 for span in spans)
+
+
+def test_span_is_recorded_when_its_stage_fails() -> None:
+    spans: list[Span] = []
+    with pytest.raises(ValueError):
+        with record_span(spans, "ingest.stream"):
+            raise ValueError("Truncated tarball")
+    assert [span.stage for span in spans] == ["ingest.stream"]
+
+
+def test_nested_span_keeps_the_peak_of_its_parent() -> None:
+    spans: list[Span] = []
+    with record_span(spans, "ingest.stream"):
+        with record_span(spans, "top.parse", "a"):
+            pass
+    inner, outer = spans
+    assert outer.peak_rss_bytes >= inner.peak_rss_bytes
+    assert outer.wall_seconds >= inner.wall_seconds
+
+
+def test_prometheus_metrics_sum_the_nodes_of_a_stage() -> None:
+    spans = [
+        Span("top.parse", "a", 1.0, 0.5, 100, 2048),
+        Span("top.parse", "b", 2.0, 1.5, 300, 1024),
+        Span("ingest.stream", "", 4.0, 3.0, 1000, 4096),
+    ]
+    metrics = to_prometheus(spans).splitlines()
+    assert "# TYPE ddcheck_stage_wall_seconds gauge" in metrics
+    assert 'ddcheck_stage_wall_seconds{stage="top.parse"} 3.0' in metrics
+    assert 'ddcheck_stage_cpu_seconds{stage="top.parse"} 2.0' in metrics
+    assert 'ddcheck_stage_bytes_read{stage="top.parse"} 400' in metrics
+    assert 'ddcheck_stage_peak_rss_bytes{stage="top.parse"} 2048' in metrics
+    assert 'ddcheck_stage_bytes_read{stage="ingest.stream"} 1000' in metrics
+
+
+def test_ingestion_writes_its_metrics(
+    uploaded: DdcheckMetadata, extract_directory: Path
+) -> None:
+    stages = {span.stage for span in uploaded.spans}
+    assert {"ingest.stream", "top.parse", "os_info.parse"} <= stages
+    metrics = (extract_directory / "ddcheck-metrics.prom").read_text()
+    assert metrics == to_prometheus(uploaded.spans)
@@ -0,0 +1,101 @@
+"""Checks the parsing of ttop.txt files and the checks run on what is parsed."""
+
+import io
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from ddcheck.analysis.top import (
+    TopOutput,
+    parse_top_output,
+    parse_top_output_lines,
+    record_top_output,
+)
+from ddcheck.storage import AnalysisState, DdcheckMetadata, Source
+from tests.synthetic import generate_ttop
+
+
+def _snapshot(time: str, us: float, sy: float, idle: float, swap: float) -> str:
+    return (
+        f"top - {time} up 10 days,  3:02,  0 users,  load average: 1.50, 2.25, 3.00\n"
+        "Threads: 300 total,   1 running, 299 sleeping,   0 stopped,   0 zombie\n"
+        f"%Cpu(s): {us:4.1f} us, {sy:4.1f} sy,  0.0 ni, {idle:4.1f} id,  0.0 wa,  "
+        "0.0 hi,  0.0 si,  0.0 st\n"
+        "MiB Mem :  64316.4 total,   1024.0 free,  30000.0 used,  33292.4 buff/cache\n"
+        f"MiB Swap:   4096.0 total,   1024.0 free, {swap:8.1f} used.  33292.4 avail Mem\n"
+        "\n"
+    )
+
+
+CASES = {
+    "synthetic": generate_ttop(samples=200, seed=1),
+    "synthetic with threads": generate_ttop(samples=50, seed=2, threads=20),
+    "no trailing newline": _snapshot("15:06:43", 10.0, 2.0, 88.0, 12.5).rstrip(),
+    # us == sy == 0 gives a JPDM of 0, us == 0 alone stands sy * 10 in for us
+    "zero user time": (
+        _snapshot("15:06:43", 0.0, 0.0, 100.0, 0.0)
+        + _snapshot("15:06:46", 0.0, 3.0, 97.0, 0.0)
+    ),
+    "single digit hour": _snapshot("9:05:07", 50.0, 5.0, 45.0, 3072.0),
+    "windows line endings": (
+        _snapshot("23:59:58", 1.0, 1.0, 98.0, 1.0)
+        + _snapshot("23:59:59", 2.0, 1.0, 97.0, 2.0)
+    ).replace("\n", "\r\n"),
+    "leading garbage": "ttop output\n" + _snapshot("00:00:00", 1.0, 0.5, 98.5, 0.0),
+    # Only the swap usage printed in MiB is parsed, leaving that series empty
+    "swap in KiB": _snapshot("12:00:00", 5.0, 1.0, 94.0, 0.0).replace(
+        "MiB Swap", "KiB Swap"
+    ),
+}
+
+
+def _series(top_output: TopOutput) -> dict[str, np.ndarray]:
+    return {
+        "times": top_output.times,
+        "load_avg_1min": top_output.load_avg_1min,
+        "load_avg_5min": top_output.load_avg_5min,
+        "load_avg_15min": top_output.load_avg_15min,
+        "cpu_usage": top_output.cpu_usage.array,
+        "used_swap_mb": top_output.used_swap_mb,
+    }
+
+
+@pytest.mark.parametrize("content", CASES.values(), ids=CASES.keys())
+def test_parse_top_output_matches_lines(content: str) -> None:
+    data = content.encode()
+    # Read as analyse_top_output used to, from a file opened in text mode
+    expected = parse_top_output_lines(io.TextIOWrapper(io.BytesIO(data)))
+    assert expected.times.size, "The case must hold at least one snapshot"
+    actual = parse_top_output(data)
+    assert actual.cpu_usage.names == expected.cpu_usage.names
+    actual_series = _series(actual)
+    for name, series in _series(expected).items():
+        assert actual_series[name].dtype == series.dtype, name
+        np.testing.assert_array_equal(actual_series[name], series, err_msg=name)
+    assert actual.times.dtype == np.int32
+    assert actual.summaries.keys() == expected.summaries.keys()
+    for name, summary in expected.summaries.items():
+        # Computed on arrays rather than lists, so possibly rounded differently
+        assert actual.summaries[name].to_dict() == pytest.approx(summary.to_dict())
+
+
+def test_record_top_output_without_swap(tmp_path: Path) -> None:
+    content = CASES["swap in KiB"].encode()
+    metadata = DdcheckMetadata(
+        "upload.tar.gz", "ddcheck-id", datetime.now(), str(tmp_path), ["node"]
+    )
+    metadata.total_cpu_count["node"] = 8
+    top_output = parse_top_output(content)
+    state = record_top_output(metadata, "node", top_output)
+    assert state == AnalysisState.COMPLETED
+    # Stored as parsed
+    assert metadata.cpu_usage["node"].array is top_output.cpu_usage.array
+    assert metadata.top_times["node"] is top_output.times
+    assert "used_swap_mb" not in metadata.top_summaries["node"]
+    # The other checks still ran
+    messages = {insight.message for insight in metadata.insights}
+    assert "Checking the average CPU usage" in messages
+    assert "Checking the Swap usage" not in messages
+    assert metadata.analysis_state["node"][Source.TOP] == AnalysisState.COMPLETED
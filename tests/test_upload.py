@@ -0,0 +1,84 @@
+"""Checks that a tarball uploaded twice is recognised, and only read once."""
+
+import io
+import json
+from pathlib import Path
+from typing import Any
+
+import pytest
+
+from ddcheck.storage import upload
+from ddcheck.storage.catalog import count_uploads
+from ddcheck.storage.upload import delete_upload, ingest_tarball
+from tests.synthetic import write_synthetic_tarball
+
+
+class _NonSeekable(io.RawIOBase):
+    def __init__(self, data: bytes):
+        self._data = io.BytesIO(data)
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer: Any) -> int:
+        return self._data.readinto(buffer)
+
+
+@pytest.fixture
+def tarball(tmp_path: Path) -> Path:
+    path = tmp_path / "synthetic.tar.gz"
+    write_synthetic_tarball(path, nodes=2, samples=60)
+    return path
+
+
+def _upload_hashes(extract_directory: Path) -> dict[str, str]:
+    with open(extract_directory / "ddcheck-upload-hashes.json") as f:
+        return json.load(f)
+
+
+def test_fingerprinted_tarball_is_not_decompressed_again(
+    extract_directory: Path, tarball: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    with open(tarball, "rb") as f:
+        first = ingest_tarball(f, tarball.name)
+    assert first is not None
+
+    def fail(*args: Any, **kwargs: Any) -> None:
+        raise AssertionError("Decompressed a tarball already uploaded")
+
+    monkeypatch.setattr(upload, "open_decompressed", fail)
+    with open(tarball, "rb") as f:
+        second = ingest_tarball(f, "renamed.tar.gz")
+    assert second is not None
+    assert second.ddcheck_id == first.ddcheck_id
+    assert count_uploads() == 1
+
+
+def test_streamed_tarball_is_recognised_by_its_sha256(
+    extract_directory: Path, tarball: Path
+) -> None:
+    data = tarball.read_bytes()
+    first = ingest_tarball(io.BufferedReader(_NonSeekable(data)), tarball.name)
+    assert first is not None
+    second = ingest_tarball(io.BufferedReader(_NonSeekable(data)), tarball.name)
+    assert second is not None
+    assert second.ddcheck_id == first.ddcheck_id
+    uploads = [path.name for path in extract_directory.iterdir() if path.is_dir()]
+    assert uploads == [first.ddcheck_id]
+
+
+def test_seekable_upload_records_sha256_and_fingerprint(
+    extract_directory: Path, tarball: Path
+) -> None:
+    with open(tarball, "rb") as f:
+        metadata = ingest_tarball(f, tarball.name)
+    assert metadata is not None
+    upload_hashes = _upload_hashes(extract_directory)
+    assert len(upload_hashes) == 2
+    assert set(upload_hashes.values()) == {metadata.ddcheck_id}
+    fingerprint = next(key for key in upload_hashes if ":" in key)
+    assert fingerprint.startswith(f"{tarball.stat().st_size}:")
+
+    delete_upload(metadata.ddcheck_id)
+    assert _upload_hashes(extract_directory) == {}
+    assert count_uploads() == 0
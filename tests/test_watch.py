@@ -0,0 +1,121 @@
+"""Checks that the watcher submits each tarball once, once it is fully written."""
+
+import time
+import uuid
+from pathlib import Path
+from typing import Optional
+
+import pytest
+from watchdog.events import FileClosedEvent, FileModifiedEvent, FileMovedEvent
+
+from ddcheck import watch
+from ddcheck.jobs import Job, JobState
+from ddcheck.watch import TarballWatcher
+
+
+class _Jobs:
+    """Jobs submitted by the watcher, instead of being queued for the worker."""
+
+    def __init__(self) -> None:
+        self.submitted: dict[str, Job] = {}
+
+    def submit_path(self, tarball: Path) -> Optional[Job]:
+        job = Job(str(uuid.uuid4()), filename=tarball.name, tarball=str(tarball))
+        self.submitted[job.job_id] = job
+        return job
+
+    def get_job(self, job_id: str) -> Optional[Job]:
+        return self.submitted.get(job_id)
+
+    def tarballs(self) -> list[str]:
+        return [Path(str(job.tarball)).name for job in self.submitted.values()]
+
+
+@pytest.fixture
+def jobs(extract_directory: Path, monkeypatch: pytest.MonkeyPatch) -> _Jobs:
+    submitted = _Jobs()
+    monkeypatch.setattr(watch, "submit_path", submitted.submit_path)
+    monkeypatch.setattr(watch, "get_job", submitted.get_job)
+    return submitted
+
+
+@pytest.fixture
+def directory(tmp_path: Path) -> Path:
+    directory = tmp_path / "watched"
+    directory.mkdir()
+    return directory
+
+
+def _write(path: Path, size: int = 100) -> Path:
+    path.write_bytes(b"\0" * size)
+    return path
+
+
+def test_closed_tarball_is_submitted_at_once(jobs: _Jobs, directory: Path) -> None:
+    watcher = TarballWatcher(directory, settle_seconds=3600)
+    watcher.on_any_event(FileClosedEvent(str(_write(directory / "a.tar.gz"))))
+    watcher.on_any_event(FileClosedEvent(str(_write(directory / "notes.txt"))))
+    temporary = _write(directory / "b.tar.zst.part")
+    renamed = directory / "b.tar.zst"
+    temporary.rename(renamed)
+    watcher.on_any_event(FileMovedEvent(str(temporary), str(renamed)))
+    watcher.submit_ready()
+    assert sorted(jobs.tarballs()) == ["a.tar.gz", "b.tar.zst"]
+
+
+def test_modified_tarball_is_submitted_once_settled(
+    jobs: _Jobs, directory: Path
+) -> None:
+    watcher = TarballWatcher(directory, settle_seconds=0.5)
+    tarball = _write(directory / "a.tar.gz")
+    watcher.on_any_event(FileModifiedEvent(str(tarball)))
+    watcher.submit_ready()
+    assert jobs.tarballs() == []
+
+    time.sleep(0.2)
+    # Still being written, so it settles from now on
+    _write(tarball, size=200)
+    watcher.submit_ready()
+    time.sleep(0.35)
+    watcher.submit_ready()
+    assert jobs.tarballs() == []
+
+    time.sleep(0.25)
+    watcher.submit_ready()
+    assert jobs.tarballs() == ["a.tar.gz"]
+
+
+def test_restarted_watcher_only_submits_changed_tarballs(
+    jobs: _Jobs, directory: Path
+) -> None:
+    unchanged = _write(directory / "a.tar.gz")
+    changed = _write(directory / "b.tar.gz")
+    watcher = TarballWatcher(directory)
+    for tarball in (unchanged, changed):
+        watcher.on_any_event(FileClosedEvent(str(tarball)))
+    watcher.submit_ready()
+    assert len(jobs.submitted) == 2
+
+    _write(changed, size=200)
+    watcher = TarballWatcher(directory)
+    for tarball in (unchanged, changed):
+        watcher.on_any_event(FileClosedEvent(str(tarball)))
+    watcher.submit_ready()
+    assert sorted(jobs.tarballs()) == ["a.tar.gz", "b.tar.gz", "b.tar.gz"]
+
+
+def test_tarballs_wait_for_pending_jobs(
+    jobs: _Jobs, directory: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(watch, "MAX_PENDING_JOBS", 1)
+    watcher = TarballWatcher(directory)
+    for name in ("a.tar.gz", "b.tar.gz"):
+        watcher.on_any_event(FileClosedEvent(str(_write(directory / name))))
+    watcher.submit_ready()
+    [job] = jobs.submitted.values()
+
+    watcher.submit_ready()
+    assert len(jobs.submitted) == 1
+    job.state = JobState.COMPLETED
+    watcher.submit_ready()
+    assert sorted(jobs.tarballs()) == ["a.tar.gz", "b.tar.gz"]
@@ -0,0 +1,142 @@
+"""Check of the analysis of a synthetic upload split between several local workers.
+
+The upload is ingested, its analyses are cleared and queued again, and the result of
+the workers must be the same as that of the ingestion. With --kill, a worker is
+killed while it runs a task, which another worker takes over once its lease expires.
+
+Usage: python -m tests.workers --workers 4 --nodes 32 --kill
+"""
+
+import argparse
+import json
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+from ddcheck.analysis.registry import get_analysers
+from ddcheck.jobs import (
+    FINISHED_STATES,
+    LEASE_SECONDS,
+    TASKS_DIRECTORY,
+    WORKERS_DIRECTORY,
+    get_job,
+    submit_analysis,
+)
+from ddcheck.storage import DdcheckMetadata
+from ddcheck.storage.list import get_uploaded_metadata, invalidate_cached_metadata
+from ddcheck.storage.series import Columns
+from ddcheck.storage.upload import (
+    delete_upload,
+    ingest_tarball,
+    write_metadata_to_disk,
+)
+from tests.synthetic import write_synthetic_tarball
+
+
+def snapshot(metadata: DdcheckMetadata) -> tuple[dict, dict[str, np.ndarray]]:
+    """Returns what the analyses produced, but spans and version, and the series."""
+    # Copied, as the analyses are cleared afterwards
+    data = json.loads(json.dumps(metadata.to_dict()))
+    del data["spans"]
+    del data["version"]
+    data["insights"] = sorted(json.dumps(insight) for insight in data["insights"])
+    series = {}
+    for attribute in metadata.SERIES_ATTRIBUTES:
+        values = getattr(metadata, attribute)
+        for node in values:
+            value = values[node]
+            series[f"{attribute}/{node}"] = (
+                value.array if isinstance(value, Columns) else value
+            )
+    return data, series
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--processes", type=int, default=1)
+    parser.add_argument("--nodes", type=int, default=32)
+    parser.add_argument("--samples", type=int, default=2880)
+    parser.add_argument("--kill", action="store_true")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        tarball = Path(directory) / "synthetic.tar.gz"
+        write_synthetic_tarball(tarball, args.nodes, args.samples)
+        with open(tarball, "rb") as f:
+            metadata = ingest_tarball(f, tarball.name)
+    assert metadata is not None
+    expected = snapshot(metadata)
+    for node in metadata.nodes:
+        for analyser in get_analysers():
+            metadata.clear_analysis(node, analyser.source, analyser.produces)
+    write_metadata_to_disk(metadata)
+
+    workers = [
+        subprocess.Popen(
+            [sys.executable, "-m", "ddcheck.jobs", "--processes", str(args.processes)],
+            start_new_session=True,
+        )
+        for _ in range(args.workers)
+    ]
+    pids = {worker.pid: worker for worker in workers}
+    killed = None
+    try:
+        while len([*WORKERS_DIRECTORY.glob("*.heartbeat")]) < args.workers:
+            time.sleep(0.1)
+        start = time.perf_counter()
+        job = submit_analysis(metadata.ddcheck_id)
+        while job.state not in FINISHED_STATES:
+            if args.kill and killed is None:
+                for lease in TASKS_DIRECTORY.glob("*.lease"):
+                    pid = int(lease.read_text().rsplit("-", 1)[1])
+                    if pid in pids:
+                        # With its processes, so that the task is left unfinished
+                        os.killpg(pid, signal.SIGKILL)
+                        killed = pid
+                        print(
+                            f"Killed worker {pid} running {lease.stem}, "
+                            f"taken over in {LEASE_SECONDS}s"
+                        )
+                        break
+            time.sleep(0.1)
+            current = get_job(job.job_id)
+            assert current is not None
+            job = current
+        elapsed = time.perf_counter() - start
+    finally:
+        for worker in workers:
+            if worker.pid != killed:
+                worker.terminate()
+            worker.wait()
+
+    tasks = len(metadata.nodes) * len(get_analysers())
+    print(
+        f"{job.state.to_str()}: {tasks} tasks in {elapsed:.2f}s with "
+        f"{args.workers} workers of {args.processes} processes"
+    )
+    invalidate_cached_metadata(metadata.ddcheck_id)
+    analysed = get_uploaded_metadata(metadata.ddcheck_id)
+    assert analysed is not None
+    data, series = snapshot(analysed)
+    differences = [key for key in expected[0] if expected[0][key] != data.get(key)]
+    differences += [
+        key
+        for key in expected[1]
+        if key not in series or not np.array_equal(expected[1][key], series[key])
+    ]
+    delete_upload(metadata.ddcheck_id)
+    if differences:
+        print(f"Different from the ingestion: {differences}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())